@@ -1,62 +1,812 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form
-from app.config import settings  # <--- ADD THIS IMPORT
-import shutil
+import asyncio
+import functools
+import io
+import json
 import os
-import uuid
-from app.services.ai_engine import AIEngine
-from app.core.image_proc import MagazineEnhancer
-from app.services.gcs import GCSService
+import re
+import secrets
+import threading
+import time
+import zipfile
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Form, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+
+from app.config import settings
+from app.core import metrics
+from app.core.codecs import OutputFormat, image_size, output_format, sniff_format
+from app.services.ai_engine import DEFAULT_PRESET, PRESETS, AIEngine
+from app.services.admission import AdmissionController, AdmissionRejected, default_budget, request_cost
+from app.services.autotune import hardware_fingerprint, load_tuning
+from app.services.backends import UnknownBackendError, backend_config
+from app.services.batch import BatchTooLargeError, ZipStream, archive_pages, run_batch, upload_page
+from app.services.cache import ResultCache
+from app.services.gcs import FilesystemStore, GCSService
+from app.services.jobs import JobManager, JobStatus, QueueFullError
+from app.services.latency import LatencyModel
+from app.services.memory import process_rss
+from app.services.pipeline import EnhancePipeline, LocalRenderer
+from app.services.preview import PreviewEngine, PreviewLane
+from app.services.profiling import Profiler, ProfilerBusyError
+from app.services.singleflight import SingleFlight
+from app.services.threads import plan_layout
+from app.services.workers import WorkerPool
 
 router = APIRouter()
 
-# Initialize services ONCE at startup to save time
-ai = AIEngine()
-gcs = GCSService()
+# Services are built ONCE by startup(), called from the app's startup hook.
+# Nothing heavy happens at import time, so importing this module (e.g. from a
+# spawned worker re-importing the main module) never loads models or starts processes.
+# The models themselves load in the background; `renderer.ready` says when they're warm.
+renderer = None
+gcs = None
+jobs = None
+cache = None
+pipeline = None
+in_flight = None
+profiler = None
+admission = None
+latency = None
+latency_file = None
+previews = None
+
+
+def startup(renderer_override=None, gcs_override=None, preview_override=None):
+    """
+    Builds every service. Tests pass their own renderer / GCS / preview engine stand-ins.
+    """
+    global renderer, gcs, jobs, cache, pipeline, in_flight, admission, latency, latency_file, profiler, previews
+
+    warmup_sizes = [int(side) for side in settings.WARMUP_SIZES.split(",") if side.strip()]
+
+    if renderer_override is not None:
+        renderer = renderer_override
+    elif settings.INFERENCE_PROCESSES > 0:
+        # Models live in pre-forked worker processes; this process only dispatches
+        renderer = WorkerPool(
+            settings.INFERENCE_PROCESSES,
+            threads_per_worker=settings.INFERENCE_THREADS_PER_WORKER,
+            pin_cpus=settings.INFERENCE_PIN_CPUS,
+            slots_per_worker=settings.INFERENCE_SLOTS_PER_WORKER,
+            task_timeout=settings.INFERENCE_TASK_TIMEOUT_SECONDS,
+            warmup_sizes=warmup_sizes,
+            cores=settings.INFERENCE_CORES,
+            interop_threads=settings.INFERENCE_INTEROP_THREADS,
+            opencv_threads=settings.OPENCV_THREADS,
+        )
+    else:
+        # The job threads' renders share this process's cores
+        layout = plan_layout(
+            1, settings.ENHANCE_WORKERS, cores=settings.INFERENCE_CORES,
+            intra_op=settings.INFERENCE_THREADS_PER_WORKER, inter_op=settings.INFERENCE_INTEROP_THREADS,
+            opencv=settings.OPENCV_THREADS,
+        )
+        # Returns at once: the engine is built and warmed up on a background thread
+        renderer = LocalRenderer(load=AIEngine, warmup_sizes=warmup_sizes, layout=layout)
+    if gcs_override is not None:
+        gcs = gcs_override
+    else:
+        gcs = GCSService(
+            store=FilesystemStore(settings.GCS_LOCAL_DIR) if settings.GCS_LOCAL_DIR else None,
+            spool_dir=settings.GCS_SPOOL_DIR,
+            workers=settings.GCS_UPLOAD_WORKERS,
+            attempts=settings.GCS_UPLOAD_ATTEMPTS,
+            backoff=settings.GCS_RETRY_BACKOFF_SECONDS,
+            spool_attempts=settings.GCS_SPOOL_MAX_ATTEMPTS,
+        )
+    jobs = JobManager(
+        # One job thread per inference slot so every worker can be kept busy
+        max_workers=max(settings.ENHANCE_WORKERS, getattr(renderer, "capacity", 0)),
+        max_pending=settings.ENHANCE_MAX_PENDING,
+        ttl=settings.JOB_TTL_SECONDS,
+        max_retained=settings.JOB_MAX_RETAINED,
+        max_result_bytes=settings.JOB_RESULT_MEMORY_BYTES,
+        aging=settings.JOB_AGING,
+    )
+
+    cache = None
+    if settings.CACHE_ENABLED:
+        cache = ResultCache(
+            settings.CACHE_DIR,
+            max_disk_bytes=settings.CACHE_DISK_BYTES,
+            max_memory_bytes=settings.CACHE_MEMORY_BYTES,
+        )
+    # Idle until an admin arms it; then the next renders are profiled
+    profiler = Profiler(settings.PROFILE_DIR)
+    pipeline = EnhancePipeline(renderer, gcs, cache=cache, profiler=profiler)
+    if cache is not None and isinstance(renderer, WorkerPool):
+        # Hash the checkpoints now rather than on the first request, without holding up
+        # startup (LocalRenderer does this itself once its models are loaded)
+        threading.Thread(target=renderer.fingerprint, name="hash-weights", daemon=True).start()
+
+    # Identical uploads that arrive while the first one is still running share its job
+    in_flight = SingleFlight()
+
+    # Renders reserve their estimated peak memory; past the budget requests wait, then are shed
+    admission = AdmissionController(
+        default_budget(),
+        max_wait=settings.ADMISSION_MAX_WAIT_SECONDS,
+        max_queue=settings.ADMISSION_MAX_QUEUE,
+        retry_after=settings.ADMISSION_RETRY_AFTER_SECONDS,
+    )
+
+    # Predicts each job's render time from what past renders took; the job queue runs
+    # the shortest predicted job first
+    latency = LatencyModel(assumed_faces=settings.ADMISSION_ASSUMED_FACES)
+    # A stand-in renderer's timings say nothing about this host, so they are never kept
+    latency_file = settings.LATENCY_MODEL_FILE if renderer_override is None else ""
+    if latency_file:
+        latency.load(latency_file)
+
+    # Low-resolution previews render on their own thread, next to the job threads
+    previews = None
+    if preview_override is not None:
+        previews = PreviewLane(lambda: preview_override, max_pending=settings.PREVIEW_MAX_PENDING)
+    elif settings.PREVIEW_ENABLED and renderer_override is None:
+        preview_layout = None
+        if isinstance(renderer, WorkerPool):
+            # This process only renders previews; keep them off most of the workers' cores
+            preview_layout = plan_layout(1, 1, intra_op=settings.PREVIEW_THREADS, opencv=settings.PREVIEW_THREADS)
+        previews = PreviewLane(
+            functools.partial(PreviewEngine, max_side=settings.PREVIEW_MAX_SIDE, quality=settings.PREVIEW_QUALITY),
+            max_pending=settings.PREVIEW_MAX_PENDING,
+            layout=preview_layout,
+        )
+
+    _register_gauges()
+
+
+def _register_gauges():
+    """
+    Gauges for /metrics, read from the services when scraped.
+    """
+    def torch_threads():
+        import torch
+        threads = {("api",): torch.get_num_threads()}
+        if isinstance(renderer, WorkerPool):
+            threads[("worker",)] = renderer.threads_per_worker
+        return threads
+
+    def worker_rss():
+        if not isinstance(renderer, WorkerPool):
+            return None
+        return {(str(pid),): process_rss(pid) for pid in renderer.worker_pids()}
+
+    for gauge in (
+        metrics.Gauge("enhance_queue_depth", "Jobs waiting for a job thread.", lambda: jobs.stats()["queued"]),
+        metrics.Gauge("enhance_jobs_in_flight", "Jobs being rendered.", lambda: jobs.stats()["running"]),
+        metrics.Gauge("enhance_admission_waiting", "Requests waiting for memory to be admitted.",
+                      lambda: admission.stats()["queued"]),
+        metrics.Gauge("enhance_admission_reserved_bytes", "Estimated peak memory reserved by admitted renders.",
+                      lambda: admission.stats()["in_flight_bytes"]),
+        metrics.Gauge("enhance_upload_spool_pending", "Results spooled for upload and not yet stored.",
+                      lambda: gcs.spool.pending() if gcs.spool is not None else None),
+        metrics.Gauge("enhance_api_rss_bytes", "Resident memory of the API process.", lambda: process_rss(os.getpid())),
+        metrics.Gauge("enhance_worker_rss_bytes", "Resident memory of each inference worker.", worker_rss, ["pid"]),
+        metrics.Gauge("enhance_torch_threads", "torch intra-op threads, in the API process and per worker.",
+                      torch_threads, ["process"]),
+    ):
+        metrics.REGISTRY.register(gauge)
+
+
+# Result fields that stay server-side; clients fetch the image via /result
+_PRIVATE_RESULT_KEYS = ("image", "media_type", "cache_key")
+
+
+def readiness() -> dict:
+    """
+    Readiness payload: models loaded and warmed up, on which device, and how long that took.
+    """
+    if renderer is None:
+        return {"ready": False, "mode": None, "device": None}
+    return renderer.readiness()
+
+
+def shutdown():
+    if jobs is not None:
+        jobs.shutdown(wait=False)
+    if previews is not None:
+        previews.shutdown(wait=False)
+    if latency is not None and latency.observations and latency_file:
+        try:
+            latency.save(latency_file)
+        except OSError as e:
+            print(f"⚠️ Could not save latency model: {e}")
+    if gcs is not None:
+        # Spooled uploads that don't finish now are resumed at the next start
+        gcs.shutdown(timeout=5.0)
+    if hasattr(renderer, "shutdown"):
+        renderer.shutdown()
+
+
+def _job_payload(job):
+    payload = job.to_dict()
+    if job.result is not None:
+        payload["result"] = {k: v for k, v in job.result.items() if k not in _PRIVATE_RESULT_KEYS}
+    payload["status_url"] = f"/api/v1/jobs/{job.id}"
+    payload["result_url"] = f"/api/v1/jobs/{job.id}/result"
+    preview = previews.get(job.id) if previews is not None else None
+    if preview is not None:
+        payload["preview"] = preview.to_dict()
+        payload["preview_url"] = f"/api/v1/jobs/{job.id}/preview"
+    return payload
+
+
+def _require_ready():
+    if not renderer.ready:
+        status = renderer.readiness()
+        detail = f"Models failed to load: {status['error']}" if status.get("error") else "Models are still loading"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "10"})
+
+
+def _check_preset(preset: str):
+    if preset not in PRESETS:
+        raise HTTPException(status_code=400, detail=f"Unknown preset '{preset}' (choose from {', '.join(PRESETS)})")
+
+
+def _resolve_backend(choice: Optional[str]) -> Optional[str]:
+    """
+    The restoration backend for a `backend` form value (a backend name or a
+    quality tier), None for the default one; 400 when it is unknown.
+    """
+    try:
+        return backend_config().resolve(choice)
+    except UnknownBackendError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _error_reason(status: int) -> str:
+    # enhance_errors_total label for a request turned away with `status`
+    return {413: "too_large", 503: "not_ready"}.get(status, "invalid" if status < 500 else "internal")
+
+
+# Uploads are copied into memory this much at a time, so an oversized one is cut off early
+_UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+
+async def _read_upload(file: UploadFile) -> bytes:
+    """
+    The upload's bytes, read in chunks; 413 as soon as it passes MAX_UPLOAD_BYTES.
+    """
+    limit = settings.MAX_UPLOAD_BYTES
+    if (getattr(file, "size", None) or 0) > limit:
+        raise HTTPException(status_code=413, detail=f"Upload is larger than {limit} bytes")
+    started = time.perf_counter()
+    chunks, size = [], 0
+    while True:
+        chunk = await file.read(_UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            metrics.STAGE_SECONDS.observe(time.perf_counter() - started, "upload_spool")
+            return b"".join(chunks)
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=f"Upload is larger than {limit} bytes")
+        chunks.append(chunk)
+
+
+def _admission_error(data: bytes) -> Optional[Tuple[int, str]]:
+    """
+    (status, reason) when an upload must be turned away before decoding: too
+    many bytes, not an image, or a header declaring more than MAX_INPUT_PIXELS.
+    """
+    if len(data) > settings.MAX_UPLOAD_BYTES:
+        return 413, f"Upload is larger than {settings.MAX_UPLOAD_BYTES} bytes"
+    if sniff_format(data) is None:
+        return 400, "Upload is not a supported image (JPEG, PNG, WebP, BMP or TIFF)"
+    size = image_size(data)
+    if size is not None and size[0] * size[1] > settings.MAX_INPUT_PIXELS:
+        return 413, f"Image is {size[1]}x{size[0]}; the limit is {settings.MAX_INPUT_PIXELS / 1e6:g} megapixels"
+    return None
+
+
+def _output_format(filename: str, codec: Optional[str], quality: Optional[int], progressive: bool,
+                   png_compression: Optional[int]) -> OutputFormat:
+    try:
+        return output_format(filename, codec, quality, progressive, png_compression)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _admit(data: bytes, filename: str, bucket_original: str, bucket_enhanced: str, preset: str,
+                 fmt: OutputFormat, backend: Optional[str] = None):
+    """
+    Returns the Job for one upload: already done when the result cache has it,
+    an identical job that is still running, or a newly queued one.
+    Raises QueueFullError when a new job is needed and the queue is full, and
+    AdmissionRejected when its memory could not be reserved in time.
+    """
+    # Repeated uploads are answered from the result cache without touching the models
+    key = await run_in_threadpool(pipeline.cache_key, data, filename, preset, fmt, backend)
+    hit = None
+    if cache is not None:
+        hit = await run_in_threadpool(pipeline.lookup, key, data, filename, bucket_original, bucket_enhanced, fmt)
+    if hit is not None:
+        return jobs.complete(hit)
+
+    # An identical job that is already running adds no render work, so it is
+    # shared without reserving memory
+    flight_key = f"{key}:{bucket_original}:{bucket_enhanced}"
+    job = in_flight.join(flight_key)
+    if job is not None:
+        return job
+
+    # Otherwise reserve its memory, then hand the heavy lifting to the worker pool
+    # (unless an identical job started while this one waited for memory)
+    size = image_size(data)
+    cost = await admission.acquire(request_cost(size, preset, settings.ADMISSION_ASSUMED_FACES))
+    try:
+        job, shared = in_flight.do(
+            flight_key,
+            lambda: jobs.submit(
+                pipeline.run, data, filename, bucket_original, bucket_enhanced, key=key, preset=preset, fmt=fmt,
+                backend=backend, estimated_ms=round(latency.predict(size, preset, backend=backend), 1),
+            ),
+        )
+    except BaseException:
+        admission.release(cost)
+        raise
+    if shared:
+        admission.release(cost)
+    else:
+        job.future.add_done_callback(lambda _: admission.release(cost))
+        job.future.add_done_callback(lambda future: _job_finished(future, size, preset, backend))
+    return job
 
-TEMP_DIR = "temp_uploads"
-os.makedirs(TEMP_DIR, exist_ok=True)
 
-@router.post("/enhance")
+def _job_finished(future, size: Optional[Tuple[int, int]], preset: str, backend: Optional[str] = None):
+    if future.exception() is not None:
+        metrics.ERRORS.inc("render")
+        return
+    result = future.result()
+    if not result["cached"]:
+        latency.observe(size, preset, result["faces"], result["timings_ms"], backend=backend)
+
+
+def _estimate_headers(job) -> dict:
+    # Predicted render time, for clients choosing how long to wait before polling
+    return {"X-Estimated-Ms": f"{job.estimated_ms:.0f}"} if job.estimated_ms is not None else {}
+
+
+async def _result_image(job) -> Optional[bytes]:
+    image = job.result["image"]
+    if image is None and cache is not None:
+        # Evicted from the job to save memory; the result cache still has it
+        entry = await run_in_threadpool(cache.get, job.result["cache_key"])
+        image = entry[0] if entry is not None else None
+    return image
+
+
+@router.post("/enhance", status_code=202)
 async def enhance_image(
     file: UploadFile = File(...),
     bucket_original: str = Form(settings.GCS_BUCKET_ORIGINAL), # Default or from App
-    bucket_enhanced: str = Form(settings.GCS_BUCKET_ENHANCED)
+    bucket_enhanced: str = Form(settings.GCS_BUCKET_ENHANCED),
+    wait: bool = Form(False), # Legacy clients: hold the connection until the job is done
+    preset: str = Form(DEFAULT_PRESET), # full, faces_only, background_only or fast
+    stream: bool = Form(False), # Hold the connection and answer with the image itself
+    codec: Optional[str] = Form(None), # jpeg, webp or png (default: the upload's format)
+    quality: Optional[int] = Form(None), # JPEG / WebP quality, 1-100
+    progressive: bool = Form(False), # progressive JPEG
+    png_compression: Optional[int] = Form(None), # PNG zlib level, 0-9
+    preview: bool = Form(False), # Also render a quick low-resolution preview, at /jobs/{id}/preview
+    backend: Optional[str] = Form(None), # Restoration backend or quality tier (see /backends)
 ):
+    metrics.REQUESTS.inc("enhance")
     try:
-        # 1. Save uploaded file locally first
-        unique_name = f"{uuid.uuid4()}_{file.filename}"
-        input_path = os.path.join(TEMP_DIR, unique_name)
-        
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        # 2. (Optional) Upload Original to GCS Bucket 1
-        original_url = gcs.upload_file(input_path, bucket_original, folder="originals")
-
-        # 3. Run AI Pipeline (Face Restore + Upscale)
-        ai_output_path = os.path.join(TEMP_DIR, f"ai_{unique_name}")
-        ai.enhance(input_path, ai_output_path)
-
-        # 4. Run Magazine Post-Processing (Color/Light)
-        final_output_path = os.path.join(TEMP_DIR, f"final_{unique_name}")
-        MagazineEnhancer.apply_magazine_look(ai_output_path, final_output_path)
-
-        # 5. Upload Result to GCS Bucket 2
-        enhanced_url = gcs.upload_file(final_output_path, bucket_enhanced, folder="enhanced")
-
-        # 6. Cleanup local files
-        # os.remove(input_path)
-        # os.remove(ai_output_path)
-        # os.remove(final_output_path)
-
-        return {
-            "status": "success",
-            "original_url": original_url,
-            "enhanced_url": enhanced_url,
-            "message": "Image processed with Magazine-Grade pipeline"
-        }
+        _require_ready()
+        _check_preset(preset)
+        backend = _resolve_backend(backend)
+        fmt = _output_format(file.filename, codec, quality, progressive, png_compression)
+
+        # 1. Keep the upload in memory, nothing touches disk; size and header are
+        #    checked before anything is decoded
+        data = await _read_upload(file)
+        error = _admission_error(data)
+        if error is not None:
+            raise HTTPException(status_code=error[0], detail=error[1])
 
+        # 2. Cached, already running, or queued; either way return immediately
+        job = await _admit(data, file.filename, bucket_original, bucket_enhanced, preset, fmt, backend)
+    except HTTPException as e:
+        metrics.ERRORS.inc(_error_reason(e.status_code))
+        raise
+    except AdmissionRejected as e:
+        metrics.ERRORS.inc("shed")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except QueueFullError as e:
+        metrics.ERRORS.inc("shed")
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         import traceback
         traceback.print_exc()
+        metrics.ERRORS.inc("internal")
         raise HTTPException(status_code=500, detail=str(e))
+
+    if not wait and not stream:
+        if preview and previews is not None:
+            previews.submit(job, data)
+        return JSONResponse(_job_payload(job), status_code=202, headers=_estimate_headers(job))
+
+    try:
+        result = await asyncio.wrap_future(job.future)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if stream:
+        return await _image_response(job)
+
+    # Legacy synchronous contract: 200 with the URLs, like before jobs existed
+    return JSONResponse({
+        "status": "success",
+        "job_id": job.id,
+        "original_url": result["original_url"],
+        "enhanced_url": result["enhanced_url"],
+        "cached": result["cached"],
+        "preset": preset,
+        "backend": result.get("backend"),
+        "timings_ms": result["timings_ms"],
+        "message": "Image processed with Magazine-Grade pipeline"
+    }, headers=_estimate_headers(job))
+
+
+# Streamed image bodies go out in chunks of this size
+_STREAM_CHUNK_BYTES = 256 * 1024
+
+# Replaced in the plain `filename` of a Content-Disposition header
+_UNSAFE_FILENAME_CHARS = re.compile(r"[^A-Za-z0-9._ -]")
+
+
+def _content_disposition(disposition: str, filename: str) -> str:
+    """
+    `disposition` with the client-supplied `filename`: an ASCII-only fallback
+    for old clients plus the exact name as RFC 5987 `filename*`, so quotes,
+    semicolons or non-latin-1 characters cannot break the header.
+    """
+    fallback = _UNSAFE_FILENAME_CHARS.sub("_", filename).strip() or "image"
+    return f"{disposition}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+async def _image_response(job) -> StreamingResponse:
+    """
+    The finished job's image as the response body, with its URLs and stage
+    timings in headers, so the client needs no second request.
+    """
+    image = await _result_image(job)
+    if image is None:
+        raise HTTPException(status_code=410, detail="Result image has expired; submit the image again")
+    result = job.result
+    headers = {
+        "Content-Length": str(len(image)),
+        "Content-Disposition": _content_disposition("inline", result["enhanced_filename"]),
+        "X-Job-Id": job.id,
+        "X-Cache": "hit" if result["cached"] else "miss",
+        **_estimate_headers(job),
+    }
+    if result.get("enhanced_url"):
+        headers["X-Enhanced-Url"] = result["enhanced_url"]
+    if result.get("timings_ms"):
+        headers["Server-Timing"] = ", ".join(f"{name};dur={ms}" for name, ms in result["timings_ms"].items())
+
+    def chunks():
+        view = memoryview(image)
+        for start in range(0, len(view), _STREAM_CHUNK_BYTES):
+            yield view[start:start + _STREAM_CHUNK_BYTES]
+
+    return StreamingResponse(chunks(), media_type=result["media_type"], headers=headers)
+
+
+@router.post("/enhance/batch")
+async def enhance_batch(
+    files: List[UploadFile] = File(None),
+    archive: Optional[UploadFile] = File(None), # Or one zip holding every page
+    bucket_original: str = Form(settings.GCS_BUCKET_ORIGINAL),
+    bucket_enhanced: str = Form(settings.GCS_BUCKET_ENHANCED),
+    preset: str = Form(DEFAULT_PRESET),
+    response_format: str = Form("ndjson"), # ndjson: one JSON line per page; zip: the images
+    codec: Optional[str] = Form(None), # Same output options as /enhance, for every page
+    quality: Optional[int] = Form(None),
+    progressive: bool = Form(False),
+    png_compression: Optional[int] = Form(None),
+    backend: Optional[str] = Form(None), # Restoration backend or quality tier, for every page
+):
+    """
+    Enhances many pages in one request. Each page becomes a regular job (so
+    the result cache and /jobs/{id} work as usual) and results stream back
+    as pages finish, not after the whole batch.
+    """
+    _require_ready()
+    _check_preset(preset)
+    backend = _resolve_backend(backend)
+    if response_format not in ("ndjson", "zip"):
+        raise HTTPException(status_code=400, detail="response_format must be 'ndjson' or 'zip'")
+    if codec:
+        _output_format("", codec, quality, progressive, png_compression)
+
+    def admit(data: bytes, filename: str):
+        metrics.REQUESTS.inc("batch")
+        error = _admission_error(data)
+        if error is not None:
+            metrics.ERRORS.inc(_error_reason(error[0]))
+            raise ValueError(error[1])
+        # Without a codec each page keeps its own format, so its options are checked per page
+        fmt = output_format(filename, codec, quality, progressive, png_compression)
+        return _admit(data, filename, bucket_original, bucket_enhanced, preset, fmt, backend)
+
+    uploads = [f for f in files or [] if f is not None]
+    if archive is None and not uploads:
+        raise HTTPException(status_code=400, detail="Send the pages as `files` or as a zip `archive`")
+    if len(uploads) > settings.BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"Batch has {len(uploads)} files; the limit is {settings.BATCH_MAX_FILES}")
+
+    pages = []
+    if archive is not None:
+        try:
+            pages = await run_in_threadpool(archive_pages, archive.file, settings.BATCH_MAX_FILES - len(uploads))
+        except zipfile.BadZipFile:
+            raise HTTPException(status_code=400, detail="archive is not a zip file")
+        except BatchTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+    # Pages are read while the response streams, after the framework has closed the
+    # request's upload files, so the stream takes them over and closes them itself
+    owned = [_detach_file(upload) for upload in [*uploads, archive] if upload is not None]
+    pages = [upload_page(upload.filename, fileobj) for upload, fileobj in zip(uploads, owned)] + pages
+
+    window = settings.BATCH_WINDOW or 2 * jobs.max_workers
+    results = run_batch(pages, admit, window)
+    if response_format == "zip":
+        return StreamingResponse(
+            _closing(_zip_lines(results), owned), media_type="application/zip",
+            headers={"Content-Disposition": 'attachment; filename="enhanced.zip"'},
+        )
+    return StreamingResponse(_closing(_ndjson_lines(results), owned), media_type="application/x-ndjson")
+
+
+def _detach_file(upload: UploadFile):
+    fileobj, upload.file = upload.file, io.BytesIO()
+    return fileobj
+
+
+async def _closing(chunks, fileobjs):
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        for fileobj in fileobjs:
+            fileobj.close()
+
+
+def _page_record(index: int, filename: str, job, error: Optional[str]) -> dict:
+    if job is None:
+        return {"index": index, "filename": filename, "status": "failed", "error": error}
+    return {"index": index, "filename": filename, **_job_payload(job)}
+
+
+def _batch_summary(records: List[dict]) -> dict:
+    done = sum(1 for record in records if record["status"] == "done")
+    return {"summary": {"pages": len(records), "done": done, "failed": len(records) - done}}
+
+
+async def _ndjson_lines(results):
+    records = []
+    async for index, filename, job, error in results:
+        record = _page_record(index, filename, job, error)
+        records.append(record)
+        yield json.dumps(record) + "\n"
+    yield json.dumps(_batch_summary(records)) + "\n"
+
+
+async def _zip_lines(results):
+    """
+    Streams a zip of the enhanced pages, each written as soon as it finishes,
+    followed by manifest.ndjson with every page's record (failures included).
+    """
+    stream = ZipStream()
+    records = []
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as bundle:
+        async for index, filename, job, error in results:
+            record = _page_record(index, filename, job, error)
+            if record["status"] == "done":
+                image = await _result_image(job)
+                if image is None:
+                    record.update(status="failed", error="Result image has expired")
+                else:
+                    record["entry"] = f"{index:04d}_{job.result['enhanced_filename']}"
+                    bundle.writestr(record["entry"], image)
+            records.append(record)
+            chunk = stream.drain()
+            if chunk:
+                yield chunk
+        manifest = "".join(json.dumps(record) + "\n" for record in records + [_batch_summary(records)])
+        bundle.writestr("manifest.ndjson", manifest)
+    yield stream.drain()
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _job_payload(job)
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status != JobStatus.DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job.status.value}")
+    image = await _result_image(job)
+    if image is None:
+        raise HTTPException(status_code=410, detail="Result image has expired; submit the image again")
+    return Response(content=image, media_type=job.result["media_type"])
+
+
+@router.get("/jobs/{job_id}/preview")
+async def get_job_preview(job_id: str):
+    """
+    The best image the job has so far: the full result once it is done,
+    until then the low-resolution preview (X-Preview: preview). 202 while
+    the preview is still rendering.
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status == JobStatus.FAILED:
+        raise HTTPException(status_code=500, detail=job.error)
+    if job.status == JobStatus.DONE:
+        image = await _result_image(job)
+        if image is None:
+            raise HTTPException(status_code=410, detail="Result image has expired; submit the image again")
+        return Response(content=image, media_type=job.result["media_type"], headers={"X-Preview": "final"})
+
+    preview = previews.get(job.id) if previews is not None else None
+    if preview is None:
+        raise HTTPException(status_code=404, detail="No preview for this job; wait for its result")
+    if preview.status == "ready":
+        return Response(content=preview.image, media_type=preview.media_type,
+                        headers={"X-Preview": "preview", "Cache-Control": "no-store"})
+    if preview.status != "pending":
+        raise HTTPException(status_code=404, detail=f"Preview {preview.status}; wait for the job's result")
+    return JSONResponse(_job_payload(job), status_code=202, headers={"Retry-After": "1"})
+
+
+@router.get("/stats")
+async def get_stats():
+    return {
+        "jobs": jobs.stats(),
+        "renderer": renderer.stats(),
+        "cache": cache.stats() if cache is not None else None,
+        "single_flight": in_flight.stats(),
+        "admission": admission.stats(),
+        "latency": latency.stats(),
+        "preview": previews.stats() if previews is not None else None,
+        "backends": _backend_stats(),
+        "uploads": gcs.stats(),
+    }
+
+
+def _backend_stats() -> dict:
+    # Renders and render time per backend, as finished jobs reported them
+    stats = {}
+    for name in backend_config().backends:
+        renders = metrics.BACKEND_SECONDS.count(name)
+        seconds = metrics.BACKEND_SECONDS.total(name)
+        stats[name] = {
+            "renders": renders,
+            "seconds_total": round(seconds, 3),
+            "mean_ms": round(1000 * seconds / renders, 1) if renders else None,
+        }
+    return stats
+
+
+@router.get("/backends")
+async def get_backends():
+    """
+    The restoration backends a request may pick with `backend`, by name or
+    quality tier, and which one it gets by default.
+    """
+    return await run_in_threadpool(backend_config().to_dict)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Prometheus text exposition: stage histograms, request / error / cache / downscale counters, and gauges.
+    """
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def _require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, settings.ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Missing or wrong X-Admin-Token")
+
+
+@router.get("/admin/tiles", dependencies=[Depends(_require_admin)])
+async def get_tile_tuning():
+    """
+    The Real-ESRGAN tile size in use and the autotuner's benchmark for this hardware, if any.
+    """
+    # The fingerprint waits for the models (and may hash the checkpoints)
+    _require_ready()
+    fingerprint = await run_in_threadpool(renderer.fingerprint)
+    threads = getattr(renderer, "threads_per_worker", None)
+    info = await run_in_threadpool(hardware_fingerprint, fingerprint.get("device", "cpu"), threads)
+    return {
+        "tile": fingerprint.get("tile"),
+        "tile_pad": fingerprint.get("tile_pad"),
+        "autotune": settings.TILE_AUTOTUNE,
+        "hardware": info,
+        "tuning": await run_in_threadpool(load_tuning, settings.TILE_TUNING_FILE, info),
+    }
+
+
+def _profile_payload(session: dict) -> dict:
+    session_id = session["session_id"]
+    return {
+        **session,
+        "status_url": f"/api/v1/admin/profile/{session_id}",
+        "download_url": f"/api/v1/admin/profile/{session_id}/download",
+    }
+
+
+@router.post("/admin/profile", status_code=202, dependencies=[Depends(_require_admin)])
+async def arm_profiling(
+    requests: int = Form(1), # Renders to profile, starting with the next one
+    shapes: bool = Form(True), # Record operator input shapes
+    memory: bool = Form(True), # Record tensor allocations
+    interval_ms: float = Form(5.0), # Python stack sampling interval
+):
+    """
+    Profiles the next `requests` renders with torch.profiler and a sampling
+    Python profiler. Cache hits are not rendered, so send fresh images.
+    """
+    if not 1 <= requests <= 100:
+        raise HTTPException(status_code=400, detail="requests must be between 1 and 100")
+    if interval_ms < 1:
+        raise HTTPException(status_code=400, detail="interval_ms must be at least 1")
+    try:
+        session = profiler.arm(requests, shapes=shapes, memory=memory, interval_ms=interval_ms)
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return _profile_payload(session)
+
+
+@router.get("/admin/profile/{session_id}", dependencies=[Depends(_require_admin)])
+async def get_profiling(session_id: str):
+    session = profiler.status(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Profiling session not found")
+    return _profile_payload(session)
+
+
+@router.delete("/admin/profile/{session_id}", dependencies=[Depends(_require_admin)])
+async def disarm_profiling(session_id: str):
+    """
+    Stops profiling further requests; what was captured stays downloadable.
+    """
+    session = profiler.disarm(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Profiling session not found")
+    return _profile_payload(session)
+
+
+@router.get("/admin/profile/{session_id}/download", dependencies=[Depends(_require_admin)])
+async def download_profiling(session_id: str):
+    """
+    A zip with one folder per profiled render: trace.json (Chrome trace),
+    stacks.collapsed (sampled Python stacks) and ops.txt (top torch operators).
+    """
+    if profiler.status(session_id) is None:
+        raise HTTPException(status_code=404, detail="Profiling session not found")
+    path = await run_in_threadpool(profiler.archive, session_id)
+    if path is None:
+        raise HTTPException(status_code=409, detail="No request has been profiled yet")
+    return FileResponse(path, media_type="application/zip", filename=os.path.basename(path))
@@ -6,6 +6,112 @@ class Settings(BaseSettings):
     PROJECT_NAME: str = "Magazine Enhancer"
     GCS_BUCKET_ORIGINAL: str = os.getenv("GCS_BUCKET_ORIGINAL", "photo_enhance")
     GCS_BUCKET_ENHANCED: str = os.getenv("GCS_BUCKET_ENHANCED", "photo_enhance")
+    # Uploads: originals upload on GCS_UPLOAD_WORKERS threads (one pooled HTTP session) while the
+    # image renders, retried GCS_UPLOAD_ATTEMPTS times; results go to a durable write-behind spool
+    # in GCS_SPOOL_DIR ("" = upload before answering) and are retried up to GCS_SPOOL_MAX_ATTEMPTS
+    # times, then parked in GCS_SPOOL_DIR/failed until the next start
+    GCS_UPLOAD_WORKERS: int = int(os.getenv("GCS_UPLOAD_WORKERS", "8"))
+    GCS_UPLOAD_ATTEMPTS: int = int(os.getenv("GCS_UPLOAD_ATTEMPTS", "3"))
+    GCS_RETRY_BACKOFF_SECONDS: float = float(os.getenv("GCS_RETRY_BACKOFF_SECONDS", "0.5"))  # doubles per retry
+    GCS_SPOOL_DIR: str = os.getenv("GCS_SPOOL_DIR", "gcs_spool")
+    GCS_SPOOL_MAX_ATTEMPTS: int = int(os.getenv("GCS_SPOOL_MAX_ATTEMPTS", "10"))
+    # Store objects under this directory instead of in GCS (a local stand-in for the buckets)
+    GCS_LOCAL_DIR: str = os.getenv("GCS_LOCAL_DIR", "")
+
+    # Job queue: inference runs on a bounded pool so the event loop never blocks
+    # Images in flight at once in the API process. Must be > 1 for tiles from different
+    # images to be batched together; face restoration still runs one image at a time.
+    ENHANCE_WORKERS: int = int(os.getenv("ENHANCE_WORKERS", "2"))
+    ENHANCE_MAX_PENDING: int = int(os.getenv("ENHANCE_MAX_PENDING", "32"))
+    JOB_TTL_SECONDS: float = float(os.getenv("JOB_TTL_SECONDS", "3600"))
+    JOB_MAX_RETAINED: int = int(os.getenv("JOB_MAX_RETAINED", "256"))
+    # Finished jobs keep their image in memory up to this many bytes in total; older
+    # images are then served from the result cache
+    JOB_RESULT_MEMORY_BYTES: int = int(os.getenv("JOB_RESULT_MEMORY_BYTES", str(128 * 1024 ** 2)))
+    # Waiting jobs run shortest predicted first; each ms spent waiting counts as this many ms
+    # less predicted work, so a long job is overtaken for at most (its estimate / JOB_AGING)
+    JOB_AGING: float = float(os.getenv("JOB_AGING", "1.0"))
+    # Per-stage latency model learned from finished renders, kept across restarts ("" = not saved)
+    LATENCY_MODEL_FILE: str = os.getenv("LATENCY_MODEL_FILE", "latency_model.json")
+    # Admission: checked on the upload bytes and the image header, before anything is decoded
+    MAX_UPLOAD_BYTES: int = int(os.getenv("MAX_UPLOAD_BYTES", str(64 * 1024 ** 2)))  # per file
+    MAX_INPUT_PIXELS: int = int(os.getenv("MAX_INPUT_PIXELS", str(150 * 1000 ** 2)))
+    # Decode large JPEGs straight to 1/2, 1/4 or 1/8 size when they'd be shrunk that far anyway
+    REDUCED_DECODE: bool = os.getenv("REDUCED_DECODE", "true").lower() == "true"
+    # Admission control: each render reserves its estimated peak memory from this budget
+    # (0 = half of this machine's RAM). Requests that don't fit wait up to
+    # ADMISSION_MAX_WAIT_SECONDS in a queue of at most ADMISSION_MAX_QUEUE, then get a 503.
+    ADMISSION_MEMORY_BYTES: int = int(os.getenv("ADMISSION_MEMORY_BYTES", "0"))
+    ADMISSION_MAX_WAIT_SECONDS: float = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "30"))
+    ADMISSION_MAX_QUEUE: int = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+    ADMISSION_ASSUMED_FACES: int = int(os.getenv("ADMISSION_ASSUMED_FACES", "1"))  # faces are only counted later
+    ADMISSION_RETRY_AFTER_SECONDS: int = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "15"))
+    # POST /enhance/batch: pages per request, and pages admitted at once (0 = 2 x job threads)
+    BATCH_MAX_FILES: int = int(os.getenv("BATCH_MAX_FILES", "500"))
+    BATCH_WINDOW: int = int(os.getenv("BATCH_WINDOW", "0"))
+
+    # POST /enhance with preview=true: a low-resolution render (SRVGGNetCompact + magazine look, no face
+    # restoration) served at /jobs/{id}/preview until the full result replaces it. Previews run on
+    # their own thread; past PREVIEW_MAX_PENDING queued ones, new previews are skipped.
+    PREVIEW_ENABLED: bool = os.getenv("PREVIEW_ENABLED", "true").lower() == "true"
+    PREVIEW_MAX_SIDE: int = int(os.getenv("PREVIEW_MAX_SIDE", "1024"))  # longest side of the preview
+    PREVIEW_QUALITY: int = int(os.getenv("PREVIEW_QUALITY", "80"))
+    PREVIEW_MAX_PENDING: int = int(os.getenv("PREVIEW_MAX_PENDING", "4"))
+    # torch / OpenCV threads of the API process when renders run in worker processes
+    # (INFERENCE_PROCESSES > 0) and it only renders previews
+    PREVIEW_THREADS: int = int(os.getenv("PREVIEW_THREADS", "1"))
+
+    # Sent as X-Admin-Token to the /admin/profile endpoints ("" = profiling disabled)
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    PROFILE_DIR: str = os.getenv("PROFILE_DIR", "profiles")  # torch / Python profiles of armed requests
+
+    # Pre-forked inference workers sharing one copy of the weights (0 = run models in the API process).
+    # Worker-pool mode is CPU-only: CUDA cannot be used in forked processes, so the
+    # workers always run on CPU even when a GPU is present. Leave this at 0 on GPU hosts.
+    INFERENCE_PROCESSES: int = int(os.getenv("INFERENCE_PROCESSES", "0"))
+    INFERENCE_THREADS_PER_WORKER: int = int(os.getenv("INFERENCE_THREADS_PER_WORKER", "0"))  # 0 = cores / workers
+    # CPU thread layout (app/services/threads.py); with INFERENCE_PROCESSES=0 the API process is
+    # the one worker and ENHANCE_WORKERS its images in flight. Cores are physical cores.
+    INFERENCE_CORES: int = int(os.getenv("INFERENCE_CORES", "0"))  # 0 = every core this process may use
+    INFERENCE_INTEROP_THREADS: int = int(os.getenv("INFERENCE_INTEROP_THREADS", "1"))  # torch inter-op, per worker
+    OPENCV_THREADS: int = int(os.getenv("OPENCV_THREADS", "0"))  # per worker; 0 = torch threads / images in flight
+    INFERENCE_PIN_CPUS: bool = os.getenv("INFERENCE_PIN_CPUS", "true").lower() == "true"
+    INFERENCE_SLOTS_PER_WORKER: int = int(os.getenv("INFERENCE_SLOTS_PER_WORKER", "2"))  # images in flight per worker
+    INFERENCE_TASK_TIMEOUT_SECONDS: float = float(os.getenv("INFERENCE_TASK_TIMEOUT_SECONDS", "600"))
+
+    # Models load in the background after the port is bound; /ready reports 200 only after
+    # a warm-up render of a synthetic page per size listed here ("" = no warm-up)
+    WARMUP_SIZES: str = os.getenv("WARMUP_SIZES", "256")
+
+    # Restoration backends (basicsr networks) requests choose from by name or quality tier, as a
+    # JSON file shaped like app/services/backends.py's DEFAULT_CONFIG ("" = the built-in ones)
+    BACKENDS_FILE: str = os.getenv("BACKENDS_FILE", "")
+
+    # Real-ESRGAN tiling: tiles from concurrent images are batched into one forward
+    TILE_SIZE: int = int(os.getenv("TILE_SIZE", "200"))  # 100 was too small/slow, 200 is balanced
+    TILE_PAD: int = int(os.getenv("TILE_PAD", "10"))
+    TILE_BATCH_SIZE: int = int(os.getenv("TILE_BATCH_SIZE", "4"))
+    TILE_BATCH_WAIT_MS: float = float(os.getenv("TILE_BATCH_WAIT_MS", "5"))
+    # Tile autotuning: "off" = always TILE_SIZE / TILE_PAD, "load" = use the winner stored for
+    # this hardware if there is one, "startup" = also benchmark at startup when there is none
+    TILE_AUTOTUNE: str = os.getenv("TILE_AUTOTUNE", "load").lower()
+    TILE_TUNING_FILE: str = os.getenv("TILE_TUNING_FILE", "tile_tuning.json")
+    TILE_AUTOTUNE_SIZES: str = os.getenv("TILE_AUTOTUNE_SIZES", "128,200,256,384")
+    TILE_AUTOTUNE_PADS: str = os.getenv("TILE_AUTOTUNE_PADS", "10,16")  # pads below TILE_PAD never win
+    TILE_AUTOTUNE_IMAGE_SIZE: int = int(os.getenv("TILE_AUTOTUNE_IMAGE_SIZE", "512"))
+
+    # Full-resolution processing: an image is only shrunk when its estimated peak memory
+    # (per image in flight, weights excluded) exceeds this. 0 = old fixed 1200px clamp.
+    IMAGE_MEMORY_BUDGET_BYTES: int = int(os.getenv("IMAGE_MEMORY_BUDGET_BYTES", str(2 * 1024 ** 3)))
+    # Outputs at least this large are written to an unlinked memory-mapped file here ("" = keep in RAM)
+    OUTPUT_MMAP_DIR: str = os.getenv("OUTPUT_MMAP_DIR", "")
+    OUTPUT_MMAP_MIN_BYTES: int = int(os.getenv("OUTPUT_MMAP_MIN_BYTES", str(64 * 1024 ** 2)))
+
+    # Content-addressed result cache (input bytes + pipeline config -> final output)
+    CACHE_ENABLED: bool = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+    CACHE_DIR: str = os.getenv("CACHE_DIR", "cache")
+    CACHE_DISK_BYTES: int = int(os.getenv("CACHE_DISK_BYTES", str(2 * 1024 ** 3)))
+    CACHE_MEMORY_BYTES: int = int(os.getenv("CACHE_MEMORY_BYTES", str(256 * 1024 ** 2)))
     
     class Config:
         env_file = ".env"
@@ -0,0 +1,221 @@
+import os
+import struct
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from basicsr.utils.img_util import imfrombytes
+
+# Extensions OpenCV can encode, mapped to the Content-Type we serve them with
+CONTENT_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".webp": "image/webp",
+    ".bmp": "image/bmp",
+    ".tif": "image/tiff",
+    ".tiff": "image/tiff",
+}
+DEFAULT_EXTENSION = ".jpg"
+
+# Codec names clients may ask for, mapped to the extension OpenCV encodes them by
+CODECS = {"jpeg": ".jpg", "jpg": ".jpg", "webp": ".webp", "png": ".png"}
+
+
+class OutputFormat(NamedTuple):
+    """
+    How the output is encoded. Options left as None keep OpenCV's defaults.
+    """
+    ext: str
+    quality: Optional[int] = None      # JPEG / WebP, 1-100
+    progressive: bool = False          # JPEG only
+    compression: Optional[int] = None  # PNG zlib level, 0-9
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES[self.ext]
+
+    def params(self) -> List[int]:
+        params = []
+        if self.quality is not None:
+            flag = cv2.IMWRITE_WEBP_QUALITY if self.ext == ".webp" else cv2.IMWRITE_JPEG_QUALITY
+            params += [flag, self.quality]
+        if self.progressive:
+            params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+        if self.compression is not None:
+            params += [cv2.IMWRITE_PNG_COMPRESSION, self.compression]
+        return params
+
+    def options(self) -> dict:
+        """
+        The encoder options that differ from the defaults (empty for a plain extension).
+        """
+        return {k: v for k, v in self._asdict().items() if k != "ext" and v not in (None, False)}
+
+
+def output_format(
+    filename: str,
+    codec: Optional[str] = None,
+    quality: Optional[int] = None,
+    progressive: bool = False,
+    compression: Optional[int] = None,
+) -> OutputFormat:
+    """
+    Validated OutputFormat for a request: `codec` (jpeg, webp or png) or else the
+    upload's extension, plus the options that codec supports.
+    Raises ValueError for an unknown codec or an option it does not take.
+    """
+    if codec:
+        if codec.lower() not in CODECS:
+            raise ValueError(f"Unknown output format '{codec}' (choose from jpeg, webp, png)")
+        ext = CODECS[codec.lower()]
+    else:
+        ext = output_extension(filename)
+
+    if quality is not None:
+        if ext not in (".jpg", ".jpeg", ".webp"):
+            raise ValueError("quality applies to JPEG and WebP output only")
+        if not 1 <= quality <= 100:
+            raise ValueError("quality must be between 1 and 100")
+    if progressive and ext not in (".jpg", ".jpeg"):
+        raise ValueError("progressive applies to JPEG output only")
+    if compression is not None:
+        if ext != ".png":
+            raise ValueError("png_compression applies to PNG output only")
+        if not 0 <= compression <= 9:
+            raise ValueError("png_compression must be between 0 and 9")
+    return OutputFormat(ext, quality, progressive, compression)
+
+
+def output_extension(filename: str) -> str:
+    """
+    Keeps the upload's extension when OpenCV can encode it, otherwise falls back to JPEG.
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if ext in CONTENT_TYPES else DEFAULT_EXTENSION
+
+
+def sniff_format(data: bytes):
+    """
+    Identifies the image format from its magic bytes. Returns an extension
+    from CONTENT_TYPES, or None if this is not an image we can decode.
+    """
+    if data[:3] == b"\xff\xd8\xff":
+        return ".jpg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return ".png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    if data[:2] == b"BM":
+        return ".bmp"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return ".tiff"
+    return None
+
+
+def image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """
+    (height, width) read from the image header alone, without decoding any
+    pixels. None when the format or header is not one we parse (TIFF, or a
+    truncated file); those are only known after a full decode. JPEG EXIF
+    rotation is not applied, so height and width may be swapped.
+    """
+    try:
+        fmt = sniff_format(data)
+        if fmt == ".png":
+            width, height = struct.unpack(">II", data[16:24])
+            return height, width
+        if fmt == ".jpg":
+            return _jpeg_size(data)
+        if fmt == ".webp":
+            return _webp_size(data)
+        if fmt == ".bmp":
+            width, height = struct.unpack("<ii", data[18:26])
+            return abs(height), width
+    except struct.error:
+        pass
+    return None
+
+
+# JPEG start-of-frame markers (every SOFn except DHT, JPG and DAC, which share the range)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    pos = 2
+    while pos + 4 <= len(data):
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # no length field
+            pos += 2
+            continue
+        (length,) = struct.unpack(">H", data[pos + 2:pos + 4])
+        if marker in _JPEG_SOF:
+            height, width = struct.unpack(">HH", data[pos + 5:pos + 9])
+            return height, width
+        if marker == 0xDA:  # start of scan before any frame header
+            return None
+        pos += 2 + length
+    return None
+
+
+def _webp_size(data: bytes) -> Optional[Tuple[int, int]]:
+    chunk = data[12:16]
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", data[26:30])
+        return height & 0x3FFF, width & 0x3FFF
+    if chunk == b"VP8L":
+        bits = struct.unpack("<I", data[21:25])[0]
+        return ((bits >> 14) & 0x3FFF) + 1, (bits & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return height, width
+    return None
+
+
+# OpenCV decodes a JPEG straight to 1/2, 1/4 or 1/8 size by dropping DCT coefficients
+_REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+def reduction_factor(size: Tuple[int, int], target: Tuple[int, int]) -> int:
+    """
+    The largest of 8, 4 and 2 that shrinks `size` to no less than `target`
+    on both sides, or 1 when even halving would undershoot.
+    """
+    (height, width), (target_height, target_width) = size, target
+    for factor in (8, 4, 2):
+        if height // factor >= target_height and width // factor >= target_width:
+            return factor
+    return 1
+
+
+def decode_image(data: bytes, reduce: int = 1) -> np.ndarray:
+    """
+    Decodes an uploaded buffer into a uint8 BGR ndarray without touching disk.
+    `reduce` (2, 4 or 8) decodes straight to that fraction of the size, which
+    for a JPEG skips most of the decoding work and the full-size buffer.
+    """
+    if reduce in _REDUCED_FLAGS:
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), _REDUCED_FLAGS[reduce])
+    else:
+        img = imfrombytes(data, flag='color')
+    if img is None:
+        raise ValueError("Could not decode the uploaded image")
+    return img
+
+
+def encode_image(img: np.ndarray, fmt: Union[str, OutputFormat] = DEFAULT_EXTENSION) -> bytes:
+    """
+    Encodes to an extension's defaults, or with an OutputFormat's options.
+    """
+    if isinstance(fmt, str):
+        fmt = OutputFormat(fmt)
+    ok, buffer = cv2.imencode(fmt.ext, img, fmt.params())
+    if not ok:
+        raise ValueError(f"Could not encode image as {fmt.ext}")
+    return buffer.tobytes()
@@ -0,0 +1,211 @@
+import bisect
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.core.timing import MARKER
+
+# Prometheus text exposition, without the client library. Recording a value never
+# takes a lock: every thread updates its own shard (a plain dict only it writes to)
+# and a scrape adds the shards up. Copying a dict is atomic under the GIL, so a
+# scrape sees each shard as it was at some instant.
+
+# Seconds; covers a cached 1 ms lookup up to a multi-minute CPU render
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 60.0, 120.0, 300.0)
+
+Labels = Tuple[str, ...]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Sharded:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[dict] = []
+        self._lock = threading.Lock()  # only taken the first time a thread records
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def _snapshots(self) -> List[dict]:
+        with self._lock:
+            shards = list(self._shards)
+        return [dict(shard) for shard in shards]
+
+
+class Counter(_Sharded):
+    def inc(self, *labels: str, amount: float = 1.0):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return sum(shard.get(labels, 0.0) for shard in self._snapshots())
+
+    def collect(self) -> List[str]:
+        totals: Dict[Labels, float] = {}
+        for shard in self._snapshots():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0.0) + value
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(totals.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Sharded):
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = STAGE_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels: str):
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            # One count per bucket plus +Inf, then the sum
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def count(self, *labels: str) -> int:
+        return sum(sum(shard[labels][:-1]) for shard in self._snapshots() if labels in shard)
+
+    def total(self, *labels: str) -> float:
+        """
+        The sum of every value observed with `labels`.
+        """
+        return sum(shard[labels][-1] for shard in self._snapshots() if labels in shard)
+
+    def collect(self) -> List[str]:
+        totals: Dict[Labels, List[float]] = {}
+        for shard in self._snapshots():
+            for labels, counts in shard.items():
+                counts = list(counts)
+                merged = totals.setdefault(labels, [0] * len(counts))
+                for i, value in enumerate(counts):
+                    merged[i] += value
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, counts in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Read when scraped: `read()` returns the current value, or a dict of
+    label values (a tuple, one per label name) to values.
+    """
+
+    def __init__(self, name: str, help: str, read: Callable[[], object], labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labelnames = tuple(labelnames)
+
+    def collect(self) -> List[str]:
+        try:
+            values = self.read()
+        except Exception as e:
+            print(f"⚠️ Metric {self.name} failed: {e}")
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(values.items()):
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """
+        Adds `metric`, replacing any earlier one of the same name (gauges are
+        re-registered whenever the services they read are rebuilt).
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self, extra: Iterable[object] = ()) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in [*metrics, *extra]:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Stage names are the ones recorded by `stage()` (see app/core/timing.py), plus
+# "upload_spool" for reading the request body and "preview" for a whole preview
+# render. "upload" is the time a job waits on its GCS uploads after rendering:
+# the rest of the original's upload and spooling the result.
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "enhance_stage_seconds", "Wall time of one pipeline stage of one render.", ["stage"]
+))
+REQUESTS = REGISTRY.register(Counter(
+    "enhance_requests_total", "Images submitted for enhancement, by endpoint.", ["endpoint"]
+))
+ERRORS = REGISTRY.register(Counter(
+    "enhance_errors_total", "Images that were rejected or failed, by reason.", ["reason"]
+))
+CACHE_HITS = REGISTRY.register(Counter(
+    "enhance_cache_hits_total", "Images answered from the result cache."
+))
+# The time a render spent decoding, enhancing and encoding (every stage but the uploads),
+# by the restoration backend it ran on; its count is the backend's throughput
+BACKEND_SECONDS = REGISTRY.register(Histogram(
+    "enhance_backend_render_seconds", "Wall time of one render, decode to encode, by restoration backend.", ["backend"]
+))
+DOWNSCALES = REGISTRY.register(Counter(
+    "enhance_downscales_total", "Renders that shrank their input (memory budget or reduced JPEG decode)."
+))
+
+
+def observe_stages(timings_ms: Dict[str, float], backend: Optional[str] = None):
+    """
+    Records a render's stage timings (milliseconds, as `stage()` adds them up;
+    markers are skipped) and, given the `backend` it ran on, its render time.
+    """
+    timings_ms = {name: ms for name, ms in timings_ms.items() if not name.startswith(MARKER)}
+    for name, ms in timings_ms.items():
+        STAGE_SECONDS.observe(ms / 1000.0, name)
+    if backend is not None:
+        BACKEND_SECONDS.observe(sum(ms for name, ms in timings_ms.items() if name != "upload") / 1000.0, backend)
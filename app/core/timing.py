@@ -0,0 +1,34 @@
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Not stages: the engine also reports how many faces it restored (so the latency
+# model can learn the per-face cost) and whether it shrank the input under these
+# keys. Whoever reads the timings as stage durations takes them out first (pop_markers).
+MARKER = "#"
+FACES = MARKER + "faces"
+DOWNSCALED = MARKER + "downscaled"
+
+
+def pop_markers(timings: Dict[str, float]) -> Dict[str, float]:
+    """
+    Removes the markers (FACES, DOWNSCALED) from `timings`, leaving only
+    stage durations, and returns them.
+    """
+    return {name: timings.pop(name) for name in [name for name in timings if name.startswith(MARKER)]}
+
+
+@contextmanager
+def stage(timings: Optional[Dict[str, float]], name: str):
+    """
+    Adds the wall time of the block, in milliseconds, to `timings[name]`.
+    Does nothing when `timings` is None.
+    """
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + (time.perf_counter() - started) * 1000.0
@@ -0,0 +1,605 @@
+"""
+Load test for POST /api/v1/enhance: throughput, latency percentiles, per-stage
+breakdown and peak RSS, as a JSON / markdown report to compare across commits.
+
+    python -m app.loadtest --concurrency 4 --requests 40             # in-process, closed loop
+    python -m app.loadtest --rate 0.5 --duration 120 --url http://host:8000
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from app.services.memory import child_pids, process_rss
+
+PERCENTILES = (50, 90, 95, 99)
+
+_LOREM = (
+    "the season's boldest looks arrive with quiet confidence and a sharper edge "
+    "as designers return to tailoring texture and light across every page"
+).split()
+
+
+class Sample(NamedTuple):
+    label: str       # e.g. "1200x1600", the resolution bucket it is reported under
+    filename: str
+    data: bytes
+    height: int
+    width: int
+
+
+# One request's outcome; `timings_ms` and `cached` are what the server reported
+class Record(NamedTuple):
+    label: str
+    status: int
+    latency_ms: float
+    timings_ms: Dict[str, float]
+    cached: bool
+    megapixels: float
+    error: Optional[str] = None
+
+
+def _draw_face(page: np.ndarray, cx: int, cy: int, size: int, rng: np.random.Generator):
+    skin = tuple(int(v) for v in rng.integers([90, 120, 160], [150, 180, 230]))
+    hair = tuple(int(v) for v in rng.integers(10, 90, size=3))
+    axes = (size // 2, int(size * 0.62))
+    cv2.ellipse(page, (cx, cy - size // 6), (axes[0] + size // 10, axes[1]), 0, 180, 360, hair, -1)
+    cv2.ellipse(page, (cx, cy), axes, 0, 0, 360, skin, -1)
+    for side in (-1, 1):
+        eye = (cx + side * size // 5, cy - size // 10)
+        cv2.ellipse(page, eye, (size // 12, size // 24), 0, 0, 360, (250, 250, 250), -1)
+        cv2.circle(page, eye, max(1, size // 28), (40, 30, 20), -1)
+        cv2.line(page, (eye[0] - size // 10, eye[1] - size // 10), (eye[0] + size // 10, eye[1] - size // 9), hair,
+                 max(1, size // 40))
+    cv2.line(page, (cx, cy - size // 20), (cx - size // 30, cy + size // 8), tuple(v - 30 for v in skin), max(1, size // 50))
+    cv2.ellipse(page, (cx, cy + size // 4), (size // 7, size // 20), 0, 0, 180, (60, 60, 170), max(1, size // 30))
+
+
+def _paste_face(page: np.ndarray, face: np.ndarray, cx: int, cy: int, size: int):
+    face = cv2.resize(face, (size, size), interpolation=cv2.INTER_AREA)
+    top, left = max(0, cy - size // 2), max(0, cx - size // 2)
+    region = page[top:top + size, left:left + size]
+    region[...] = face[:region.shape[0], :region.shape[1]]
+
+
+def _halftone(region: np.ndarray, rng: np.random.Generator, cell: int):
+    """
+    Covers `region` with print-style halftone dots whose size follows a smooth random tone.
+    """
+    height, width = region.shape[:2]
+    tone = rng.random((max(2, height // (cell * 8)), max(2, width // (cell * 8)), 3)).astype(np.float32)
+    tone = cv2.resize(tone, (width, height), interpolation=cv2.INTER_CUBIC).clip(0, 1)
+    yy, xx = np.mgrid[0:height, 0:width]
+    dy = (yy % cell) - cell / 2
+    dx = (xx % cell) - cell / 2
+    dist = np.sqrt(dx * dx + dy * dy)[..., None]
+    dots = dist < tone * cell * 0.7
+    region[...] = np.where(dots, (tone * 200).astype(np.uint8), 245)
+
+
+def synthetic_page(height: int, width: int, faces: int = 1, seed: int = 0,
+                   face_images: Sequence[np.ndarray] = ()) -> np.ndarray:
+    """
+    A BGR magazine-like page: paper grain, a headline and columns of body
+    text, a halftone photo block and `faces` faces at a few sizes. Faces are
+    drawn unless `face_images` (real face crops) are given; drawn faces
+    exercise the same decode / upscale / encode path but rarely pass face
+    detection, so use real crops to load the GFPGAN stages.
+    """
+    rng = np.random.default_rng(seed)
+    page = np.clip(rng.normal(238, 6, size=(height, width, 3)), 0, 255).astype(np.uint8)  # paper grain
+
+    margin = width // 16
+    scale = width / 1000
+    cv2.putText(page, " ".join(rng.choice(_LOREM, 3)).upper(), (margin, margin + int(50 * scale)),
+                cv2.FONT_HERSHEY_DUPLEX, 1.6 * scale, (20, 20, 20), max(1, int(3 * scale)), cv2.LINE_AA)
+
+    # Halftone photo block on the right half, text columns on the left
+    photo_top, photo_left = margin + int(90 * scale), width // 2
+    photo = page[photo_top:height - margin, photo_left:width - margin]
+    if photo.size:
+        _halftone(photo, rng, cell=max(4, int(6 * scale)))
+
+    line_height = max(8, int(22 * scale))
+    column_width = (photo_left - 2 * margin) // 2
+    for column in range(2):
+        x = margin + column * (column_width + margin // 2)
+        for y in range(photo_top, height - margin, line_height):
+            words = " ".join(rng.choice(_LOREM, 6))
+            cv2.putText(page, words, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.45 * scale, (35, 35, 35), 1, cv2.LINE_AA)
+
+    for i in range(faces):
+        # Faces of a few sizes, spread over the photo block
+        size = int(min(height, width) * (0.22, 0.14, 0.09)[i % 3])
+        cx = int(rng.integers(photo_left + size // 2, max(photo_left + size // 2 + 1, width - margin - size // 2)))
+        cy = int(rng.integers(photo_top + size // 2, max(photo_top + size // 2 + 1, height - margin - size // 2)))
+        if face_images:
+            _paste_face(page, face_images[i % len(face_images)], cx, cy, size)
+        else:
+            _draw_face(page, cx, cy, size, rng)
+    return page
+
+
+def parse_sizes(value: str) -> List[Tuple[int, int]]:
+    """
+    "800x600,1600x1200" -> [(height, width), ...]; sizes are given width first.
+    """
+    sizes = []
+    for item in value.split(","):
+        if item.strip():
+            width, height = item.lower().split("x")
+            sizes.append((int(height), int(width)))
+    return sizes
+
+
+def build_workload(sizes: Sequence[Tuple[int, int]], faces: int = 1, per_size: int = 2, quality: int = 90,
+                   face_images: Sequence[np.ndarray] = (), seed: int = 0) -> List[Sample]:
+    samples = []
+    for height, width in sizes:
+        for i in range(per_size):
+            page = synthetic_page(height, width, faces=faces, seed=seed + len(samples), face_images=face_images)
+            ok, buf = cv2.imencode(".jpg", page, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            assert ok
+            samples.append(Sample(f"{width}x{height}", f"page_{width}x{height}_{i}.jpg", buf.tobytes(), height, width))
+    return samples
+
+
+def unique_bytes(sample: Sample, n: int) -> bytes:
+    """
+    The sample's bytes with a counter appended after the image ends: decoders
+    ignore it, but the result cache sees a new upload.
+    """
+    return sample.data + b"\0loadtest" + str(n).encode("ascii")
+
+
+def percentile(values: Sequence[float], p: float) -> Optional[float]:
+    """
+    Nearest-rank percentile; None for no values.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _distribution(values: Sequence[float]) -> Dict[str, Optional[float]]:
+    summary = {"mean": round(sum(values) / len(values), 1) if values else None}
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        summary[f"p{p}"] = round(value, 1) if value is not None else None
+    summary["max"] = round(max(values), 1) if values else None
+    return summary
+
+
+Send = Callable[[Sample, bytes], Record]
+
+
+def closed_loop(send: Send, workload: Sequence[Sample], concurrency: int, requests: int = 0,
+                duration: float = 0.0, unique: bool = True) -> Tuple[List[Record], float]:
+    """
+    `concurrency` clients, each sending its next request as soon as the last
+    one answers, until `requests` were sent or `duration` seconds passed.
+    Returns (records, elapsed seconds).
+    """
+    counter = iter(range(sys.maxsize))
+    lock = threading.Lock()
+    records: List[Record] = []
+    started = time.perf_counter()
+
+    def client():
+        while True:
+            with lock:
+                n = next(counter)
+            if (requests and n >= requests) or (duration and time.perf_counter() - started >= duration):
+                return
+            sample = workload[n % len(workload)]
+            record = send(sample, unique_bytes(sample, n) if unique else sample.data)
+            with lock:
+                records.append(record)
+
+    threads = [threading.Thread(target=client, name=f"loadtest-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, time.perf_counter() - started
+
+
+def open_loop(send: Send, workload: Sequence[Sample], rate: float, requests: int = 0, duration: float = 0.0,
+              max_in_flight: int = 64, unique: bool = True, seed: int = 0) -> Tuple[List[Record], float]:
+    """
+    Poisson arrivals at `rate` per second, whether or not earlier requests
+    have answered. Latency counts from the scheduled send time, so a client
+    that falls behind (more than `max_in_flight` open requests) shows up as
+    latency instead of silently lowering the load.
+    """
+    rng = random.Random(seed)
+    records: List[Record] = []
+    lock = threading.Lock()
+
+    def fire(sample: Sample, data: bytes, scheduled: float):
+        record = send(sample, data)
+        queued_ms = (time.perf_counter() - scheduled) * 1000.0 - record.latency_ms
+        with lock:
+            records.append(record._replace(latency_ms=record.latency_ms + max(0.0, queued_ms)))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="loadtest") as pool:
+        n, scheduled = 0, started
+        while not (requests and n >= requests) and not (duration and scheduled - started >= duration):
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sample = workload[n % len(workload)]
+            pool.submit(fire, sample, unique_bytes(sample, n) if unique else sample.data, scheduled)
+            n += 1
+            scheduled += rng.expovariate(rate)
+    return records, time.perf_counter() - started
+
+
+def http_sender(base_url: str, form: Dict[str, str], timeout: float = 900.0) -> Send:
+    """
+    Sends each sample to `base_url`/api/v1/enhance with wait=true, so the
+    response carries the stage timings. One HTTP session per client thread.
+    """
+    import requests
+
+    local = threading.local()
+    url = f"{base_url.rstrip('/')}/api/v1/enhance"
+
+    def send(sample: Sample, data: bytes) -> Record:
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        try:
+            response = session.post(
+                url, files={"file": (sample.filename, data, "image/jpeg")}, data={**form, "wait": "true"},
+                timeout=timeout,
+            )
+        except requests.RequestException as e:
+            return Record(sample.label, 0, (time.perf_counter() - started) * 1000.0, {}, False,
+                          sample.height * sample.width / 1e6, str(e))
+        latency_ms = (time.perf_counter() - started) * 1000.0
+        return _record(sample, response.status_code, latency_ms, response.json, response.text)
+
+    return send
+
+
+def _record(sample: Sample, status: int, latency_ms: float, body: Callable[[], Any], text: str) -> Record:
+    megapixels = sample.height * sample.width / 1e6
+    try:
+        payload = body()
+    except ValueError:
+        payload = {}
+    if status != 200:
+        return Record(sample.label, status, latency_ms, {}, False, megapixels, str(payload.get("detail") or text[:200]))
+    return Record(sample.label, status, latency_ms, payload.get("timings_ms") or {}, bool(payload.get("cached")),
+                  megapixels)
+
+
+def tree_rss(pid: int) -> int:
+    """
+    Resident bytes of `pid` and all its descendants (e.g. inference workers).
+    Pages shared between them (mapped weights, fork copy-on-write) are counted
+    once per process, so this overstates a worker pool's real footprint.
+    """
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += process_rss(current) or 0
+        stack.extend(child_pids(current))
+    return total
+
+
+class RssSampler:
+    """
+    Polls `tree_rss(pid)` on a background thread and keeps the peak.
+    """
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, name="rss-sampler", daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _poll(self):
+        while True:
+            self.peak = max(self.peak, tree_rss(self.pid))
+            if self._stop.wait(self.interval):
+                return
+
+
+class _NoSampler:
+    peak = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def summarize(records: Sequence[Record], elapsed: float, peak_rss: Optional[int] = None,
+              config: Optional[dict] = None) -> Dict[str, Any]:
+    ok = [r for r in records if r.status == 200]
+    errors: Dict[str, int] = {}
+    for r in records:
+        if r.status != 200:
+            errors[str(r.status)] = errors.get(str(r.status), 0) + 1
+
+    stages: Dict[str, List[float]] = {}
+    for r in ok:
+        if not r.cached:
+            for name, ms in r.timings_ms.items():
+                stages.setdefault(name, []).append(ms)
+
+    by_size: Dict[str, List[float]] = {}
+    for r in ok:
+        by_size.setdefault(r.label, []).append(r.latency_ms)
+
+    return {
+        "config": config or {},
+        "requests": len(records),
+        "succeeded": len(ok),
+        "cached": sum(1 for r in ok if r.cached),
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed > 0 else None,
+        "throughput_mp_per_second": round(sum(r.megapixels for r in ok) / elapsed, 3) if elapsed > 0 else None,
+        "latency_ms": _distribution([r.latency_ms for r in ok]),
+        "latency_ms_by_size": {label: _distribution(values) for label, values in sorted(by_size.items())},
+        "stages_ms": {name: _distribution(values) for name, values in sorted(stages.items())},
+        "peak_rss_bytes": peak_rss,
+        "sample_errors": sorted({r.error for r in records if r.error})[:5],
+    }
+
+
+def _cell(value) -> str:
+    return "-" if value is None else f"{value:g}" if isinstance(value, float) else str(value)
+
+
+def markdown(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    """
+    The report as markdown; with a `baseline` report, latency and throughput
+    rows gain the change relative to it.
+    """
+    config = report["config"]
+    lines = [f"## Load test: {config.get('commit') or 'working tree'}", ""]
+    if config:
+        lines += [", ".join(f"{k}={v}" for k, v in sorted(config.items()) if k != "commit"), ""]
+
+    def delta(path: Sequence[str]) -> str:
+        if baseline is None:
+            return ""
+        old, new = baseline, report
+        for key in path:
+            old, new = (old or {}).get(key), (new or {}).get(key)
+        if not old or new is None:
+            return ""
+        return f" ({(new - old) / old * 100:+.1f}%)"
+
+    lines += [
+        "| metric | value |",
+        "|---|---|",
+        f"| requests (ok / total) | {report['succeeded']} / {report['requests']} |",
+        f"| cache hits | {report['cached']} |",
+        f"| errors | {', '.join(f'{k}: {v}' for k, v in report['errors'].items()) or 'none'} |",
+        f"| throughput (req/s) | {_cell(report['throughput_rps'])}{delta(['throughput_rps'])} |",
+        f"| throughput (MP/s) | {_cell(report['throughput_mp_per_second'])}{delta(['throughput_mp_per_second'])} |",
+    ]
+    for key in ("mean", *(f"p{p}" for p in PERCENTILES), "max"):
+        lines.append(f"| latency {key} (ms) | {_cell(report['latency_ms'][key])}{delta(['latency_ms', key])} |")
+    rss = report["peak_rss_bytes"]
+    lines.append(f"| peak RSS (MiB) | {_cell(round(rss / 1024 ** 2, 1) if rss else None)}{delta(['peak_rss_bytes'])} |")
+
+    for title, table in (("Latency by size (ms)", report["latency_ms_by_size"]), ("Stages (ms)", report["stages_ms"])):
+        if not table:
+            continue
+        columns = ["mean", *(f"p{p}" for p in PERCENTILES), "max"]
+        lines += ["", f"### {title}", "", "| | " + " | ".join(columns) + " |", "|---" * (len(columns) + 1) + "|"]
+        for name, dist in table.items():
+            lines.append(f"| {name} | " + " | ".join(_cell(dist[c]) for c in columns) + " |")
+    return "\n".join(lines) + "\n"
+
+
+class StubBucket:
+    """
+    A bucket store for GCSService that keeps nothing and returns mock URLs,
+    after `latency_ms` to mimic the round trip to the bucket.
+    """
+
+    def __init__(self, latency_ms: float = 0.0):
+        self.latency_ms = latency_ms
+        self.uploads = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, bucket, name, data, content_type=None, metadata=None):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        with self._lock:
+            self.uploads += 1
+            self.bytes += len(data)
+
+    def exists(self, bucket, name):
+        return False
+
+    def url(self, bucket, name):
+        return f"http://localhost/mock/{bucket}/{name}"
+
+    def permanent(self, error):
+        return False
+
+
+def stub_gcs(latency_ms: float = 0.0, spool_dir: str = ""):
+    """
+    GCSService over a StubBucket, so uploads take the real (concurrent, spooled) path.
+    """
+    from app.services.gcs import GCSService
+    return GCSService(StubBucket(latency_ms), spool_dir=spool_dir)
+
+
+def serve_in_process(gcs, port: int = 0, ready_timeout: float = 1800.0):
+    """
+    Starts the API (real models, `gcs` in place of GCSService) on a local
+    port in a background thread and waits until /ready. Returns
+    (base URL, stop function).
+    """
+    import socket
+
+    import uvicorn
+    from fastapi import FastAPI
+
+    from app.api import endpoints
+    from app.main import readiness_probe
+
+    app = FastAPI()
+    app.include_router(endpoints.router, prefix="/api/v1")
+    app.add_api_route("/ready", readiness_probe)
+    endpoints.startup(gcs_override=gcs)
+
+    if not port:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server.install_signal_handlers = lambda: None  # not the main thread
+    thread = threading.Thread(target=server.run, name="loadtest-server", daemon=True)
+    thread.start()
+
+    deadline = time.monotonic() + ready_timeout
+    while not endpoints.readiness()["ready"]:
+        status = endpoints.readiness()
+        if status.get("error"):
+            raise RuntimeError(f"Models failed to load: {status['error']}")
+        if time.monotonic() > deadline:
+            raise TimeoutError("Models did not become ready")
+        time.sleep(0.5)
+    while not server.started:
+        time.sleep(0.05)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+        endpoints.shutdown()
+
+    return f"http://127.0.0.1:{port}", stop
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True, check=True
+        ).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test POST /api/v1/enhance and report latency percentiles.")
+    parser.add_argument("--url", help="Test a running server (default: start the app in this process)")
+    parser.add_argument("--pid", type=int, help="With --url: server process to sample RSS from")
+    parser.add_argument("--concurrency", type=int, default=2, help="Closed loop: clients; open loop: max open requests")
+    parser.add_argument("--rate", type=float, default=0.0, help="Open loop: Poisson arrivals per second (0 = closed loop)")
+    parser.add_argument("--requests", type=int, default=0, help="Stop after this many requests")
+    parser.add_argument("--duration", type=float, default=0.0, help="Stop sending after this many seconds")
+    parser.add_argument("--sizes", default="600x800,1200x1600", help="Page sizes, WIDTHxHEIGHT, comma-separated")
+    parser.add_argument("--faces", type=int, default=2, help="Faces per page")
+    parser.add_argument("--face-dir", help="Real face crops to paste instead of drawn faces (loads the GFPGAN path)")
+    parser.add_argument("--per-size", type=int, default=2, help="Distinct pages generated per size")
+    parser.add_argument("--preset", default="full")
+    parser.add_argument("--repeat-images", action="store_true",
+                        help="Send identical bytes for repeated pages, so the result cache can answer them")
+    parser.add_argument("--gcs-latency-ms", type=float, default=0.0, help="In-process: simulated bucket upload time")
+    parser.add_argument("--json", help="Write the report here")
+    parser.add_argument("--markdown", help="Write the markdown report here (default: print it)")
+    parser.add_argument("--baseline", help="Earlier JSON report to compare against")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    if not args.requests and not args.duration:
+        args.requests = 10 * args.concurrency
+
+    face_images = []
+    if args.face_dir:
+        for name in sorted(os.listdir(args.face_dir)):
+            face = cv2.imread(os.path.join(args.face_dir, name), cv2.IMREAD_COLOR)
+            if face is not None:
+                face_images.append(face)
+    workload = build_workload(parse_sizes(args.sizes), args.faces, args.per_size, face_images=face_images,
+                              seed=args.seed)
+    print(f"🧪 {len(workload)} synthetic pages ({args.sizes}, {args.faces} faces each)")
+
+    stop = None
+    if args.url:
+        base_url, pid = args.url, args.pid
+    else:
+        print("⏳ Starting the API in-process and waiting for the models...")
+        spool_dir = tempfile.mkdtemp(prefix="loadtest-spool-")
+        base_url, stop = serve_in_process(stub_gcs(args.gcs_latency_ms, spool_dir))
+        pid = os.getpid()
+
+    config = {
+        "commit": _commit(),
+        "target": args.url or "in-process",
+        "mode": f"open ({args.rate:g}/s)" if args.rate else "closed",
+        "concurrency": args.concurrency,
+        "sizes": args.sizes,
+        "faces": args.faces,
+        "preset": args.preset,
+    }
+    send = http_sender(base_url, {"preset": args.preset})
+    unique = not args.repeat_images
+    try:
+        with RssSampler(pid) if pid else _NoSampler() as sampler:
+            if args.rate:
+                records, elapsed = open_loop(send, workload, args.rate, args.requests, args.duration,
+                                             max_in_flight=args.concurrency, unique=unique, seed=args.seed)
+            else:
+                records, elapsed = closed_loop(send, workload, args.concurrency, args.requests, args.duration,
+                                               unique=unique)
+    finally:
+        if stop is not None:
+            stop()
+
+    report = summarize(records, elapsed, sampler.peak or None, config)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    text = markdown(report, baseline)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.json}")
+    if args.markdown:
+        with open(args.markdown, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from app.api import endpoints
 import uvicorn
 import os
@@ -23,13 +24,36 @@ app.add_middleware(
 
 # Connect the /enhance endpoint
 app.include_router(endpoints.router, prefix="/api/v1", tags=["Enhancement"])
+# Prometheus scrapes /metrics by default
+app.add_api_route("/metrics", endpoints.get_metrics, include_in_schema=False)
+
+@app.on_event("startup")
+def startup():
+    endpoints.startup()
+
+@app.on_event("shutdown")
+def shutdown():
+    endpoints.shutdown()
 
 @app.get("/")
 def health_check():
     """
-    Simple route to check if server is running.
+    Liveness: the server is running, whether or not the models are loaded yet.
+    """
+    status = endpoints.readiness()
+    return {
+        "status": "online",
+        "gpu_enabled": status.get("device") == "cuda",
+        "message": "System Ready" if status["ready"] else "Loading models",
+    }
+
+@app.get("/ready")
+def readiness_probe():
+    """
+    Readiness: 200 once the models are loaded and warmed up, 503 until then.
     """
-    return {"status": "online", "gpu_enabled": False, "message": "System Ready"}
+    status = endpoints.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
 
 if __name__ == "__main__":
     # Local Development Entry Point
@@ -0,0 +1,201 @@
+import asyncio
+import collections
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+from app.services.ai_engine import AIEngine, PRESETS
+from app.services.jobs import QueueFullError
+from app.services.memory import estimate_peak_bytes, fit_to_budget, total_memory
+
+# Bytes per source pixel held while the upload is decoded at full size, before the engine shrinks it
+_SOURCE_DECODE = 3
+
+
+class AdmissionRejected(QueueFullError):
+    """Raised when a request waited too long for memory, or the wait queue is full."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _memory_kwargs(preset: str, faces: int) -> dict:
+    steps = PRESETS[preset]
+    return {
+        "scale": 2,
+        "tile": settings.TILE_SIZE,
+        "tile_pad": settings.TILE_PAD,
+        "tile_batch": settings.TILE_BATCH_SIZE,
+        "faces": faces if steps.faces else 0,
+        "detect_faces": steps.faces,
+        "model_upsample": steps.background,
+    }
+
+
+def fitted_size(size: Tuple[int, int], preset: str, faces: int = 1) -> Tuple[int, int]:
+    """
+    The size the engine will actually process an input of `size` (height,
+    width) at: shrunk to IMAGE_MEMORY_BUDGET_BYTES, or to the legacy 1200px
+    clamp when there is no budget.
+    """
+    budget = settings.IMAGE_MEMORY_BUDGET_BYTES
+    height, width = size
+    if budget > 0:
+        return fit_to_budget(height, width, budget, **_memory_kwargs(preset, faces))
+    scale = min(1.0, AIEngine.SAFE_MAX_DIMENSION / max(height, width))
+    return int(height * scale), int(width * scale)
+
+
+def request_cost(size: Optional[Tuple[int, int]], preset: str, faces: int = 1) -> int:
+    """
+    Estimated peak bytes of rendering an image of `size` (height, width) with
+    `preset`: `estimate_peak_bytes` at the engine's `fitted_size`, plus the
+    full-size decode. The face count is unknown until detection, so presets
+    that restore faces are charged for `faces` of them. An unknown size is
+    charged as a full-budget image.
+    """
+    budget = settings.IMAGE_MEMORY_BUDGET_BYTES
+    if size is None:
+        if budget > 0:
+            return budget
+        size = (AIEngine.SAFE_MAX_DIMENSION, AIEngine.SAFE_MAX_DIMENSION)
+
+    height, width = size
+    cost = estimate_peak_bytes(*fitted_size((height, width), preset, faces), **_memory_kwargs(preset, faces))
+    return cost + height * width * _SOURCE_DECODE
+
+
+def default_budget() -> int:
+    """
+    ADMISSION_MEMORY_BYTES, or half of this machine's RAM when that is 0.
+    """
+    if settings.ADMISSION_MEMORY_BYTES > 0:
+        return settings.ADMISSION_MEMORY_BYTES
+    return (total_memory() or 8 * 1024 ** 3) // 2
+
+
+class _Waiter:
+    __slots__ = ("cost", "future", "loop", "admitted")
+
+    def __init__(self, cost: int, loop: asyncio.AbstractEventLoop):
+        self.cost = cost
+        self.future = loop.create_future()
+        self.loop = loop
+        self.admitted = False
+
+
+class AdmissionController:
+    """
+    Keeps the summed estimated cost (peak bytes) of the requests being
+    rendered under `budget`. A request that does not fit waits in FIFO order
+    for up to `max_wait` seconds; past that, or when `max_queue` requests are
+    already waiting, it is shed with AdmissionRejected. A request costlier
+    than the whole budget is charged the budget, so it runs alone instead of
+    never.
+
+    `acquire` runs on the event loop; `release` may be called from any thread
+    (e.g. a job's done-callback).
+    """
+
+    def __init__(self, budget: int, max_wait: float = 30.0, max_queue: int = 64, retry_after: int = 15):
+        self.budget = max(1, budget)
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.in_flight_cost = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self, cost: int) -> int:
+        """
+        Waits until `cost` fits and reserves it. Returns the reserved amount,
+        which must be passed to `release`.
+        """
+        cost = min(max(0, cost), self.budget)
+        with self._lock:
+            if not self._waiters and self.in_flight_cost + cost <= self.budget:
+                self._take(cost)
+                self._record_wait(0.0)
+                return cost
+            if len(self._waiters) >= self.max_queue:
+                self.shed += 1
+                raise AdmissionRejected(f"Server is at capacity ({len(self._waiters)} requests waiting)", self.retry_after)
+            waiter = _Waiter(cost, asyncio.get_running_loop())
+            self._waiters.append(waiter)
+
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                admitted = waiter.admitted
+                if not admitted:
+                    self._waiters.remove(waiter)
+                    if isinstance(e, asyncio.TimeoutError):
+                        self.shed += 1
+            if admitted:
+                # Admitted just as the wait ran out: give it back unless we can still use it
+                if isinstance(e, asyncio.CancelledError):
+                    self.release(cost)
+                    raise
+            else:
+                # A large request leaving the head of the queue may let smaller ones in
+                self._wake()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                raise AdmissionRejected(
+                    f"Server is at capacity (waited {self.max_wait:g}s for memory)", self.retry_after
+                ) from None
+        with self._lock:
+            self._record_wait(time.monotonic() - started)
+        return cost
+
+    def release(self, cost: int):
+        with self._lock:
+            self.in_flight_cost -= cost
+            self.in_flight -= 1
+        self._wake()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "budget_bytes": self.budget,
+                "in_flight_bytes": self.in_flight_cost,
+                "in_flight": self.in_flight,
+                "queued": len(self._waiters),
+                "admitted": self.admitted,
+                "shed": self.shed,
+                "wait_seconds_total": round(self.wait_seconds_total, 3),
+                "wait_seconds_max": round(self.wait_seconds_max, 3),
+                "max_wait_seconds": self.max_wait,
+                "max_queue": self.max_queue,
+            }
+
+    def _take(self, cost: int):
+        self.in_flight_cost += cost
+        self.in_flight += 1
+        self.admitted += 1
+
+    def _record_wait(self, waited: float):
+        self.wait_seconds_total += waited
+        self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+    def _wake(self):
+        with self._lock:
+            while self._waiters and self.in_flight_cost + self._waiters[0].cost <= self.budget:
+                waiter = self._waiters.popleft()
+                waiter.admitted = True
+                self._take(waiter.cost)
+                waiter.loop.call_soon_threadsafe(_resolve, waiter.future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
@@ -1,57 +1,409 @@
+import copy
+import functools
+import hashlib
 import os
+import tempfile
+import threading
+from typing import NamedTuple, Optional, Tuple
+
 import torch
 import cv2
 import numpy as np
 from basicsr.archs.rrdbnet_arch import RRDBNet
-from realesrgan import RealESRGANer
+from basicsr.utils import img2tensor, tensor2img
+from facexlib.utils.face_restoration_helper import FaceRestoreHelper
 from gfpgan import GFPGANer
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from torch.nn import functional as F
+from torchvision.transforms.functional import normalize
+
+from app.config import settings
+from app.core.codecs import decode_image
+from app.core.timing import DOWNSCALED, FACES, stage
+from app.services.autotune import autotune, hardware_fingerprint, load_tuning, tuned_tile
+from app.services.backends import BackendRegistry, UnknownBackendError, backend_config
+from app.services.memory import estimate_peak_bytes, fit_to_budget
+from app.services.weights import is_mapped, is_stale, load_weights, mapped_path, source_digest
+
+REALESRGAN_WEIGHTS = '/app/weights/RealESRGAN_x2plus.pth'
+GFPGAN_WEIGHTS = '/app/weights/GFPGANv1.4.pth'
+
+class Preset(NamedTuple):
+    faces: bool       # detect faces and restore them with GFPGAN
+    background: bool  # upscale with the restoration backend (otherwise a bicubic resize)
+
+# Which stages each `preset` form value runs. Images without faces skip
+# restoration and paste-back on their own, whatever the preset.
+PRESETS = {
+    "full": Preset(faces=True, background=True),
+    "faces_only": Preset(faces=True, background=False),
+    "background_only": Preset(faces=False, background=True),
+    "fast": Preset(faces=False, background=False),
+}
+DEFAULT_PRESET = "full"
+
+@functools.lru_cache(maxsize=None)
+def _file_digest(path: str, size: int, mtime_ns: int) -> str:
+    # Keyed on size + mtime so a replaced checkpoint is re-hashed, an unchanged one never is
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def weights_id(path: str):
+    """
+    Content hash of a checkpoint, so a fine-tuned model with the same
+    architecture (and byte size) never shares cache entries with the original.
+    A converted flat weight file is what gets loaded (unless it is stale),
+    so its recorded source hash wins (and saves hashing the checkpoint).
+    """
+    flat = mapped_path(path)
+    digest = source_digest(flat) if not is_stale(flat, path) else None
+    if digest is not None:
+        return digest
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return _file_digest(path, st.st_size, st.st_mtime_ns)
+
+def _default_backend_weights() -> str:
+    config = backend_config()
+    return config.backends[config.default].weights
+
+def model_fingerprint(tile: int, tile_pad: int) -> dict:
+    """
+    Everything about the models that changes the output image.
+    Computable without loading the weights.
+    """
+    return {
+        "weights": {os.path.basename(path): weights_id(path) for path in (_default_backend_weights(), GFPGAN_WEIGHTS)},
+        "tile": tile,
+        "tile_pad": tile_pad,
+        # The budget decides how far large inputs are shrunk
+        "memory_budget": settings.IMAGE_MEMORY_BUDGET_BYTES or {"max_dimension": AIEngine.SAFE_MAX_DIMENSION},
+        "mmap_output": bool(settings.OUTPUT_MMAP_DIR),
+        # Large JPEGs are shrunk in the DCT domain instead of after a full decode
+        "reduced_decode": settings.REDUCED_DECODE,
+    }
+
+def build_bg_model() -> RRDBNet:
+    """
+    The Real-ESRGAN x2plus architecture, without weights.
+    """
+    return RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2)
+
+def build_face_enhancer(device) -> GFPGANer:
+    """
+    What GFPGANer(model_path=GFPGAN_WEIGHTS, upscale=2, arch='clean',
+    channel_multiplier=2) builds, but with the weights from `load_weights`,
+    which maps a converted flat file instead of unpickling the checkpoint.
+    """
+    enhancer = GFPGANer.__new__(GFPGANer)
+    enhancer.upscale = 2
+    enhancer.bg_upsampler = None
+    enhancer.device = device
+    enhancer.gfpgan = GFPGANv1Clean(
+        out_size=512,
+        num_style_feat=512,
+        channel_multiplier=2,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=1,
+        sft_half=True,
+    )
+    enhancer.face_helper = FaceRestoreHelper(
+        2,
+        face_size=512,
+        crop_ratio=(1, 1),
+        det_model='retinaface_resnet50',
+        save_ext='png',
+        use_parse=True,
+        device=device,
+        model_rootpath='gfpgan/weights',
+    )
+    print(f"   GFPGAN weights: {load_weights(enhancer.gfpgan, GFPGAN_WEIGHTS)}")
+    enhancer.gfpgan = enhancer.gfpgan.eval().to(device)
+    return enhancer
 
 class AIEngine:
-    def __init__(self):
+    # With IMAGE_MEMORY_BUDGET_BYTES=0, inputs larger than this are shrunk first
+    # (1200px input -> 2400px output), whatever memory is available
+    SAFE_MAX_DIMENSION = 1200
+
+    # Every restoration backend (see app/services/backends.py), set by __init__
+    backends: Optional[BackendRegistry] = None
+
+    def __init__(self, device=None):
         # 1. Setup Device
-        if torch.cuda.is_available():
+        if device is not None:
+            self.device = torch.device(device)
+            print(f"⚡ AI Engine: Running on {self.device}")
+        elif torch.cuda.is_available():
             self.device = torch.device('cuda')
             print("⚡ AI Engine: Running on NVIDIA GPU")
         else:
             self.device = torch.device('cpu')
             print("⚠️ AI Engine: Running on CPU (Explicit Fallback)")
 
-        # 2. Setup Background Upsampler (Real-ESRGAN)
-        print("⚡ Loading Real-ESRGAN...")
-        model = RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=64, num_block=23, num_grow_ch=32, scale=2)
-        
-        bg_upsampler = RealESRGANer(
-            scale=2,
-            model_path='/app/weights/RealESRGAN_x2plus.pth',
-            model=model,
-            tile=200,       # Increased slightly (100 was too small/slow, 200 is balanced)
-            tile_pad=10,
-            pre_pad=0,
-            half=False,     
-            device=self.device
-        )
+        # 2. Setup Background Upsamplers (Real-ESRGAN and the other configured backends)
+        # Weights come from the converted flat files when present
+        # (`python -m app.services.weights`): mapped, not unpickled and copied.
+        self.backends = BackendRegistry(backend_config(), self.device)
+        # The tile loop is the batched one below, not RealESRGANer's
+        self.bg_model = self.backends.default.model
 
         # 3. Setup Face Enhancer (GFPGAN)
         print("⚡ Loading GFPGAN...")
-        self.face_enhancer = GFPGANer(
-            model_path='/app/weights/GFPGANv1.4.pth',
-            upscale=2,
-            arch='clean',
-            channel_multiplier=2,
-            bg_upsampler=bg_upsampler,
-            device=self.device
-        )
+        self.face_enhancer = build_face_enhancer(self.device)
+
+        # 4. Find the fastest tile size for this machine once, unless it is already known.
+        #    Pool workers run with other thread counts than the zygote that loads
+        #    the models, so they are tuned with `python -m app.services.autotune` instead.
+        if (
+            settings.TILE_AUTOTUNE == "startup"
+            and settings.INFERENCE_PROCESSES <= 0
+            and load_tuning(settings.TILE_TUNING_FILE, hardware_fingerprint(self.device)) is None
+        ):
+            autotune(self.bg_model, self.device, image_size=settings.TILE_AUTOTUNE_IMAGE_SIZE)
+
+        self._init_runtime()
+
+    def _init_runtime(self):
+        """
+        Threads and locks that cannot be inherited across fork().
+        Also picks the tile size, which depends on this process's torch thread count.
+        """
+        tile, tile_pad = tuned_tile(self.device)
+        # Tiles from every in-flight image share one batched forward per backend instance
+        self.backends.init_runtime(tile, tile_pad)
+        self.bg_upsampler = self.backends.default.upsamplers[0]
+        self.tile_batcher = self.bg_upsampler.batcher
+
+        # GFPGANer keeps per-image state on its face_helper, so the face stages
+        # run one image at a time. Background upsampling happens outside the lock
+        # so tiles from concurrent images can be batched together.
+        self._lock = threading.Lock()
+
+    def reset_after_fork(self):
+        """
+        Call in a forked child before use: the parent's batcher thread does not exist there.
+        """
+        self._init_runtime()
+
+    def modules(self):
+        helper = self.face_enhancer.face_helper
+        bg_models = self.backends.models() if self.backends is not None else [self.bg_model]
+        nets = [*bg_models, self.face_enhancer.gfpgan, helper.face_det, getattr(helper, 'face_parse', None)]
+        return [net for net in nets if net is not None]
+
+    def share_memory(self):
+        """
+        Moves every parameter and buffer into shared memory so forked workers
+        map the same pages instead of copying them. Tensors mapped from a flat
+        weight file are shared through the page cache already and stay put.
+        """
+        for net in self.modules():
+            for tensor in [*net.parameters(), *net.buffers()]:
+                if not is_mapped(tensor):
+                    tensor.share_memory_()
+
+    @torch.no_grad()
+    def warm_up_faces(self):
+        """
+        Runs GFPGAN once on a blank aligned crop: synthetic warm-up pages have no faces to detect.
+        """
+        helper = self.face_enhancer.face_helper
+        crop = torch.zeros(1, 3, helper.face_size[1], helper.face_size[0], device=self.device)
+        with self._lock:
+            self.face_enhancer.gfpgan(crop, return_rgb=False, weight=0.5)
+
+    def fingerprint(self) -> dict:
+        # GPU renders use the tensor magazine look, which rounds slightly differently
+        upsampler = self.bg_upsampler
+        return {**model_fingerprint(upsampler.tile_size, upsampler.tile_pad), "device": self.device.type}
 
     def enhance(self, input_path: str, output_path: str):
+        from app.services.pipeline import decode_reduction
+
         print(f"⚡ Processing: {input_path}")
-        img = cv2.imread(input_path, cv2.IMREAD_COLOR)
+        with open(input_path, 'rb') as f:
+            data = f.read()
+        img = decode_image(data, decode_reduction(self, data))
+        output = self.enhance_array(img)
+        cv2.imwrite(output_path, output)
+        return output_path
+
+    def decode_size(self, height: int, width: int, preset: str = DEFAULT_PRESET,
+                    backend: Optional[str] = None) -> Tuple[int, int]:
+        """
+        The size a `height` x `width` input is shrunk to before face detection
+        (faces can only shrink it further), so the decoder may start there.
+        """
+        budget = settings.IMAGE_MEMORY_BUDGET_BYTES
+        if budget <= 0:
+            scale = min(1.0, self.SAFE_MAX_DIMENSION / max(height, width))
+            return int(height * scale), int(width * scale)
+        float_output = self.device.type != 'cpu'
+        upsampler = self._upsampler(backend)
+        return fit_to_budget(height, width, budget, **self._memory_kwargs(0, PRESETS[preset], float_output, upsampler))
 
+    def enhance_array(self, img: np.ndarray, preset: str = DEFAULT_PRESET, timings: Optional[dict] = None,
+                      backend: Optional[str] = None) -> np.ndarray:
+        """
+        Face restore + background upscale on an in-memory uint8 BGR image.
+        `preset` (see PRESETS) selects which of the two stages run, `backend`
+        which restoration backend upscales (None = the default one); stage
+        times in ms are added to `timings` when given.
+
+        Runs at full resolution unless the estimated peak memory exceeds
+        IMAGE_MEMORY_BUDGET_BYTES; background tiles are streamed into a
+        preallocated (optionally memory-mapped) output buffer.
+        """
+        steps = PRESETS[preset]
+        upsampler = self._upsampler(backend)
+        img, face_helper = self._fit_and_restore_faces(img, steps, False, timings, upsampler)
+        out = None
+        if steps.background and upsampler.scale == self.face_enhancer.upscale:
+            out = self._output_buffer(*img.shape[:2])
+        return self._upsample_and_paste(img, steps, face_helper, timings, out=out, upsampler=upsampler)
+
+    def enhance_tensor(self, img: np.ndarray, preset: str = DEFAULT_PRESET, timings: Optional[dict] = None,
+                       backend: Optional[str] = None) -> torch.Tensor:
+        """
+        Same as `enhance_array`, but returns an unquantized float (3, H, W) RGB
+        tensor in [0, 1] on this engine's device. Images without faces never
+        leave the device; face paste-back is a facexlib (numpy) step, so images
+        with faces make one round trip through the host for it.
+        """
+        steps = PRESETS[preset]
+        upsampler = self._upsampler(backend)
+        img, face_helper = self._fit_and_restore_faces(img, steps, True, timings, upsampler)
+        if steps.background and not _has_faces(face_helper):
+            with stage(timings, "background"):
+                output = upsampler.enhance_tensor(img).float()
+                if upsampler.scale != self.face_enhancer.upscale:
+                    # Backends with another scale are brought to the pipeline's
+                    size = (img.shape[0] * self.face_enhancer.upscale, img.shape[1] * self.face_enhancer.upscale)
+                    output = F.interpolate(output[None], size=size, mode="bicubic", align_corners=False)[0]
+                return output.clamp_(0, 1)
+
+        output = self._upsample_and_paste(img, steps, face_helper, timings, upsampler=upsampler)
+        output = torch.from_numpy(cv2.cvtColor(output, cv2.COLOR_BGR2RGB)).to(self.device)
+        return output.permute(2, 0, 1).float().div_(255.0)
+
+    def estimate_peak_bytes(self, height: int, width: int, faces: int = 0, preset: str = DEFAULT_PRESET,
+                            float_output: bool = False, backend: Optional[str] = None) -> int:
+        """
+        Estimated peak memory of enhancing a `height` x `width` image at full resolution.
+        """
+        kwargs = self._memory_kwargs(faces, PRESETS[preset], float_output, self._upsampler(backend))
+        return estimate_peak_bytes(height, width, **kwargs)
+
+    def _upsampler(self, backend: Optional[str] = None):
+        """
+        The upsampler of `backend` (None = the default backend) to render with.
+        """
+        if self.backends is None:
+            if backend is not None:
+                raise UnknownBackendError(f"Backend '{backend}' is not loaded")
+            return self.bg_upsampler
+        return self.backends.get(backend).upsampler()
+
+    def _upsample_and_paste(self, img: np.ndarray, steps, face_helper, timings: Optional[dict],
+                            out: Optional[np.ndarray] = None, upsampler=None) -> np.ndarray:
+        # Same stages as GFPGANer.enhance(paste_back=True), split up so the
+        # background upsampler can run concurrently with other requests
+        upsampler = upsampler or self.bg_upsampler
+        with stage(timings, "background"):
+            if steps.background:
+                bg_img = upsampler.enhance(img, outscale=self.face_enhancer.upscale, out=out)[0]
+            else:
+                bg_img = self._resample(img)
+        if not _has_faces(face_helper):
+            # Pasting zero faces back would only copy the whole output
+            return bg_img
+        with stage(timings, "paste_back"):
+            return face_helper.paste_faces_to_input_image(upsample_img=bg_img)
+
+    def _resample(self, img: np.ndarray) -> np.ndarray:
+        """
+        Cheap stand-in for the restoration backend: a plain bicubic upscale.
+        """
+        height, width = img.shape[:2]
+        scale = self.face_enhancer.upscale
+        return cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_CUBIC)
+
+    def _memory_kwargs(self, faces: int, steps, float_output: bool, upsampler=None) -> dict:
+        upsampler = upsampler or self.bg_upsampler
+        # Outputs below OUTPUT_MMAP_MIN_BYTES stay in RAM anyway, which the
+        # estimate ignores; that error is bounded by OUTPUT_MMAP_MIN_BYTES
+        return {
+            "scale": upsampler.scale,
+            "tile": upsampler.tile_size,
+            "tile_pad": upsampler.tile_pad,
+            "tile_batch": upsampler.batcher.max_batch,
+            "faces": faces,
+            "mmap_output": (
+                steps.background and not float_output and faces == 0 and bool(settings.OUTPUT_MMAP_DIR)
+            ),
+            "float_output": float_output,
+            "detect_faces": steps.faces,
+            "model_upsample": steps.background,
+        }
+
+    def _fit_and_restore_faces(self, img: np.ndarray, steps, float_output: bool, timings: Optional[dict] = None,
+                               upsampler=None):
+        """
+        Restores the faces at the largest size that fits the memory budget.
+        The face count is only known after detection, so an image whose faces
+        push it over the budget is shrunk further and restored again.
+        Returns (image, face helper), with no face helper when `steps` skip faces.
+        """
+        source = img
+        with stage(timings, "resize"):
+            img = self._fit_to_budget(source, faces=0, steps=steps, float_output=float_output, upsampler=upsampler)
+        face_helper, faces = None, 0
+        if steps.faces:
+            face_helper = self._restore_faces(img, timings=timings)
+            faces = len(face_helper.restored_faces)
+            if faces:
+                with stage(timings, "resize"):
+                    fitted = self._fit_to_budget(source, faces=faces, steps=steps, float_output=float_output,
+                                                 upsampler=upsampler)
+                if fitted.shape != img.shape:
+                    img = fitted
+                    face_helper = self._restore_faces(img, timings=timings)
+        if timings is not None:
+            timings[FACES] = faces
+            if img.shape != source.shape:
+                timings[DOWNSCALED] = 1
+        return img, face_helper
+
+    def _fit_to_budget(self, img: np.ndarray, faces: int, steps, float_output: bool, upsampler=None) -> np.ndarray:
+        height, width = img.shape[:2]
+        budget = settings.IMAGE_MEMORY_BUDGET_BYTES
+        if budget <= 0:
+            return self._safe_resize(img)
+
+        kwargs = self._memory_kwargs(faces, steps, float_output, upsampler)
+        new_height, new_width = fit_to_budget(height, width, budget, **kwargs)
+        if (new_height, new_width) == (height, width):
+            return img
+        print(f"⚠️ Image too large for the memory budget ({width}x{height}, {faces} faces). Resizing to {new_width}x{new_height}")
+        return cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+    def _safe_resize(self, img: np.ndarray) -> np.ndarray:
         # --- SAFETY RESIZE START ---
         # If image is massive (>1200px), shrink it to prevent RAM crash.
         # 1200px input -> 2400px output (High Quality, Safe RAM)
-        max_dimension = 1200
+        max_dimension = self.SAFE_MAX_DIMENSION
         height, width = img.shape[:2]
-        
+
         if width > max_dimension or height > max_dimension:
             print(f"⚠️ Image too large ({width}x{height}). Resizing to safe limit...")
             scale_factor = max_dimension / max(width, height)
@@ -60,14 +412,62 @@ class AIEngine:
             img = cv2.resize(img, (new_width, new_height), interpolation=cv2.INTER_AREA)
             print(f"✅ Resized to {new_width}x{new_height}")
         # --- SAFETY RESIZE END ---
+        return img
 
-        # GFPGAN handles the whole pipeline
-        _, _, output = self.face_enhancer.enhance(
-            img,
-            has_aligned=False,
-            only_center_face=False,
-            paste_back=True
-        )
+    def _output_buffer(self, height: int, width: int) -> Optional[np.ndarray]:
+        """
+        A memory-mapped output buffer for large results when OUTPUT_MMAP_DIR is
+        set, so the finished tiles can be paged out instead of held in RAM.
+        """
+        scale = self.face_enhancer.upscale
+        shape = (height * scale, width * scale, 3)
+        if not settings.OUTPUT_MMAP_DIR or shape[0] * shape[1] * 3 < settings.OUTPUT_MMAP_MIN_BYTES:
+            return None
+        # Unlinked on creation: nothing is left behind, even if the process dies
+        with tempfile.TemporaryFile(dir=settings.OUTPUT_MMAP_DIR) as f:
+            return np.memmap(f, dtype=np.uint8, mode="w+", shape=shape)
 
-        cv2.imwrite(output_path, output)
-        return output_path
\ No newline at end of file
+    @torch.no_grad()
+    def _restore_faces(self, img: np.ndarray, weight: float = 0.5, timings: Optional[dict] = None):
+        """
+        Detects, aligns and restores every face in `img`.
+        Returns a private copy of the face helper holding this image's state.
+        """
+        with self._lock:
+            face_helper = self.face_enhancer.face_helper
+            with stage(timings, "face_detection"):
+                face_helper.clean_all()
+                face_helper.read_image(img)
+                face_helper.get_face_landmarks_5(only_center_face=False, eye_dist_threshold=5)
+                face_helper.align_warp_face()
+
+            with stage(timings, "face_restoration"):
+                self._restore_cropped_faces(face_helper, weight)
+
+            # clean_all() rebinds every per-image list, so a shallow copy keeps
+            # this image's faces safe from the next caller
+            return copy.copy(face_helper)
+
+    def _restore_cropped_faces(self, face_helper, weight: float):
+        """
+        Runs GFPGAN on every aligned crop. Caller holds self._lock.
+        """
+        for cropped_face in face_helper.cropped_faces:
+            cropped_face_t = img2tensor(cropped_face / 255., bgr2rgb=True, float32=True)
+            normalize(cropped_face_t, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
+            cropped_face_t = cropped_face_t.unsqueeze(0).to(self.device)
+
+            try:
+                output = self.face_enhancer.gfpgan(cropped_face_t, return_rgb=False, weight=weight)[0]
+                restored_face = tensor2img(output.squeeze(0), rgb2bgr=True, min_max=(-1, 1))
+            except RuntimeError as error:
+                print(f"❌ GFPGAN inference failed: {error}")
+                restored_face = cropped_face
+
+            face_helper.add_restored_face(restored_face.astype('uint8'))
+
+        face_helper.get_inverse_affine(None)
+
+
+def _has_faces(face_helper) -> bool:
+    return face_helper is not None and bool(face_helper.restored_faces)
@@ -0,0 +1,208 @@
+import argparse
+import functools
+import hashlib
+import json
+import os
+import platform
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from app.config import settings
+from app.services.memory import estimate_peak_bytes, total_memory
+from app.services.tiling import TileBatcher, TiledUpsampler
+
+# Tuning runs rewrite the whole file; keep concurrent writers in this process from interleaving
+_file_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _cpu_model() -> str:
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def hardware_fingerprint(device="cpu", threads: Optional[int] = None) -> dict:
+    """
+    What the fastest tile size depends on. `threads` is the torch intra-op
+    thread count the tiles will run with (default: this process's).
+    """
+    device = torch.device(device)
+    info = {
+        "device": device.type,
+        "cpu": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "threads": threads or torch.get_num_threads(),
+        "memory_bytes": total_memory(),
+        "torch": torch.__version__,
+        "tile_batch": settings.TILE_BATCH_SIZE,
+    }
+    if device.type == "cuda":
+        info["gpu"] = torch.cuda.get_device_name(device)
+    return info
+
+
+def hardware_key(info: dict) -> str:
+    return hashlib.sha256(json.dumps(info, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def load_tuning(path: str, info: dict) -> Optional[dict]:
+    """
+    The stored tuning run for this hardware, or None.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f).get(hardware_key(info))
+    except (OSError, ValueError):
+        return None
+
+
+def save_tuning(path: str, info: dict, results: List[dict], winner: dict) -> dict:
+    entry = {
+        "hardware": info,
+        "tile": winner["tile"],
+        "tile_pad": winner["tile_pad"],
+        "measured_at": time.time(),
+        "results": results,
+    }
+    with _file_lock:
+        try:
+            with open(path) as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            stored = {}
+        stored[hardware_key(info)] = entry
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+    return entry
+
+
+def tuned_tile(device="cpu", threads: Optional[int] = None) -> Tuple[int, int]:
+    """
+    (tile, tile_pad) to run with: the stored winner for this hardware unless
+    TILE_AUTOTUNE is "off" or nothing was measured yet, else TILE_SIZE / TILE_PAD.
+    """
+    if settings.TILE_AUTOTUNE != "off":
+        entry = load_tuning(settings.TILE_TUNING_FILE, hardware_fingerprint(device, threads))
+        if entry is not None:
+            return entry["tile"], entry["tile_pad"]
+    return settings.TILE_SIZE, settings.TILE_PAD
+
+
+def benchmark(
+    model: torch.nn.Module,
+    device,
+    tile_sizes: Sequence[int],
+    tile_pads: Sequence[int],
+    image_size: int = 512,
+    repeats: int = 2,
+    scale: int = 2,
+) -> List[dict]:
+    """
+    Upsamples one synthetic `image_size` square image per (tile, tile_pad)
+    pair and records the best of `repeats` timed runs, after one warm-up run.
+    Pairs whose tile activations alone would exceed IMAGE_MEMORY_BUDGET_BYTES
+    are skipped.
+    """
+    device = torch.device(device)
+    batcher = TileBatcher(model, device, max_batch=settings.TILE_BATCH_SIZE, max_wait_ms=settings.TILE_BATCH_WAIT_MS)
+    img = np.random.default_rng(0).integers(0, 256, size=(image_size, image_size, 3), dtype=np.uint8)
+
+    results = []
+    try:
+        for tile in tile_sizes:
+            for tile_pad in tile_pads:
+                peak = estimate_peak_bytes(
+                    image_size, image_size, scale=scale, tile=tile, tile_pad=tile_pad, tile_batch=batcher.max_batch
+                )
+                if 0 < settings.IMAGE_MEMORY_BUDGET_BYTES < peak:
+                    continue
+                upsampler = TiledUpsampler(batcher, scale=scale, tile=tile, tile_pad=tile_pad)
+                upsampler.enhance(img)  # warm-up: allocator, kernel selection
+                best = float("inf")
+                for _ in range(max(1, repeats)):
+                    started = time.perf_counter()
+                    upsampler.enhance(img)
+                    best = min(best, time.perf_counter() - started)
+                results.append({
+                    "tile": tile,
+                    "tile_pad": tile_pad,
+                    "seconds": round(best, 4),
+                    "megapixels_per_second": round(image_size * image_size / best / 1e6, 4),
+                })
+    finally:
+        # Its dispatcher thread would otherwise outlive every autotune run
+        batcher.stop()
+    return results
+
+
+def pick_winner(results: List[dict], min_pad: int) -> Optional[dict]:
+    """
+    The fastest result whose padding is at least `min_pad`: less padding is
+    always faster but shows tile seams, so TILE_PAD acts as a quality floor.
+    """
+    candidates = [r for r in results if r["tile_pad"] >= min_pad] or results
+    return max(candidates, key=lambda r: r["megapixels_per_second"], default=None)
+
+
+def autotune(model: torch.nn.Module, device, threads: Optional[int] = None, **kwargs) -> Optional[dict]:
+    """
+    Benchmarks the configured candidates and stores the winner for this hardware.
+    """
+    tile_sizes = kwargs.pop("tile_sizes", _int_list(settings.TILE_AUTOTUNE_SIZES))
+    tile_pads = kwargs.pop("tile_pads", _int_list(settings.TILE_AUTOTUNE_PADS))
+    print(f"⚡ Tuning Real-ESRGAN tiles: sizes {list(tile_sizes)}, pads {list(tile_pads)}...")
+    results = benchmark(model, device, tile_sizes, tile_pads, **kwargs)
+    winner = pick_winner(results, settings.TILE_PAD)
+    if winner is None:
+        print("⚠️ No tile size fits the memory budget; keeping TILE_SIZE")
+        return None
+    entry = save_tuning(settings.TILE_TUNING_FILE, hardware_fingerprint(device, threads), results, winner)
+    print(f"✅ Best tile: {winner['tile']} (pad {winner['tile_pad']}), {winner['megapixels_per_second']} MP/s")
+    return entry
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    from app.services.ai_engine import build_bg_model
+
+    parser = argparse.ArgumentParser(description="Benchmark Real-ESRGAN tile sizes on this machine and store the fastest.")
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="torch threads, e.g. INFERENCE_THREADS_PER_WORKER in worker-pool mode (default: torch's)")
+    parser.add_argument("--sizes", default=settings.TILE_AUTOTUNE_SIZES)
+    parser.add_argument("--pads", default=settings.TILE_AUTOTUNE_PADS)
+    parser.add_argument("--image-size", type=int, default=settings.TILE_AUTOTUNE_IMAGE_SIZE)
+    parser.add_argument("--repeats", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    # Throughput does not depend on the weight values, so the checkpoint is not loaded
+    model = build_bg_model().eval().to(args.device)
+    entry = autotune(
+        model, args.device, threads=args.threads or None,
+        tile_sizes=_int_list(args.sizes), tile_pads=_int_list(args.pads),
+        image_size=args.image_size, repeats=args.repeats,
+    )
+    if entry is not None:
+        for r in sorted(entry["results"], key=lambda r: -r["megapixels_per_second"]):
+            print(f"  tile {r['tile']:>4} pad {r['tile_pad']:>3}: {r['megapixels_per_second']:.4f} MP/s ({r['seconds']:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
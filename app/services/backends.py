@@ -0,0 +1,295 @@
+import functools
+import json
+import os
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from app.config import settings
+
+# Backends are basicsr architectures (anything registered in basicsr's
+# ARCH_REGISTRY: RRDBNet, SRVGGNetCompact, EDSR, SwinIR, ...), built with
+# `build_network` from a config file (BACKENDS_FILE) shaped like this one.
+# Requests pick one by name or by quality tier; face restoration is GFPGAN
+# whatever the backend. Without BACKENDS_FILE these are the backends:
+DEFAULT_CONFIG = {
+    "default": "realesrgan_x2",
+    "backends": {
+        # What AIEngine always ran (see `build_bg_model`)
+        "realesrgan_x2": {
+            "network": {"type": "RRDBNet", "num_in_ch": 3, "num_out_ch": 3, "num_feat": 64, "num_block": 23,
+                        "num_grow_ch": 32, "scale": 2},
+            "weights": "/app/weights/RealESRGAN_x2plus.pth",
+            "scale": 2,
+        },
+        # realesr-general-x4v3, the preview checkpoint: a fraction of RRDBNet's cost.
+        # Its x4 output is resized down to the pipeline's x2. The autotuned tile is
+        # RRDBNet's, so this one sets its own.
+        "compact_x4": {
+            "network": {"type": "SRVGGNetCompact", "num_in_ch": 3, "num_out_ch": 3, "num_feat": 64,
+                        "num_conv": 32, "upscale": 4, "act_type": "prelu"},
+            "weights": "/app/weights/realesr-general-x4v3.pth",
+            "scale": 4,
+            "tile": 400,
+            "tile_pad": 10,
+        },
+    },
+    "tiers": {"premium": "realesrgan_x2", "standard": "compact_x4"},
+}
+
+
+class UnknownBackendError(ValueError):
+    """Raised when a request names a backend or tier that is not configured (or not installed)."""
+
+
+class BackendSpec(NamedTuple):
+    name: str
+    network: Dict[str, Any]  # build_network options: "type" (an ARCH_REGISTRY name) and its arguments
+    weights: str             # checkpoint, loaded with `load_weights`
+    scale: int               # the network's upscale factor
+    # 0 = the engine's tile size / padding: the autotuned ones for the default backend
+    # (autotune benchmarks its network), TILE_SIZE / TILE_PAD for the others
+    tile: int = 0
+    tile_pad: int = 0
+    tile_batch: int = 0      # tiles per forward; 0 = TILE_BATCH_SIZE
+    instances: int = 1       # warm tile batchers sharing the weights, each with its own dispatcher thread
+
+    @classmethod
+    def from_dict(cls, name: str, value: Dict[str, Any]) -> "BackendSpec":
+        network = value.get("network")
+        if not isinstance(network, dict) or not network.get("type"):
+            raise ValueError(f"Backend '{name}' needs a `network` with a `type`")
+        if not value.get("weights"):
+            raise ValueError(f"Backend '{name}' needs `weights`")
+        spec = cls(
+            name, dict(network), str(value["weights"]), int(value.get("scale", 0)),
+            tile=int(value.get("tile", 0)), tile_pad=int(value.get("tile_pad", 0)),
+            tile_batch=int(value.get("tile_batch", 0)), instances=int(value.get("instances", 1)),
+        )
+        if spec.scale < 1:
+            raise ValueError(f"Backend '{name}' needs the network's upscale factor as `scale`")
+        if min(spec.tile, spec.tile_pad, spec.tile_batch) < 0 or spec.instances < 1:
+            raise ValueError(f"Backend '{name}' has negative tile settings or fewer than one instance")
+        return spec
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "network": self.network["type"],
+            "scale": self.scale,
+            "tile": self.tile,
+            "tile_pad": self.tile_pad,
+            "tile_batch": self.tile_batch,
+            "instances": self.instances,
+        }
+
+
+def _weights_present(path: str) -> bool:
+    from app.services.weights import mapped_path
+    return os.path.exists(mapped_path(path)) or os.path.exists(path)
+
+
+class BackendConfig:
+    """
+    The configured backends, the quality tiers mapping onto them, and the
+    default backend (the one requests get when they name none).
+    """
+
+    def __init__(self, backends: Dict[str, BackendSpec], tiers: Dict[str, str], default: str):
+        self.backends = backends
+        self.tiers = tiers
+        self.default = default
+
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any]) -> "BackendConfig":
+        entries = config.get("backends")
+        if not isinstance(entries, dict) or not entries:
+            raise ValueError("Backend config needs at least one entry in `backends`")
+        backends = {name: BackendSpec.from_dict(name, value) for name, value in entries.items()}
+        default = config.get("default") or next(iter(backends))
+        if default not in backends:
+            raise ValueError(f"Default backend '{default}' is not configured")
+        tiers = dict(config.get("tiers") or {})
+        for tier, name in tiers.items():
+            if name not in backends:
+                raise ValueError(f"Tier '{tier}' maps to unknown backend '{name}'")
+            if tier in backends and tier != name:
+                raise ValueError(f"Tier '{tier}' has the name of another backend")
+        return cls(backends, tiers, default)
+
+    def installed(self, name: str) -> bool:
+        """
+        True when the backend's checkpoint (or its converted flat file) is on disk.
+        """
+        return _weights_present(self.backends[name].weights)
+
+    def resolve(self, choice: Optional[str]) -> Optional[str]:
+        """
+        The backend a request asking for `choice` (a backend name, a tier or
+        None) runs on, or None for the default backend. A tier whose backend
+        is not installed falls back to the default; a backend asked for by
+        name must be installed.
+        """
+        if not choice:
+            return None
+        if choice in self.backends:
+            if not self.installed(choice):
+                raise UnknownBackendError(f"Backend '{choice}' is not installed on this server")
+            return choice if choice != self.default else None
+        if choice in self.tiers:
+            name = self.tiers[choice]
+            if name == self.default or not self.installed(name):
+                return None
+            return name
+        options = ", ".join([*self.backends, *self.tiers])
+        raise UnknownBackendError(f"Unknown backend '{choice}' (choose from {options})")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "default": self.default,
+            "tiers": dict(self.tiers),
+            "backends": {
+                name: {**spec.to_dict(), "installed": self.installed(name)} for name, spec in self.backends.items()
+            },
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def load_backend_config(path: str) -> BackendConfig:
+    """
+    The backend config in JSON file `path` ("" = DEFAULT_CONFIG).
+    """
+    if not path:
+        return BackendConfig.from_dict(DEFAULT_CONFIG)
+    with open(path) as f:
+        return BackendConfig.from_dict(json.load(f))
+
+
+def backend_config() -> BackendConfig:
+    return load_backend_config(settings.BACKENDS_FILE)
+
+
+def backend_fingerprint(name: str) -> dict:
+    """
+    Everything about a backend that changes the output image, for cache keys
+    of requests that run on it.
+    """
+    from app.services.ai_engine import weights_id
+
+    spec = backend_config().backends[name]
+    return {
+        "name": name,
+        "network": spec.network,
+        "weights": weights_id(spec.weights),
+        "tile": spec.tile,
+        "tile_pad": spec.tile_pad,
+    }
+
+
+class Backend:
+    """
+    One loaded backend: its network (weights loaded once) and `instances`
+    warm TileBatcher + TiledUpsampler pairs over it. Renders take the
+    instance with the fewest tiles waiting.
+    """
+
+    def __init__(self, spec: BackendSpec, device):
+        from basicsr.archs import build_network
+        from app.services.weights import load_weights
+
+        self.spec = spec
+        self.device = device
+        model = build_network(dict(spec.network))
+        print(f"   {spec.name} weights: {load_weights(model, spec.weights)}")
+        self.model = model.eval().to(device)
+        self.upsamplers = []
+
+    @property
+    def name(self) -> str:
+        return self.spec.name
+
+    def init_runtime(self, tile: int, tile_pad: int):
+        """
+        Starts the instances' dispatcher threads; `tile` / `tile_pad` are the
+        engine's, used where the spec leaves them at 0.
+        """
+        from app.services.tiling import RRDBNET_MOD_SCALE, TileBatcher, TiledUpsampler
+
+        spec = self.spec
+        self.upsamplers = [
+            TiledUpsampler(
+                TileBatcher(
+                    self.model,
+                    self.device,
+                    max_batch=spec.tile_batch or settings.TILE_BATCH_SIZE,
+                    max_wait_ms=settings.TILE_BATCH_WAIT_MS,
+                ),
+                scale=spec.scale,
+                tile=spec.tile or tile,
+                tile_pad=spec.tile_pad or tile_pad,
+                pre_pad=0,
+                # Only RRDBNet unshuffles its input; other networks take any size
+                mod_scale=RRDBNET_MOD_SCALE if spec.network["type"] == "RRDBNet" else None,
+            )
+            for _ in range(spec.instances)
+        ]
+
+    def upsampler(self):
+        return min(self.upsamplers, key=lambda upsampler: upsampler.batcher.backlog)
+
+    def stats(self) -> Dict[str, Any]:
+        batchers = [upsampler.batcher for upsampler in self.upsamplers]
+        first = self.upsamplers[0] if self.upsamplers else None
+        return {
+            **self.spec.to_dict(),
+            "tile": first.tile_size if first is not None else None,
+            "tile_pad": first.tile_pad if first is not None else None,
+            "batches": sum(batcher.batches for batcher in batchers),
+            "tiles": sum(batcher.tiles for batcher in batchers),
+            "backlog": sum(batcher.backlog for batcher in batchers),
+        }
+
+
+class BackendRegistry:
+    """
+    Every installed backend of `config`, loaded on `device`. The default
+    backend must load; the others are skipped, with a warning, when their
+    weights are missing.
+    """
+
+    def __init__(self, config: BackendConfig, device):
+        self.config = config
+        self._backends: Dict[str, Backend] = {}
+        for name, spec in config.backends.items():
+            if name != config.default and not config.installed(name):
+                print(f"⚠️ Backend {name}: {os.path.basename(spec.weights)} not found, skipping it")
+                continue
+            print(f"⚡ Loading backend {name} ({spec.network['type']} x{spec.scale})...")
+            self._backends[name] = Backend(spec, device)
+
+    @property
+    def default(self) -> Backend:
+        return self._backends[self.config.default]
+
+    def names(self) -> List[str]:
+        return list(self._backends)
+
+    def get(self, name: Optional[str] = None) -> Backend:
+        backend = self._backends.get(name or self.config.default)
+        if backend is None:
+            raise UnknownBackendError(f"Backend '{name}' is not loaded")
+        return backend
+
+    def models(self) -> list:
+        return [backend.model for backend in self._backends.values()]
+
+    def init_runtime(self, tile: int, tile_pad: int):
+        """
+        `tile` / `tile_pad` are the autotuned ones, which were measured on the
+        default backend's network only.
+        """
+        for name, backend in self._backends.items():
+            if name == self.config.default:
+                backend.init_runtime(tile, tile_pad)
+            else:
+                backend.init_runtime(settings.TILE_SIZE, settings.TILE_PAD)
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: backend.stats() for name, backend in self._backends.items()}
@@ -0,0 +1,116 @@
+import asyncio
+import collections
+import os
+import zipfile
+from typing import IO, Any, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.codecs import sniff_format
+from app.services.jobs import QueueFullError
+
+# A batch page: (filename, read). `read()` returns the page bytes and may be called
+# more than once, so a page can be re-read instead of held while it waits for admission.
+Page = Tuple[str, Callable[[], bytes]]
+
+# Pause before retrying admission when the job queue is full and none of the batch's own pages are running
+_QUEUE_FULL_BACKOFF_SECONDS = 0.5
+
+
+class BatchTooLargeError(ValueError):
+    """Raised when a batch has more pages than the server accepts."""
+
+
+def upload_page(filename: str, fileobj: IO[bytes]) -> Page:
+    def read() -> bytes:
+        fileobj.seek(0)
+        return fileobj.read()
+    return filename, read
+
+
+def archive_pages(fileobj: IO[bytes], max_files: int) -> List[Page]:
+    """
+    The pages of a zip upload in name order: every file member, skipping
+    directories and macOS resource forks. Members are read on demand.
+    Raises zipfile.BadZipFile for anything that is not a zip.
+    """
+    archive = zipfile.ZipFile(fileobj)
+    members = sorted(
+        (info for info in archive.infolist()
+         if not info.is_dir() and not info.filename.startswith("__MACOSX/")
+         and not os.path.basename(info.filename).startswith(".")),
+        key=lambda info: info.filename,
+    )
+    if len(members) > max_files:
+        raise BatchTooLargeError(f"Archive has {len(members)} files; the limit is {max_files}")
+    return [(info.filename, lambda info=info: archive.read(info)) for info in members]
+
+
+async def run_batch(
+    pages: List[Page],
+    admit: Callable[[bytes, str], Awaitable[Any]],
+    window: int,
+) -> AsyncIterator[Tuple[int, str, Optional[Any], Optional[str]]]:
+    """
+    Feeds `pages` through `admit(data, filename)`, which returns a Job, and
+    yields (index, filename, job, error) as each page finishes, in completion
+    order. Undecodable pages come back with job None and an error.
+
+    At most `window` pages are admitted at once: enough to keep every job
+    thread busy, so one page decodes and uploads while another is in the
+    models, without flooding the shared queue. A full queue (other traffic)
+    just holds back the next page until one of ours finishes.
+    """
+    queued = collections.deque(enumerate(pages))
+    running = {}  # asyncio future -> (index, filename, job)
+    while queued or running:
+        while queued and len(running) < window:
+            index, (filename, read) = queued[0]
+            data = await run_in_threadpool(read)
+            if sniff_format(data) is None:
+                queued.popleft()
+                yield index, filename, None, "Not a supported image (JPEG, PNG, WebP, BMP or TIFF)"
+                continue
+            try:
+                job = await admit(data, filename)
+            except QueueFullError:
+                break
+            except Exception as e:
+                queued.popleft()
+                yield index, filename, None, str(e)
+                continue
+            queued.popleft()
+            running[asyncio.ensure_future(asyncio.wrap_future(job.future))] = (index, filename, job)
+
+        if not running:
+            if queued:
+                await asyncio.sleep(_QUEUE_FULL_BACKOFF_SECONDS)
+            continue
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for finished in done:
+            finished.exception()  # the job records its own error; mark this one retrieved
+            index, filename, job = running.pop(finished)
+            yield index, filename, job, None
+
+
+class ZipStream:
+    """
+    Write-only file object for zipfile.ZipFile. It has no tell(), so ZipFile
+    writes sizes in data descriptors after each member instead of seeking
+    back, and what it wrote so far can be streamed out with `drain()`.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
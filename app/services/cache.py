@@ -0,0 +1,212 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+def content_key(data: bytes, fingerprint: str) -> str:
+    """
+    Content address of a request: the input bytes plus everything that changes the output.
+    """
+    digest = hashlib.sha256()
+    digest.update(fingerprint.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier LRU cache of final outputs keyed by `content_key`.
+
+    A small in-memory tier serves hot entries without I/O; a larger on-disk
+    tier survives restarts. Each tier evicts least-recently-used entries once
+    its byte budget is exceeded. Every entry carries a small JSON metadata
+    dict (media type, uploaded URLs) next to the image bytes.
+    """
+
+    def __init__(self, directory: str, max_disk_bytes: int, max_memory_bytes: int):
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[bytes, Dict[str, Any]]]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+
+        if self.max_disk_bytes > 0:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_index()
+
+    def get(self, key: str) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+            on_disk = key in self._disk
+
+        if on_disk:
+            try:
+                with open(self._data_path(key), "rb") as f:
+                    data = f.read()
+                with open(self._meta_path(key), "r") as f:
+                    meta = json.load(f)
+                # Keep mtime as the LRU clock so the order survives restarts
+                os.utime(self._data_path(key))
+            except (OSError, ValueError):
+                with self._lock:
+                    self._drop_disk(key)
+                    self.misses += 1
+                return None
+
+            with self._lock:
+                if key in self._disk:
+                    self._disk.move_to_end(key)
+                self._remember(key, data, meta)
+                self.disk_hits += 1
+            return data, meta
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, data: bytes, meta: Dict[str, Any]):
+        if self.max_disk_bytes > 0 and len(data) <= self.max_disk_bytes:
+            try:
+                # Data first: the .json is what marks an entry as complete on disk
+                self._write_atomic(self._data_path(key), data)
+                self._write_atomic(self._meta_path(key), json.dumps(meta).encode("utf-8"))
+            except OSError as e:
+                print(f"⚠️ Cache write failed: {e}")
+                with self._lock:
+                    self._drop_disk(key)
+            else:
+                with self._lock:
+                    if key in self._disk:
+                        self._disk_bytes -= self._disk.pop(key)
+                    self._disk[key] = len(data)
+                    self._disk_bytes += len(data)
+                    self._evict_disk()
+
+        with self._lock:
+            self._remember(key, data, meta)
+
+    def update_meta(self, key: str, meta: Dict[str, Any]):
+        """
+        Replaces an entry's metadata (e.g. after uploading it to another bucket).
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory[key] = (entry[0], meta)
+            on_disk = key in self._disk
+        if on_disk:
+            try:
+                self._write_atomic(self._meta_path(key), json.dumps(meta).encode("utf-8"))
+            except OSError as e:
+                print(f"⚠️ Cache write failed: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "hits": self.memory_hits + self.disk_hits,
+                "misses": self.misses,
+                "memory_evictions": self.memory_evictions,
+                "disk_evictions": self.disk_evictions,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+            }
+
+    # --- internals (callers hold self._lock unless noted) ---
+
+    def _remember(self, key: str, data: bytes, meta: Dict[str, Any]):
+        if len(data) > self.max_memory_bytes:
+            return
+        if key in self._memory:
+            self._memory_bytes -= len(self._memory.pop(key)[0])
+        self._memory[key] = (data, meta)
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, (old, _) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+            self.memory_evictions += 1
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            key = next(iter(self._disk))
+            self._drop_disk(key)
+            self.disk_evictions += 1
+
+    def _drop_disk(self, key: str):
+        size = self._disk.pop(key, None)
+        if size is not None:
+            self._disk_bytes -= size
+        for path in (self._data_path(key), self._meta_path(key)):
+            _remove(path)
+
+    def _load_index(self):
+        """
+        Called from __init__ only. Rebuilds the LRU order from mtimes (oldest
+        first == least recently used) and deletes leftovers of interrupted
+        writes: temp files and .bin/.json files missing their partner.
+        """
+        names = set(os.listdir(self.directory))
+        entries = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            stem, ext = os.path.splitext(name)
+            if ext == ".tmp":
+                _remove(path)
+            elif ext == ".bin" and f"{stem}.json" in names:
+                st = os.stat(path)
+                entries.append((st.st_mtime, stem, st.st_size))
+            elif ext == ".bin" or (ext == ".json" and f"{stem}.bin" not in names):
+                _remove(path)
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_bytes += size
+        self._evict_disk()
+
+    def _write_atomic(self, path: str, data: bytes):
+        # Not under the lock: a temp file + rename keeps readers from seeing partial writes
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            _remove(tmp_path)
+            raise
+
+    def _data_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,40 +1,489 @@
+import hashlib
+import heapq
+import itertools
+import json
 import os
-from google.cloud import storage
-from datetime import datetime
+import random
+import threading
+import time
 import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import quote
 
-# If we are in local dev/codespace, we might Mock this if no creds are present
-class GCSService:
-    def __init__(self):
-        # We try to connect. If it fails (no creds), we log a warning.
+from app.core import metrics
+
+_SCOPES = ("https://www.googleapis.com/auth/devstorage.read_write",)
+
+# Originals known to be in their bucket, so repeats skip even the existence check
+_KNOWN_ORIGINALS = 4096
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """
+    Seconds to wait before retry number `attempt` (1 = the first retry):
+    exponential, capped, with jitter so failed uploads don't retry in lockstep.
+    """
+    return min(cap, base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        _remove(tmp_path)
+        raise
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class GoogleCloudStore:
+    """
+    Google Cloud Storage through one authorized HTTP session whose connection
+    pool holds `pool_size` connections, so concurrent uploads reuse warm TLS
+    connections instead of opening (or waiting for) new ones.
+    """
+
+    def __init__(self, pool_size: int = 16):
+        import google.auth
+        from google.auth.transport.requests import AuthorizedSession
+        from google.cloud import storage
+        from requests.adapters import HTTPAdapter
+
+        credentials, project = google.auth.default(scopes=_SCOPES)
+        session = AuthorizedSession(credentials)
+        session.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        self.client = storage.Client(project=project, credentials=credentials, _http=session)
+        self._buckets = {}
+
+    def put(self, bucket: str, name: str, data: bytes, content_type: Optional[str] = None,
+            metadata: Optional[Dict[str, str]] = None):
+        blob = self._bucket(bucket).blob(name)
+        if metadata:
+            blob.metadata = metadata
+        # Retries are GCSService's, which can hand them to the spool
+        blob.upload_from_string(data, content_type=content_type, retry=None)
+
+    def exists(self, bucket: str, name: str) -> bool:
+        return self._bucket(bucket).blob(name).exists()
+
+    def url(self, bucket: str, name: str) -> str:
+        # What blob.public_url returns, without building a blob
+        return f"https://storage.googleapis.com/{bucket}/{quote(name, safe='/~')}"
+
+    def permanent(self, error: Exception) -> bool:
+        from google.api_core import exceptions
+        return isinstance(error, (exceptions.BadRequest, exceptions.Unauthorized, exceptions.Forbidden,
+                                  exceptions.NotFound))
+
+    def _bucket(self, name: str):
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            bucket = self._buckets[name] = self.client.bucket(name)
+        return bucket
+
+
+class FilesystemStore:
+    """
+    A fake bucket on the local filesystem, for tests and offline runs:
+    objects are files under `root`/<bucket>/<name>, with their content type
+    and metadata in a ".meta.json" file next to them. Setting `fail_next`
+    makes that many uploads fail, like a flaky network would.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.puts = 0
+        self.fail_next = 0
+        self._lock = threading.Lock()
+
+    def put(self, bucket: str, name: str, data: bytes, content_type: Optional[str] = None,
+            metadata: Optional[Dict[str, str]] = None):
+        with self._lock:
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                raise ConnectionError("Simulated upload failure")
+        path = self._path(bucket, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _write_atomic(path, data)
+        meta = {"content_type": content_type, "metadata": metadata or {}}
+        _write_atomic(f"{path}.meta.json", json.dumps(meta).encode("utf-8"))
+        with self._lock:
+            self.puts += 1
+
+    def exists(self, bucket: str, name: str) -> bool:
+        return os.path.exists(self._path(bucket, name))
+
+    def read(self, bucket: str, name: str) -> bytes:
+        with open(self._path(bucket, name), "rb") as f:
+            return f.read()
+
+    def url(self, bucket: str, name: str) -> str:
+        return Path(os.path.abspath(self._path(bucket, name))).as_uri()
+
+    def permanent(self, error: Exception) -> bool:
+        return False
+
+    def _path(self, bucket: str, name: str) -> str:
+        return os.path.join(self.root, bucket, *name.split("/"))
+
+
+class UploadSpool:
+    """
+    Durable write-behind queue. `add` writes the object and its record to
+    `directory` (data first, then the record that marks it complete) and
+    returns; `workers` threads upload it in the background and delete it
+    once stored. A failed upload is retried with exponential backoff; after
+    `max_attempts` (or a permanent error) it is parked in `directory`/failed.
+    Whatever is left when the process stops, parked uploads included, is
+    uploaded again by the next spool on the same directory.
+    """
+
+    def __init__(self, directory: str, store, workers: int = 2, max_attempts: int = 10, backoff: float = 0.5,
+                 max_backoff: float = 60.0):
+        self.directory = directory
+        self.failed_directory = os.path.join(directory, "failed")
+        self.store = store
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.uploaded = 0
+        self.retries = 0
+        self.failed = 0
+
+        self._due = []  # (monotonic due time, seq, entry id)
+        self._seq = itertools.count()
+        self._active = 0
+        self._stopped = False
+        self._cond = threading.Condition()
+        os.makedirs(self.failed_directory, exist_ok=True)
+        self._load()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"upload-spool-{i}", daemon=True) for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def add(self, bucket: str, name: str, data: bytes, content_type: Optional[str] = None,
+            metadata: Optional[Dict[str, str]] = None) -> str:
+        entry_id = uuid.uuid4().hex
+        record = {"bucket": bucket, "name": name, "content_type": content_type, "metadata": metadata or {},
+                  "attempts": 0, "queued_at": time.time()}
+        _write_atomic(self._path(entry_id, ".bin"), data)
+        _write_atomic(self._path(entry_id, ".json"), json.dumps(record).encode("utf-8"))
+        self._schedule(entry_id, 0.0)
+        return entry_id
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._due) + self._active
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until every queued upload is stored or parked. Returns False on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._due or self._active:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        parked = sum(1 for name in os.listdir(self.failed_directory) if name.endswith(".json"))
+        return {
+            "pending": self.pending(),
+            "uploaded": self.uploaded,
+            "retries": self.retries,
+            "failed": self.failed,
+            "parked": parked,
+        }
+
+    def shutdown(self, timeout: float = 0.0):
+        """
+        Stops the workers after at most `timeout` seconds of draining; what is
+        still queued stays on disk for the next start.
+        """
+        if timeout > 0:
+            self.flush(timeout)
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+
+    def _path(self, entry_id: str, ext: str, directory: Optional[str] = None) -> str:
+        return os.path.join(directory or self.directory, f"{entry_id}{ext}")
+
+    def _schedule(self, entry_id: str, delay: float):
+        with self._cond:
+            heapq.heappush(self._due, (time.monotonic() + delay, next(self._seq), entry_id))
+            self._cond.notify_all()
+
+    def _load(self):
+        """
+        Called from __init__ only. Requeues every complete entry, parked ones
+        with fresh attempts, and deletes leftovers of interrupted writes.
+        """
+        for name in os.listdir(self.failed_directory):
+            if name.endswith((".bin", ".json")):
+                os.replace(os.path.join(self.failed_directory, name), os.path.join(self.directory, name))
+        names = set(os.listdir(self.directory))
+        entries = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            stem, ext = os.path.splitext(name)
+            if ext == ".tmp":
+                _remove(path)
+            elif ext == ".bin" and f"{stem}.json" not in names:
+                _remove(path)
+            elif ext == ".json" and f"{stem}.bin" in names:
+                entries.append((os.stat(path).st_mtime, stem))
+            elif ext == ".json":
+                _remove(path)
+        for _, entry_id in sorted(entries):
+            self._reset_attempts(entry_id)
+            self._schedule(entry_id, 0.0)
+        if entries:
+            print(f"📤 Resuming {len(entries)} spooled upload(s) from {self.directory}")
+
+    def _reset_attempts(self, entry_id: str):
+        path = self._path(entry_id, ".json")
         try:
-            self.client = storage.Client()
-            self.valid = True
+            with open(path) as f:
+                record = json.load(f)
+            if record.get("attempts"):
+                record["attempts"] = 0
+                _write_atomic(path, json.dumps(record).encode("utf-8"))
+        except (OSError, ValueError):
+            pass
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if self._due:
+                        wait = self._due[0][0] - time.monotonic()
+                        if wait <= 0:
+                            break
+                    else:
+                        wait = None
+                    self._cond.wait(wait)
+                if self._stopped:
+                    return
+                _, _, entry_id = heapq.heappop(self._due)
+                self._active += 1
+            try:
+                self._upload(entry_id)
+            except Exception as e:
+                print(f"❌ Spooled upload {entry_id} crashed: {e}")
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+
+    def _upload(self, entry_id: str):
+        try:
+            with open(self._path(entry_id, ".json")) as f:
+                record = json.load(f)
+            with open(self._path(entry_id, ".bin"), "rb") as f:
+                data = f.read()
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Dropping unreadable spooled upload {entry_id}: {e}")
+            for ext in (".bin", ".json"):
+                _remove(self._path(entry_id, ext))
+            return
+
+        try:
+            self.store.put(record["bucket"], record["name"], data, record["content_type"], record["metadata"])
         except Exception as e:
-            print(f"⚠️ GCS Warning: Could not connect to Google Cloud. {e}")
-            print("⚠️ Files will be saved LOCALLY only.")
-            self.valid = False
+            attempts = record["attempts"] + 1
+            if attempts >= self.max_attempts or self.store.permanent(e):
+                print(f"❌ Upload of {record['name']} failed {attempts} time(s), parking it: {e}")
+                for ext in (".bin", ".json"):
+                    os.replace(self._path(entry_id, ext), self._path(entry_id, ext, self.failed_directory))
+                with self._cond:
+                    self.failed += 1
+                metrics.ERRORS.inc("upload")
+                return
+            record["attempts"] = attempts
+            _write_atomic(self._path(entry_id, ".json"), json.dumps(record).encode("utf-8"))
+            with self._cond:
+                self.retries += 1
+            self._schedule(entry_id, backoff_delay(attempts, self.backoff, self.max_backoff))
+            return
+
+        for ext in (".json", ".bin"):
+            _remove(self._path(entry_id, ext))
+        with self._cond:
+            self.uploaded += 1
+
+
+class GCSService:
+    """
+    Uploads to a bucket store (Google Cloud Storage unless another `store`,
+    e.g. a FilesystemStore, is given):
+
+    * `upload_bytes` uploads now, retrying failures `attempts` times with
+      backoff. Originals are stored under their content hash, and one that
+      is already in the bucket is not uploaded again.
+    * `upload_async` does the same on a pool of `workers` threads, so the
+      caller can render while the original uploads.
+    * `upload_behind` hands the object to a durable UploadSpool in
+      `spool_dir` and returns its URL right away ("" = upload now instead).
+
+    Without a store (no GCS credentials) nothing is kept and every upload
+    returns a mock URL.
+    """
+
+    def __init__(self, store=None, spool_dir: str = "", workers: int = 8, attempts: int = 3, backoff: float = 0.5,
+                 spool_attempts: int = 10, max_backoff: float = 60.0):
+        if store is None:
+            # We try to connect. If it fails (no creds), we log a warning.
+            try:
+                store = GoogleCloudStore(pool_size=workers + 2)
+            except Exception as e:
+                print(f"⚠️ GCS Warning: Could not connect to Google Cloud. {e}")
+                print("⚠️ Files will be saved LOCALLY only.")
+        self.store = store
+        self.valid = store is not None
+        self.attempts = max(1, attempts)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.uploads = 0
+        self.deduplicated = 0
+        self.retries = 0
+        self.failures = 0
+
+        self._known = {}  # (bucket, name) of originals known to be stored, oldest first
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="gcs-upload")
+        self.spool = None
+        if self.valid and spool_dir:
+            self.spool = UploadSpool(spool_dir, store, workers=max(1, workers // 4), max_attempts=spool_attempts,
+                                     backoff=backoff, max_backoff=max_backoff)
 
     def upload_file(self, file_path: str, bucket_name: str, folder="images"):
         """
         Uploads a local file to GCS and returns the public URL.
         """
+        with open(file_path, "rb") as f:
+            data = f.read()
+        return self.upload_bytes(data, os.path.basename(file_path), bucket_name, folder=folder)
+
+    def upload_bytes(self, data: bytes, filename: str, bucket_name: str, folder="images", content_type=None):
+        """
+        Uploads an in-memory buffer and returns its public URL, or None when
+        every attempt failed.
+        """
         if not self.valid:
-            return f"http://localhost/mock/{os.path.basename(file_path)}"
+            return f"http://localhost/mock/{quote(filename)}"
 
+        name = self._blob_name(data, filename, folder)
+        dedupe = folder == "originals"
         try:
-            bucket = self.client.bucket(bucket_name)
-            
-            # Create a unique filename to prevent overwrites
-            filename = f"{folder}/{uuid.uuid4()}_{os.path.basename(file_path)}"
-            blob = bucket.blob(filename)
-            
-            blob.upload_from_filename(file_path)
-            
-            # Make public (optional, depends on client security needs)
-            # blob.make_public()
-            
-            return blob.public_url
+            if dedupe and self._stored(bucket_name, name):
+                with self._lock:
+                    self.deduplicated += 1
+                return self.store.url(bucket_name, name)
+            self._put(bucket_name, name, data, content_type, {"filename": filename} if dedupe else None)
         except Exception as e:
             print(f"❌ Upload Failed: {e}")
-            return None
\ No newline at end of file
+            with self._lock:
+                self.failures += 1
+            metrics.ERRORS.inc("upload")
+            return None
+        if dedupe:
+            self._remember(bucket_name, name)
+        return self.store.url(bucket_name, name)
+
+    def upload_async(self, data: bytes, filename: str, bucket_name: str, folder="images",
+                     content_type=None) -> Future:
+        """
+        `upload_bytes` on the upload threads. The Future resolves to the URL (or None).
+        """
+        return self._executor.submit(self.upload_bytes, data, filename, bucket_name, folder, content_type)
+
+    def upload_behind(self, data: bytes, filename: str, bucket_name: str, folder="images", content_type=None):
+        """
+        Spools the upload and returns the URL the object will have once the
+        spool has stored it; uploads right away when there is no spool.
+        """
+        if self.spool is None:
+            return self.upload_bytes(data, filename, bucket_name, folder=folder, content_type=content_type)
+        name = self._blob_name(data, filename, folder)
+        try:
+            self.spool.add(bucket_name, name, data, content_type)
+        except OSError as e:
+            print(f"⚠️ Upload spool write failed, uploading now: {e}")
+            return self.upload_bytes(data, filename, bucket_name, folder=folder, content_type=content_type)
+        return self.store.url(bucket_name, name)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "store": type(self.store).__name__ if self.store is not None else None,
+                "uploads": self.uploads,
+                "deduplicated": self.deduplicated,
+                "retries": self.retries,
+                "failures": self.failures,
+            }
+        stats["spool"] = self.spool.stats() if self.spool is not None else None
+        return stats
+
+    def shutdown(self, timeout: float = 0.0):
+        self._executor.shutdown(wait=False)
+        if self.spool is not None:
+            self.spool.shutdown(timeout)
+
+    def _blob_name(self, data: bytes, filename: str, folder: str) -> str:
+        if folder == "originals":
+            # Content-addressed, so a repeated upload maps to the object already stored
+            return f"{folder}/{hashlib.sha256(data).hexdigest()}{os.path.splitext(filename)[1].lower()}"
+        # Create a unique filename to prevent overwrites
+        return f"{folder}/{uuid.uuid4()}_{filename}"
+
+    def _stored(self, bucket: str, name: str) -> bool:
+        with self._lock:
+            if (bucket, name) in self._known:
+                return True
+        if self.store.exists(bucket, name):
+            self._remember(bucket, name)
+            return True
+        return False
+
+    def _remember(self, bucket: str, name: str):
+        with self._lock:
+            self._known.pop((bucket, name), None)
+            self._known[(bucket, name)] = True
+            while len(self._known) > _KNOWN_ORIGINALS:
+                del self._known[next(iter(self._known))]
+
+    def _put(self, bucket: str, name: str, data: bytes, content_type: Optional[str],
+             metadata: Optional[Dict[str, str]]):
+        for attempt in range(1, self.attempts + 1):
+            try:
+                self.store.put(bucket, name, data, content_type, metadata)
+            except Exception as e:
+                if attempt == self.attempts or self.store.permanent(e):
+                    raise
+                with self._lock:
+                    self.retries += 1
+                time.sleep(backoff_delay(attempt, self.backoff, self.max_backoff))
+            else:
+                with self._lock:
+                    self.uploads += 1
+                return
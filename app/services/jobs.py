@@ -0,0 +1,207 @@
+import heapq
+import itertools
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the job queue is at capacity and cannot accept more work."""
+
+
+@dataclass
+class Job:
+    id: str
+    status: JobStatus = JobStatus.QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    estimated_ms: Optional[float] = None
+    future: Optional[Future] = field(default=None, repr=False)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status.value,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "estimated_ms": self.estimated_ms,
+        }
+
+
+class JobManager:
+    """
+    Runs blocking enhancement work on a bounded thread pool so the event loop
+    stays free. Jobs are kept in memory and forgotten `ttl` seconds after they
+    finish, or earlier once more than `max_retained` finished jobs are held.
+
+    Finished results may carry the encoded output under "image". Those bytes
+    are capped at `max_result_bytes` in total: past the budget the oldest
+    jobs lose their "image" (the status and URLs stay) and callers have to
+    fetch it from somewhere else, e.g. the result cache.
+
+    Waiting jobs run shortest expected job first: a free thread takes the job
+    with the lowest `estimated_ms` minus `aging` times the milliseconds it has
+    waited, so a long job is overtaken by short ones only for a bounded time.
+    Jobs without an estimate count as 0 ms and keep their FIFO order.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 1,
+        max_pending: int = 32,
+        ttl: float = 3600.0,
+        max_retained: int = 256,
+        max_result_bytes: int = 256 * 1024 ** 2,
+        aging: float = 1.0,
+    ):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.max_retained = max_retained
+        self.max_result_bytes = max_result_bytes
+        self.aging = aging
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="enhance")
+        self._jobs: Dict[str, Job] = {}
+        # (priority, sequence, job, fn, args, kwargs); the executor only runs `_run_next`
+        self._queue: List[Tuple[float, int, Job, Callable, tuple, dict]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., Dict[str, Any]], *args, estimated_ms: Optional[float] = None, **kwargs) -> Job:
+        """
+        Queues `fn(*args, **kwargs)` and returns the Job immediately.
+        `estimated_ms` is the predicted run time, used to order waiting jobs.
+        Raises QueueFullError when `max_pending` jobs are already waiting or running.
+        """
+        with self._lock:
+            self._evict_expired()
+            if self._pending_count() >= self.max_pending:
+                raise QueueFullError(f"Job queue is full ({self.max_pending} pending)")
+            job = Job(id=uuid.uuid4().hex, estimated_ms=estimated_ms)
+            job.future = Future()
+            self._jobs[job.id] = job
+            # Aging is linear for every job, so the order never changes while they wait:
+            # the priority can be fixed at submit time
+            priority = (estimated_ms or 0.0) + self.aging * time.monotonic() * 1000.0
+            heapq.heappush(self._queue, (priority, next(self._sequence), job, fn, args, kwargs))
+
+        self._executor.submit(self._run_next)
+        return job
+
+    def complete(self, result: Dict[str, Any]) -> Job:
+        """
+        Registers a job that is already done (e.g. answered from the result cache).
+        """
+        now = time.time()
+        job = Job(id=uuid.uuid4().hex, status=JobStatus.DONE, started_at=now, finished_at=now, result=result)
+        job.future = Future()
+        job.future.set_result(result)
+        with self._lock:
+            self._evict_expired()
+            self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {status.value: 0 for status in JobStatus}
+            for job in self._jobs.values():
+                counts[job.status.value] += 1
+            counts["result_bytes"] = sum(_result_bytes(job) for job in self._jobs.values())
+            counts["queued_estimated_ms"] = round(sum(item[2].estimated_ms or 0.0 for item in self._queue), 1)
+        counts["max_workers"] = self.max_workers
+        counts["max_pending"] = self.max_pending
+        counts["max_result_bytes"] = self.max_result_bytes
+        return counts
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _run_next(self):
+        # One call per submitted job, but it runs whichever waiting job is due first
+        with self._lock:
+            _, _, job, fn, args, kwargs = heapq.heappop(self._queue)
+        self._run(job, fn, args, kwargs)
+
+    def _run(self, job: Job, fn: Callable[..., Dict[str, Any]], args, kwargs):
+        job.status = JobStatus.RUNNING
+        job.started_at = time.time()
+        error = None
+        try:
+            job.result = fn(*args, **kwargs)
+            job.status = JobStatus.DONE
+        except Exception as e:
+            traceback.print_exc()
+            error = e
+            job.error = str(e)
+            job.status = JobStatus.FAILED
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._evict_expired()
+
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(job.result)
+
+    def _pending_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.finished)
+
+    def _evict_expired(self):
+        cutoff = time.time() - self.ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+        finished = sorted(
+            (job for job in self._jobs.values() if job.finished), key=lambda job: job.finished_at or 0.0
+        )
+        for job in finished[:max(0, len(finished) - self.max_retained)]:
+            del self._jobs[job.id]
+        finished = finished[max(0, len(finished) - self.max_retained):]
+
+        # Drop stored images, oldest first, until they fit the byte budget
+        total = sum(_result_bytes(job) for job in finished)
+        for job in finished:
+            if total <= self.max_result_bytes:
+                break
+            size = _result_bytes(job)
+            if size:
+                job.result = {**job.result, "image": None}
+                total -= size
+
+
+def _result_bytes(job: Job) -> int:
+    if not isinstance(job.result, dict):
+        return 0
+    image = job.result.get("image")
+    return len(image) if image else 0
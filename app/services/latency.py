@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from app.services.admission import fitted_size
+from app.services.ai_engine import AIEngine, PRESETS
+
+
+class StagePrior(NamedTuple):
+    feature: str       # what the stage's time scales with (see `job_features`)
+    intercept: float   # ms
+    slope: float       # ms per unit of `feature`
+
+
+# Starting guesses per stage, roughly a CPU host; they only matter for the first
+# few jobs. "resample" is the bicubic stand-in timed as "background" by presets
+# that skip RRDBNet.
+STAGE_PRIORS = {
+    "decode": StagePrior("source_mp", 5.0, 30.0),
+    "resize": StagePrior("fitted_mp", 0.0, 10.0),
+    "face_detection": StagePrior("fitted_mp", 20.0, 600.0),
+    "face_restoration": StagePrior("faces", 0.0, 1200.0),
+    "paste_back": StagePrior("faces", 0.0, 100.0),
+    "background": StagePrior("fitted_mp", 0.0, 20000.0),
+    "resample": StagePrior("fitted_mp", 0.0, 40.0),
+    "magazine_look": StagePrior("output_mp", 0.0, 200.0),
+    "encode": StagePrior("output_mp", 0.0, 150.0),
+    "upload": StagePrior("output_mp", 10.0, 10.0),  # spooling the result; the original uploads during the render
+}
+
+_FACE_STAGES = ("face_detection", "face_restoration", "paste_back")
+
+# How hard the fits are pulled towards the priors, in observations' worth. The
+# intercept is held firmly (a few ms either way hardly matters, and a handful of
+# similar-sized jobs cannot separate it from the slope); the slope is barely
+# held, so the first real job already sets the per-megapixel / per-face cost.
+_INTERCEPT_WEIGHT = 3.0
+_SLOPE_WEIGHT = 0.001
+
+
+def job_features(size: Optional[Tuple[int, int]], preset: str, faces: float) -> Dict[str, float]:
+    """
+    What each stage's time scales with, for an upload of `size` (height,
+    width; None when the header could not be read) with `faces` faces: the
+    source and processed megapixels, the output megapixels (2x upscale) and
+    the face count.
+    """
+    if size is None:
+        size = (AIEngine.SAFE_MAX_DIMENSION, AIEngine.SAFE_MAX_DIMENSION)
+    height, width = fitted_size(size, preset, max(1, round(faces)))
+    fitted_mp = height * width / 1e6
+    return {
+        "source_mp": size[0] * size[1] / 1e6,
+        "fitted_mp": fitted_mp,
+        "output_mp": 4 * fitted_mp,
+        "faces": faces,
+    }
+
+
+def preset_stages(preset: str):
+    """
+    The stages (keys of STAGE_PRIORS) that `preset` runs.
+    """
+    steps = PRESETS[preset]
+    stages = ["decode", "resize", "background" if steps.background else "resample", "magazine_look", "encode", "upload"]
+    if steps.faces:
+        stages += _FACE_STAGES
+    return stages
+
+
+class _StageFit:
+    """
+    ms = intercept + slope * x, by exponentially weighted least squares,
+    shrunk towards the prior (ridge regression centred on it).
+    """
+
+    def __init__(self, prior: StagePrior, forgetting: float):
+        self.prior = prior
+        self.forgetting = forgetting
+        # Weighted sums of 1, x, x^2, y and x*y
+        self.n = self.sx = self.sxx = self.sy = self.sxy = 0.0
+        self.coef = (prior.intercept, prior.slope)
+
+    def observe(self, x: float, ms: float):
+        g = self.forgetting
+        self.n = g * self.n + 1.0
+        self.sx = g * self.sx + x
+        self.sxx = g * self.sxx + x * x
+        self.sy = g * self.sy + ms
+        self.sxy = g * self.sxy + x * ms
+        self.coef = self._solve()
+
+    def predict(self, x: float) -> float:
+        return max(0.0, self.coef[0] + self.coef[1] * x)
+
+    def _solve(self) -> Tuple[float, float]:
+        # (X'WX + K) coef = X'Wy + K prior, with K = diag(intercept weight, slope weight)
+        a, b, d = self.n + _INTERCEPT_WEIGHT, self.sx, self.sxx + _SLOPE_WEIGHT
+        r0 = self.sy + _INTERCEPT_WEIGHT * self.prior.intercept
+        r1 = self.sxy + _SLOPE_WEIGHT * self.prior.slope
+        det = a * d - b * b
+        return (d * r0 - b * r1) / det, (a * r1 - b * r0) / det
+
+    def to_dict(self) -> Dict[str, float]:
+        return {"n": self.n, "sx": self.sx, "sxx": self.sxx, "sy": self.sy, "sxy": self.sxy}
+
+    def restore(self, state: Dict[str, float]):
+        for name in ("n", "sx", "sxx", "sy", "sxy"):
+            setattr(self, name, float(state[name]))
+        self.coef = self._solve()
+
+
+class LatencyModel:
+    """
+    Online per-stage latency model for this deployment. Every finished render
+    reports its stage timings (see app/core/timing.py) with the job's
+    features; each stage keeps its own linear fit, and a job's prediction is
+    the sum over the stages its preset runs. Each restoration backend other
+    than the default gets its own "background" fit ("background@<backend>"),
+    started from the same prior.
+
+    The fits forget old jobs geometrically (`forgetting` per observation), so
+    the model follows the host as load, thread counts or weights change. The
+    face count is unknown until detection, so predictions use a running
+    average of the faces seen so far.
+    """
+
+    def __init__(self, forgetting: float = 0.995, assumed_faces: float = 1.0):
+        self.forgetting = forgetting
+        self.expected_faces = float(assumed_faces)
+        self.observations = 0
+        self.error_ewma: Optional[float] = None  # mean relative error of the predictions
+        self._stages = {name: _StageFit(prior, forgetting) for name, prior in STAGE_PRIORS.items()}
+        self._lock = threading.Lock()
+
+    def predict(self, size: Optional[Tuple[int, int]], preset: str, faces: Optional[float] = None,
+                backend: Optional[str] = None) -> float:
+        """
+        Predicted render time in ms of an upload of `size` with `preset` on
+        `backend` (None = the default backend).
+        """
+        with self._lock:
+            faces = self.expected_faces if faces is None else faces
+            return self._predict(job_features(size, preset, faces), preset, backend)
+
+    def observe(self, size: Optional[Tuple[int, int]], preset: str, faces: int, timings_ms: Dict[str, float],
+                backend: Optional[str] = None):
+        """
+        Learns from one finished render: its faces and measured stage timings.
+        """
+        features = job_features(size, preset, faces)
+        with self._lock:
+            predicted = self._predict(job_features(size, preset, self.expected_faces), preset, backend)
+            actual = 0.0
+            for name in preset_stages(preset):
+                ms = timings_ms.get("background" if name == "resample" else name)
+                if ms is None:
+                    continue
+                fit = self._fit(name, backend)
+                fit.observe(features[fit.prior.feature], ms)
+                actual += ms
+
+            if actual > 0:
+                error = abs(predicted - actual) / actual
+                self.error_ewma = error if self.error_ewma is None else 0.9 * self.error_ewma + 0.1 * error
+            if PRESETS[preset].faces:
+                self.expected_faces = 0.9 * self.expected_faces + 0.1 * faces
+            self.observations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "observations": self.observations,
+                "mean_relative_error": round(self.error_ewma, 3) if self.error_ewma is not None else None,
+                "expected_faces": round(self.expected_faces, 2),
+                "stages": {
+                    name: {"feature": fit.prior.feature, "intercept_ms": round(fit.coef[0], 2),
+                           "slope_ms": round(fit.coef[1], 2)}
+                    for name, fit in self._stages.items()
+                },
+            }
+
+    def save(self, path: str):
+        with self._lock:
+            state = {
+                "observations": self.observations,
+                "error_ewma": self.error_ewma,
+                "expected_faces": self.expected_faces,
+                "stages": {name: fit.to_dict() for name, fit in self._stages.items()},
+            }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> bool:
+        """
+        Restores a model saved by `save`. Returns False (keeping the priors)
+        when there is no usable file.
+        """
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            with self._lock:
+                for name, fit_state in state["stages"].items():
+                    stage_name, _, backend = name.partition("@")
+                    if stage_name in self._stages:
+                        self._fit(stage_name, backend or None).restore(fit_state)
+                self.observations = int(state["observations"])
+                self.error_ewma = state.get("error_ewma")
+                self.expected_faces = float(state["expected_faces"])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"⚠️ Ignoring latency model {path}: {e}")
+            return False
+        return True
+
+    def _fit(self, name: str, backend: Optional[str]) -> _StageFit:
+        if backend is None or name != "background":
+            return self._stages[name]
+        key = f"{name}@{backend}"
+        fit = self._stages.get(key)
+        if fit is None:
+            fit = self._stages[key] = _StageFit(STAGE_PRIORS[name], self.forgetting)
+        return fit
+
+    def _predict(self, features: Dict[str, float], preset: str, backend: Optional[str] = None) -> float:
+        fits = [self._fit(name, backend) for name in preset_stages(preset)]
+        return sum(fit.predict(features[fit.prior.feature]) for fit in fits)
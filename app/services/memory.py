@@ -0,0 +1,125 @@
+import math
+import os
+from typing import List, Optional, Tuple
+
+# Rough peak bytes of each pipeline stage, deliberately on the pessimistic side
+# so a budget that "fits" really does. Per input pixel unless noted.
+_DECODED = 3 + 3                 # uint8 BGR decode + the upsampler's uint8 RGB copy
+_DETECTION = 160                 # RetinaFace-R50 feature maps over the whole image
+_OUTPUT = 3                      # per output pixel: uint8 BGR result buffer
+_FLOAT_OUTPUT = 12               # per output pixel: float32 RGB result tensor (accelerator path)
+_POST = 4 * 3                    # per output pixel: magazine look + encoder, ~4 uint8 images
+_FLOAT_POST = 3 * 12             # per output pixel: magazine look as float32 tensors
+_PASTE = 4 * 3 * 8               # per output pixel: facexlib blends faces as ~4 float64 images
+_TILE_ACTIVATIONS = 3 * 64 * 4   # per tile output pixel: ~3 live 64-channel float32 RRDBNet maps
+_TILE_IO = 3 * 4                 # per tile input and per tile output pixel: float32 RGB tile
+_TILE_WINDOW_BATCHES = 2         # tiles in flight per image, in batches (tiling.TILE_WINDOW_BATCHES)
+_FACE = 2 * 512 * 512 * 3        # per face: aligned crop + restored crop
+_GFPGAN_FORWARD = 300 * 1024 ** 2  # one 512px GFPGAN forward; faces are restored one at a time
+
+# Never shrink the long side below this, even when the budget is too small for anything
+MIN_DIMENSION = 256
+
+
+def estimate_peak_bytes(
+    height: int,
+    width: int,
+    scale: int = 2,
+    tile: int = 200,
+    tile_pad: int = 10,
+    tile_batch: int = 4,
+    faces: int = 0,
+    mmap_output: bool = False,
+    float_output: bool = False,
+    detect_faces: bool = True,
+    model_upsample: bool = True,
+) -> int:
+    """
+    Estimated peak memory of enhancing one `height` x `width` image, model
+    weights excluded. Tiling bounds the RRDBNet activations by the tile size;
+    what still grows with the image are the decoded input, the face detector,
+    the output buffer (unless it is memory-mapped), face paste-back and
+    post-processing. Presets that skip face detection or RRDBNet pass
+    `detect_faces` / `model_upsample` as False.
+    """
+    pixels = height * width
+    out_pixels = pixels * scale * scale
+
+    total = pixels * (_DECODED + (_DETECTION if detect_faces else 0))
+    if float_output:
+        total += out_pixels * (_FLOAT_OUTPUT + _FLOAT_POST)
+    else:
+        total += out_pixels * ((0 if mmap_output else _OUTPUT) + _POST)
+
+    if model_upsample and tile > 0:
+        tile_h, tile_w = min(tile + 2 * tile_pad, height), min(tile + 2 * tile_pad, width)
+        tiles = math.ceil(height / tile) * math.ceil(width / tile)
+        in_batch = min(max(1, tile_batch), tiles)
+        total += in_batch * tile_h * tile_w * scale * scale * _TILE_ACTIVATIONS
+        # The image's window of submitted tiles and their outputs, as floats
+        in_window = min(max(1, tile_batch) * _TILE_WINDOW_BATCHES, tiles)
+        total += in_window * tile_h * tile_w * (1 + scale * scale) * _TILE_IO
+    elif model_upsample:
+        total += out_pixels * _TILE_ACTIVATIONS
+
+    if faces > 0:
+        total += _GFPGAN_FORWARD + faces * _FACE + out_pixels * _PASTE
+    return int(total)
+
+
+def fit_to_budget(height: int, width: int, budget: int, **kwargs) -> Tuple[int, int]:
+    """
+    Largest size with the input's aspect ratio whose `estimate_peak_bytes`
+    (same keyword arguments) stays within `budget`. Returns the input size
+    unchanged when it already fits.
+    """
+    if estimate_peak_bytes(height, width, **kwargs) <= budget:
+        return height, width
+
+    def size(factor):
+        return max(1, int(height * factor)), max(1, int(width * factor))
+
+    floor = min(1.0, MIN_DIMENSION / max(height, width))
+    low, high = floor, 1.0
+    for _ in range(20):
+        mid = (low + high) / 2
+        if estimate_peak_bytes(*size(mid), **kwargs) <= budget:
+            low = mid
+        else:
+            high = mid
+    return size(low)
+
+
+def total_memory() -> Optional[int]:
+    """
+    Physical memory of this machine in bytes, or None where it cannot be read.
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def process_rss(pid: int) -> Optional[int]:
+    """
+    Resident bytes of process `pid`, or None where it cannot be read (not Linux, or gone).
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def child_pids(pid: int) -> List[int]:
+    """
+    Direct children of process `pid` (Linux only; empty elsewhere).
+    """
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
@@ -0,0 +1,367 @@
+import json
+import os
+import threading
+import time
+import traceback
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Sequence, Union
+
+import numpy as np
+
+from app.config import settings
+from app.core.codecs import (
+    OutputFormat, decode_image, encode_image, image_size, output_extension, reduction_factor, sniff_format,
+)
+from app.core.image_proc import MagazineEnhancer, tensor_to_bgr
+from app.core import metrics
+from app.core.timing import DOWNSCALED, FACES, pop_markers, stage
+from app.services.backends import backend_config, backend_fingerprint
+from app.services.cache import ResultCache, content_key
+from app.services.threads import ThreadLayout, apply_layout, effective_layout
+
+if TYPE_CHECKING:
+    from app.services.profiling import ProfileSlot, Profiler
+
+
+def render(ai, data: bytes, fmt: Union[str, OutputFormat], preset: str = "full",
+           timings: Optional[Dict[str, float]] = None, profile: Optional["ProfileSlot"] = None,
+           backend: Optional[str] = None) -> bytes:
+    """
+    The compute part of the pipeline: upload bytes in, encoded output bytes out.
+    Runs wherever the models live (this process or an inference worker).
+    `fmt` is an output extension or an OutputFormat with encoder options, and
+    `backend` the restoration backend (see app/services/backends.py; None =
+    the engine's default). Per-stage wall times in ms are added to `timings`
+    when given, and the whole render is profiled into `profile`'s directory
+    when one is given.
+    """
+    if profile is not None:
+        from app.services.profiling import capture
+        with capture(profile):
+            return render(ai, data, fmt, preset=preset, timings=timings, backend=backend)
+
+    # Engines without backends (and the test fakes) never see the argument
+    choice = {"backend": backend} if backend is not None else {}
+
+    # 1. Decode once, straight to the size the engine would shrink it to when it can
+    with stage(timings, "decode"):
+        reduce = decode_reduction(ai, data, preset, backend)
+        img = decode_image(data, reduce)
+    if reduce > 1 and timings is not None:
+        timings[DOWNSCALED] = 1
+
+    device = getattr(ai, "device", None)
+    if device is not None and device.type != "cpu":
+        # 2. + 3. On an accelerator the AI output stays a float tensor on the
+        #    device through the magazine look and is quantized once at the end
+        image = ai.enhance_tensor(img, preset=preset, timings=timings, **choice)
+        with stage(timings, "magazine_look"):
+            image = MagazineEnhancer.apply_magazine_look_tensor(image)
+            img = tensor_to_bgr(image)
+    else:
+        # 2. Run AI Pipeline (Face Restore + Upscale)
+        img = ai.enhance_array(img, preset=preset, timings=timings, **choice)
+
+        # 3. Run Magazine Post-Processing (Color/Light)
+        with stage(timings, "magazine_look"):
+            img = MagazineEnhancer.apply_magazine_look_array(img)
+
+    # 4. Encode once
+    with stage(timings, "encode"):
+        return encode_image(img, fmt)
+
+
+def decode_reduction(ai, data: bytes, preset: str = "full", backend: Optional[str] = None) -> int:
+    """
+    How far the JPEG decoder may shrink this upload (see `decode_image`):
+    only as far as the engine would shrink it anyway before face detection.
+    """
+    decode_size = getattr(ai, "decode_size", None)
+    if not settings.REDUCED_DECODE or decode_size is None or sniff_format(data) != ".jpg":
+        return 1
+    size = image_size(data)
+    if size is None:
+        return 1
+    choice = {"backend": backend} if backend is not None else {}
+    return reduction_factor(size, decode_size(*size, preset=preset, **choice))
+
+
+def warm_up(ai, sizes: Sequence[int]) -> float:
+    """
+    Pays the one-time costs (allocator growth, kernel selection, lazy imports)
+    before real traffic: one GFPGAN pass on a blank face crop, then a full
+    render of a synthetic page per size in `sizes`, and a background-only one
+    on every other restoration backend. Returns the seconds taken.
+    """
+    started = time.perf_counter()
+    ai.warm_up_faces()
+    backends = getattr(ai, "backends", None)
+    others = [name for name in backends.names() if name != backends.config.default] if backends is not None else []
+    rng = np.random.default_rng(0)
+    for side in sizes:
+        page = encode_image(rng.integers(0, 256, size=(side, side, 3), dtype=np.uint8), ".jpg")
+        render(ai, page, ".jpg")
+        for name in others:
+            render(ai, page, ".jpg", preset="background_only", backend=name)
+    return time.perf_counter() - started
+
+
+class LocalRenderer:
+    """
+    Renders on an AIEngine living in this process.
+
+    Given `load` (e.g. the AIEngine class) instead of an engine, the models
+    are loaded and warmed up (see `warm_up`) on a background thread, so the
+    server can bind its port right away; `ready` turns True once both are done.
+
+    A `layout` (see `plan_layout`) is applied to this process right away,
+    before the models are loaded.
+    """
+
+    def __init__(self, ai=None, load: Optional[Callable[[], Any]] = None, warmup_sizes: Sequence[int] = (),
+                 layout: Optional[ThreadLayout] = None):
+        self.layout = layout
+        if layout is not None:
+            apply_layout(layout)
+        self.ai = ai
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.error: Optional[str] = None
+        self._loaded = threading.Event()
+        if ai is not None:
+            self._loaded.set()
+        else:
+            threading.Thread(
+                target=self._load, args=(load, warmup_sizes), name="model-loader", daemon=True
+            ).start()
+
+    @property
+    def ready(self) -> bool:
+        return self._loaded.is_set() and self.error is None
+
+    def render(self, data: bytes, fmt: Union[str, OutputFormat], preset: str = "full",
+               timings: Optional[Dict[str, float]] = None, profile: Optional["ProfileSlot"] = None,
+               backend: Optional[str] = None) -> bytes:
+        return render(self._engine(), data, fmt, preset=preset, timings=timings, profile=profile, backend=backend)
+
+    def fingerprint(self) -> dict:
+        return self._engine().fingerprint()
+
+    def readiness(self) -> dict:
+        return {
+            "ready": self.ready,
+            "mode": "in_process",
+            "device": self.ai.device.type if self.ai is not None else None,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "threads": {
+                "planned": self.layout.to_dict() if self.layout is not None else None,
+                "processes": [effective_layout()],
+            },
+            "error": self.error,
+        }
+
+    def stats(self) -> dict:
+        if not self.ready:
+            return {"mode": "in_process", "ready": False}
+        stats = {"mode": "in_process", "ready": True, "tile_batcher": self.ai.tile_batcher.stats()}
+        if getattr(self.ai, "backends", None) is not None:
+            stats["backends"] = self.ai.backends.stats()
+        return stats
+
+    def _engine(self):
+        # Callers normally check `ready` first; anyone early waits for the load
+        self._loaded.wait()
+        if self.error is not None:
+            raise RuntimeError(f"Models failed to load: {self.error}")
+        return self.ai
+
+    def _load(self, load: Callable[[], Any], warmup_sizes: Sequence[int]):
+        try:
+            started = time.monotonic()
+            ai = self.ai = load()
+            self.load_seconds = time.monotonic() - started
+            self.warmup_seconds = warm_up(ai, warmup_sizes)
+            # Hash the checkpoints now rather than on the first request
+            ai.fingerprint()
+            print(f"✅ Models ready on {ai.device} (load {self.load_seconds:.1f}s, warm-up {self.warmup_seconds:.1f}s)")
+        except Exception as e:
+            traceback.print_exc()
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            self._loaded.set()
+
+
+class EnhancePipeline:
+    """
+    The Magazine-Grade pipeline, entirely in memory:
+    upload bytes -> decode -> AI -> magazine look -> encode once -> upload bytes.
+
+    The compute step is delegated to a renderer (LocalRenderer or an
+    inference WorkerPool); uploads and caching stay in the API process.
+
+    When a ResultCache is given, finished outputs are stored under the hash of
+    the input bytes and the pipeline configuration, and `lookup` can answer a
+    repeated request without running the models.
+
+    When a Profiler is given and armed, renders are profiled (see app/services/profiling.py).
+    """
+
+    def __init__(self, renderer, gcs, cache: Optional[ResultCache] = None, profiler: Optional["Profiler"] = None):
+        self.renderer = renderer
+        self.gcs = gcs
+        self.cache = cache
+        self.profiler = profiler
+
+    def fingerprint(self, filename: str, preset: str = "full", fmt: Optional[OutputFormat] = None,
+                    backend: Optional[str] = None) -> str:
+        fmt = fmt or OutputFormat(output_extension(filename))
+        config = {
+            "ai": self.renderer.fingerprint(),
+            "look": MagazineEnhancer.params(),
+            "ext": fmt.ext,
+            "preset": preset,
+        }
+        if fmt.options():
+            config["encode"] = fmt.options()
+        if backend is not None:
+            # The default backend is part of "ai"; keys of its renders are unchanged
+            config["backend"] = backend_fingerprint(backend)
+        return json.dumps(config, sort_keys=True)
+
+    def cache_key(self, data: bytes, filename: str, preset: str = "full", fmt: Optional[OutputFormat] = None,
+                  backend: Optional[str] = None) -> str:
+        return content_key(data, self.fingerprint(filename, preset, fmt, backend))
+
+    def lookup(self, key: str, data: bytes, filename: str, bucket_original: str, bucket_enhanced: str,
+               fmt: Optional[OutputFormat] = None) -> Optional[Dict[str, Any]]:
+        """
+        Returns a finished result from the cache, or None on a miss.
+        Uploads only happen if this output was never stored in the requested
+        bucket; the output's goes through the write-behind spool.
+        """
+        if self.cache is None:
+            return None
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+
+        metrics.CACHE_HITS.inc()
+        output, meta = entry
+        urls = dict(meta.get("urls", {}))
+        names = _names(filename, (fmt or OutputFormat(output_extension(filename))).ext)
+
+        original_url = urls.get(f"originals:{bucket_original}")
+        if original_url is None:
+            original_url = self.gcs.upload_bytes(data, names["original"], bucket_original, folder="originals")
+        enhanced_url = urls.get(f"enhanced:{bucket_enhanced}")
+        if enhanced_url is None:
+            enhanced_url = self.gcs.upload_behind(
+                output, names["enhanced"], bucket_enhanced, folder="enhanced", content_type=meta["media_type"]
+            )
+
+        fresh = {f"originals:{bucket_original}": original_url, f"enhanced:{bucket_enhanced}": enhanced_url}
+        fresh = {k: v for k, v in fresh.items() if v is not None and urls.get(k) != v}
+        if fresh:
+            self.cache.update_meta(key, {**meta, "urls": {**urls, **fresh}})
+
+        return {
+            "original_url": original_url,
+            "enhanced_url": enhanced_url,
+            "enhanced_filename": names["enhanced"],
+            "cached": True,
+            "preset": meta.get("preset"),
+            "backend": meta.get("backend"),
+            "faces": meta.get("faces"),
+            "timings_ms": {},
+            "cache_key": key,
+            "image": output,
+            "media_type": meta["media_type"],
+        }
+
+    def run(self, data: bytes, filename: str, bucket_original: str, bucket_enhanced: str, key: Optional[str] = None,
+            preset: str = "full", fmt: Optional[OutputFormat] = None, backend: Optional[str] = None):
+        """
+        `fmt` picks the output codec and its options; by default the upload's
+        extension with the encoder's defaults. `backend` picks the restoration
+        backend (None = the default one).
+        """
+        fmt = fmt or OutputFormat(output_extension(filename))
+        key = key or self.cache_key(data, filename, preset, fmt, backend)
+        backend_name = backend or backend_config().default
+
+        # 0. An identical request may have finished between the caller's cache
+        #    miss and this job starting; reuse its output instead of rendering twice
+        hit = self.lookup(key, data, filename, bucket_original, bucket_enhanced, fmt)
+        if hit is not None:
+            return hit
+
+        content_type = fmt.content_type
+        names = _names(filename, fmt.ext)
+
+        timings: Dict[str, float] = {}
+
+        # 1. (Optional) Upload Original to GCS Bucket 1 (the untouched upload bytes),
+        #    on the upload threads while the image renders
+        original = self.gcs.upload_async(data, names["original"], bucket_original, folder="originals")
+
+        # 2. Decode, enhance, post-process and encode
+        output = self._render(data, fmt, preset, timings, key, backend)
+        markers = pop_markers(timings)
+        faces = int(markers.get(FACES, 0))
+        if markers.get(DOWNSCALED):
+            metrics.DOWNSCALES.inc()
+
+        # 3. Spool the Result for GCS Bucket 2 (uploaded in the background), and
+        #    wait for whatever is left of the original's upload
+        with stage(timings, "upload"):
+            enhanced_url = self.gcs.upload_behind(
+                output, names["enhanced"], bucket_enhanced, folder="enhanced", content_type=content_type
+            )
+            original_url = original.result()
+
+        if self.cache is not None:
+            urls = {}
+            if original_url is not None:
+                urls[f"originals:{bucket_original}"] = original_url
+            if enhanced_url is not None:
+                urls[f"enhanced:{bucket_enhanced}"] = enhanced_url
+            self.cache.put(key, output, {
+                "media_type": content_type, "urls": urls, "preset": preset, "backend": backend_name, "faces": faces,
+            })
+        metrics.observe_stages(timings, backend_name)
+
+        return {
+            "original_url": original_url,
+            "enhanced_url": enhanced_url,
+            "enhanced_filename": names["enhanced"],
+            "cached": False,
+            "preset": preset,
+            "backend": backend_name,
+            "faces": faces,
+            "timings_ms": {name: round(ms, 1) for name, ms in timings.items()},
+            "cache_key": key,
+            "image": output,
+            "media_type": content_type,
+        }
+
+    def _render(self, data: bytes, fmt: OutputFormat, preset: str, timings: Dict[str, float], key: str,
+                backend: Optional[str] = None) -> bytes:
+        choice = {"backend": backend} if backend is not None else {}
+        profile = self.profiler.claim(key[:12]) if self.profiler is not None else None
+        if profile is None:
+            return self.renderer.render(data, fmt, preset=preset, timings=timings, **choice)
+        started = time.perf_counter()
+        error = None
+        try:
+            return self.renderer.render(data, fmt, preset=preset, timings=timings, profile=profile, **choice)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            self.profiler.finish(profile, time.perf_counter() - started, error)
+
+
+def _names(filename: str, ext: str) -> Dict[str, str]:
+    base = os.path.basename(filename or "") or f"upload{ext}"
+    stem = os.path.splitext(base)[0] or "upload"
+    return {"original": base, "enhanced": f"{stem}{ext}"}
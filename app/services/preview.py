@@ -0,0 +1,214 @@
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+import cv2
+import numpy as np
+import torch
+from basicsr.archs.srvgg_arch import SRVGGNetCompact
+from basicsr.utils import img2tensor, tensor2img
+
+from app.config import settings
+from app.core import metrics
+from app.core.codecs import OutputFormat, decode_image, encode_image, image_size, reduction_factor, sniff_format
+from app.core.image_proc import MagazineEnhancer
+from app.core.timing import stage
+from app.services.threads import ThreadLayout, apply_layout
+from app.services.weights import load_weights, mapped_path
+
+PREVIEW_WEIGHTS = '/app/weights/realesr-general-x4v3.pth'
+
+# SRVGGNetCompact's upscale factor; previews are rendered from an input this much smaller
+PREVIEW_SCALE = 4
+
+
+def build_preview_model() -> SRVGGNetCompact:
+    """
+    The realesr-general-x4v3 architecture, without weights.
+    """
+    return SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=64, num_conv=32, upscale=PREVIEW_SCALE,
+                           act_type='prelu')
+
+
+class PreviewEngine:
+    """
+    Fast, low-resolution stand-in for the full render: the upload is decoded
+    small, upscaled x4 by SRVGGNetCompact (no face restoration, no tiling)
+    and given the magazine look, so the longest side of the JPEG is at most
+    `max_side`. Without the checkpoint the upscale is bicubic.
+    """
+
+    def __init__(self, device=None, max_side: int = 1024, quality: int = 80, weights: str = PREVIEW_WEIGHTS):
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() and settings.INFERENCE_PROCESSES <= 0 else "cpu"
+        self.device = torch.device(device)
+        self.max_side = max_side
+        self.fmt = OutputFormat(".jpg", quality=quality)
+        self.model = None
+        if os.path.exists(mapped_path(weights)) or os.path.exists(weights):
+            model = build_preview_model()
+            print(f"   Preview weights: {load_weights(model, weights)}")
+            self.model = model.eval().to(self.device)
+        else:
+            print(f"⚠️ {os.path.basename(weights)} not found; previews are upscaled bicubically")
+
+    def render(self, data: bytes, timings: Optional[Dict[str, float]] = None) -> bytes:
+        side = max(1, self.max_side // PREVIEW_SCALE)
+        with stage(timings, "decode"):
+            size = image_size(data)
+            reduce = 1
+            if size is not None and sniff_format(data) == ".jpg":
+                scale = min(1.0, side / max(size))
+                reduce = reduction_factor(size, (int(size[0] * scale), int(size[1] * scale)))
+            img = decode_image(data, reduce)
+        with stage(timings, "resize"):
+            height, width = img.shape[:2]
+            scale = min(1.0, side / max(height, width))
+            if scale < 1.0:
+                img = cv2.resize(img, (max(1, int(width * scale)), max(1, int(height * scale))),
+                                 interpolation=cv2.INTER_AREA)
+        with stage(timings, "background"):
+            img = self._upscale(img)
+        with stage(timings, "magazine_look"):
+            img = MagazineEnhancer.apply_magazine_look_array(img)
+        with stage(timings, "encode"):
+            return encode_image(img, self.fmt)
+
+    @torch.no_grad()
+    def _upscale(self, img: np.ndarray) -> np.ndarray:
+        if self.model is None:
+            height, width = img.shape[:2]
+            return cv2.resize(img, (width * PREVIEW_SCALE, height * PREVIEW_SCALE), interpolation=cv2.INTER_CUBIC)
+        tensor = img2tensor(img.astype(np.float32) / 255.0, bgr2rgb=True, float32=True).unsqueeze(0).to(self.device)
+        return tensor2img(self.model(tensor).clamp_(0, 1), rgb2bgr=True, min_max=(0, 1))
+
+
+class Preview:
+    """
+    One job's preview: "pending" until rendered, then "ready" (with `image`)
+    or "failed"; "skipped" when the job finished first.
+    """
+
+    def __init__(self):
+        self.status = "pending"
+        self.image: Optional[bytes] = None
+        self.media_type = "image/jpeg"
+        self.seconds: Optional[float] = None
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"status": self.status, "seconds": self.seconds, "error": self.error}
+
+
+class PreviewLane:
+    """
+    Renders previews on their own `max_workers` thread(s), apart from the job
+    threads, so a preview never waits behind full renders and a full render
+    never waits for a job thread held by previews. Previews are small (a
+    fraction of a megapixel through a compact network), and at most
+    `max_pending` are queued: past that a new preview is skipped rather than
+    queued, so a burst of them cannot take over the cores the full jobs run on.
+    When the full renders run in worker processes, pass a `layout` (see
+    `plan_layout`) for this process too, so its torch and OpenCV pools do not
+    spread previews over the cores the workers are pinned to.
+
+    A job's preview is dropped as soon as the job finishes: its full result
+    replaces it. `load` (e.g. PreviewEngine) runs on the lane's thread first,
+    after `layout` is applied.
+    """
+
+    def __init__(self, load: Callable[[], Any], max_pending: int = 8, max_workers: int = 1,
+                 layout: Optional[ThreadLayout] = None):
+        self.max_pending = max_pending
+        self.rendered = 0
+        self.skipped = 0
+        self.failed = 0
+        self.seconds_total = 0.0
+        self._previews: Dict[str, Preview] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="preview")
+        self.layout = layout
+        self._engine = self._executor.submit(self._load, load)
+
+    def submit(self, job, data: bytes) -> Optional[Preview]:
+        """
+        Queues a preview of `data` for `job`, unless one exists already (the
+        job was shared with an identical upload). Returns None when the job is
+        finished or the lane is full.
+        """
+        with self._lock:
+            if job.id in self._previews:
+                return self._previews[job.id]
+            if job.finished:
+                return None
+            if self._pending_count() >= self.max_pending:
+                self.skipped += 1
+                return None
+            preview = self._previews[job.id] = Preview()
+        self._executor.submit(self._render, job, preview, data)
+        job.future.add_done_callback(lambda _: self.forget(job.id))
+        return preview
+
+    def get(self, job_id: str) -> Optional[Preview]:
+        with self._lock:
+            return self._previews.get(job_id)
+
+    def forget(self, job_id: str):
+        with self._lock:
+            preview = self._previews.pop(job_id, None)
+        if preview is not None and preview.status == "pending":
+            preview.status = "skipped"
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = self._pending_count()
+            held = len(self._previews)
+        return {
+            "pending": pending,
+            "held": held,
+            "max_pending": self.max_pending,
+            "rendered": self.rendered,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "seconds_total": round(self.seconds_total, 3),
+            "layout": self.layout.to_dict() if self.layout is not None else None,
+        }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+    def _load(self, load: Callable[[], Any]):
+        if self.layout is not None:
+            apply_layout(self.layout)
+        return load()
+
+    def _pending_count(self) -> int:
+        return sum(1 for preview in self._previews.values() if preview.status == "pending")
+
+    def _render(self, job, preview: Preview, data: bytes):
+        if job.finished or preview.status != "pending":
+            # The full result is out already; the preview would be dropped right away
+            with self._lock:
+                self.skipped += 1
+            return
+        started = time.perf_counter()
+        try:
+            image = self._engine.result().render(data)
+        except Exception as e:
+            traceback.print_exc()
+            preview.error = f"{type(e).__name__}: {e}"
+            preview.status = "failed"
+            with self._lock:
+                self.failed += 1
+            return
+        seconds = time.perf_counter() - started
+        metrics.STAGE_SECONDS.observe(seconds, "preview")
+        preview.image = image
+        preview.seconds = round(seconds, 3)
+        preview.status = "ready"
+        with self._lock:
+            self.rendered += 1
+            self.seconds_total += seconds
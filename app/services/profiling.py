@@ -0,0 +1,253 @@
+import collections
+import os
+import shutil
+import sys
+import threading
+import time
+import uuid
+import zipfile
+from contextlib import contextmanager
+from typing import Any, Dict, List, NamedTuple, Optional
+
+# Threads sampled besides the one rendering: RRDBNet tiles run on the shared batcher
+_SAMPLED_THREAD_NAMES = ("tile-batcher",)
+
+# Finished sessions kept (with their files) before the oldest is deleted
+_KEEP_SESSIONS = 8
+
+
+class ProfilerBusyError(RuntimeError):
+    """Raised when profiling is armed while an earlier session is still capturing."""
+
+
+class ProfileSlot(NamedTuple):
+    """
+    One request to profile: where its files go and what to record. Picklable,
+    so it travels with the task to an inference worker.
+    """
+    session: str
+    index: int
+    directory: str
+    shapes: bool
+    memory: bool
+    interval_ms: float
+
+
+class StackSampler:
+    """
+    Sampling Python profiler: every `interval` seconds, records the stack of
+    the thread that started it and of the tile batcher, as collapsed stacks
+    (one "root;caller;callee count" line per distinct stack, the input format
+    of flamegraph.pl and speedscope).
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.samples = 0
+        self.stacks: Dict[str, int] = collections.Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: str):
+        with open(path, "w") as f:
+            for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]):
+                f.write(f"{stack} {count}\n")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self._thread_id:
+                    root = "request"
+                elif names.get(ident, "").startswith(_SAMPLED_THREAD_NAMES):
+                    root = names[ident]
+                else:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join([root, *reversed(frames)])] += 1
+            self.samples += 1
+
+
+@contextmanager
+def capture(slot: ProfileSlot):
+    """
+    Profiles the block with torch.profiler (CPU, plus CUDA when present,
+    with input shapes and memory as `slot` asks) and a StackSampler, then
+    writes into `slot.directory`:
+
+    * trace.json: Chrome trace (chrome://tracing or ui.perfetto.dev)
+    * stacks.collapsed: sampled Python stacks
+    * ops.txt: torch operators by self CPU time
+    """
+    import torch
+    from torch.profiler import ProfilerActivity, profile
+
+    os.makedirs(slot.directory, exist_ok=True)
+    activities = [ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(ProfilerActivity.CUDA)
+    sampler = StackSampler(slot.interval_ms / 1000.0)
+    prof = profile(activities=activities, record_shapes=slot.shapes, profile_memory=slot.memory)
+    try:
+        with prof:
+            sampler.start()
+            try:
+                yield
+            finally:
+                sampler.stop()
+    finally:
+        prof.export_chrome_trace(os.path.join(slot.directory, "trace.json"))
+        sampler.write(os.path.join(slot.directory, "stacks.collapsed"))
+        table = prof.key_averages(group_by_input_shape=slot.shapes).table(
+            sort_by="self_cpu_time_total", row_limit=50
+        )
+        with open(os.path.join(slot.directory, "ops.txt"), "w") as f:
+            f.write(table)
+
+
+class _Session:
+    def __init__(self, session_id: str, directory: str, requests: int, shapes: bool, memory: bool,
+                 interval_ms: float):
+        self.id = session_id
+        self.directory = directory
+        self.requests = requests
+        self.shapes = shapes
+        self.memory = memory
+        self.interval_ms = interval_ms
+        self.armed_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.claimed = 0
+        self.capturing = False
+        self.captures: List[Dict[str, Any]] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "session_id": self.id,
+            "requests": self.requests,
+            "captured": len(self.captures),
+            "remaining": self.requests - self.claimed,
+            "armed_at": self.armed_at,
+            "finished_at": self.finished_at,
+            "captures": self.captures,
+        }
+
+
+class Profiler:
+    """
+    Arms profiling for the next `requests` renders. Until then `claim`
+    returns None after one attribute read, so nothing is instrumented.
+
+    Renders are captured one at a time: torch.profiler is process-wide, and
+    two overlapping captures would also blur into each other. Requests that
+    arrive while a capture runs simply go unprofiled.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._armed: Optional[_Session] = None
+        self._sessions: Dict[str, _Session] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def arm(self, requests: int = 1, shapes: bool = True, memory: bool = True, interval_ms: float = 5.0) -> dict:
+        with self._lock:
+            if self._armed is not None:
+                raise ProfilerBusyError(f"Profiling session {self._armed.id} is still capturing")
+            session_id = uuid.uuid4().hex[:12]
+            session = _Session(session_id, os.path.join(self.directory, session_id), max(1, requests), shapes,
+                               memory, interval_ms)
+            self._sessions[session_id] = session
+            self._armed = session
+            self._prune()
+            return session.to_dict()
+
+    def disarm(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if self._armed is session:
+                self._armed = None
+                session.requests = session.claimed
+                if not session.capturing:
+                    session.finished_at = time.time()
+            return session.to_dict()
+
+    def claim(self, label: str) -> Optional[ProfileSlot]:
+        """
+        A slot for the render about to start, or None when profiling is not
+        armed or another capture is running.
+        """
+        if self._armed is None:
+            return None
+        with self._lock:
+            session = self._armed
+            if session is None or session.capturing or session.claimed >= session.requests:
+                return None
+            session.capturing = True
+            session.claimed += 1
+            return ProfileSlot(
+                session.id, session.claimed - 1,
+                os.path.join(session.directory, f"{session.claimed - 1:03d}_{label}"),
+                session.shapes, session.memory, session.interval_ms,
+            )
+
+    def finish(self, slot: ProfileSlot, seconds: float, error: Optional[str] = None):
+        with self._lock:
+            session = self._sessions.get(slot.session)
+            if session is None:
+                return
+            files = sorted(os.listdir(slot.directory)) if os.path.isdir(slot.directory) else []
+            session.captures.append({
+                "index": slot.index,
+                "directory": os.path.basename(slot.directory),
+                "seconds": round(seconds, 3),
+                "files": files,
+                "error": error,
+            })
+            session.capturing = False
+            if session.claimed >= session.requests:
+                session.finished_at = time.time()
+                if self._armed is session:
+                    self._armed = None
+
+    def status(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session.to_dict() if session is not None else None
+
+    def archive(self, session_id: str) -> Optional[str]:
+        """
+        Zips the files captured so far into the session directory and returns
+        the zip's path, or None for an unknown session or nothing captured yet.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or not session.captures:
+                return None
+            directories = [capture["directory"] for capture in session.captures]
+        os.makedirs(session.directory, exist_ok=True)
+        path = os.path.join(session.directory, f"profile_{session_id}.zip")
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as bundle:
+            for directory in directories:
+                full = os.path.join(session.directory, directory)
+                for name in sorted(os.listdir(full)) if os.path.isdir(full) else []:
+                    bundle.write(os.path.join(full, name), f"{directory}/{name}")
+        return path
+
+    def _prune(self):
+        finished = [s for s in self._sessions.values() if s.finished_at is not None]
+        for session in finished[:max(0, len(finished) - _KEEP_SESSIONS)]:
+            del self._sessions[session.id]
+            shutil.rmtree(session.directory, ignore_errors=True)
@@ -0,0 +1,58 @@
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight work. The first caller for a key starts the
+    work; later callers with the same key get the same handle back until it
+    finishes, instead of starting a second run.
+
+    `start` must return an object with a `future` attribute (e.g. a Job);
+    the key is released when that future completes.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Any] = {}
+
+    def do(self, key: str, start: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Returns (handle, shared). `shared` is True when the caller was attached
+        to a computation started by someone else.
+        """
+        with self._lock:
+            handle = self._calls.get(key)
+            if handle is not None:
+                self.coalesced += 1
+                return handle, True
+
+            handle = start()
+            self._calls[key] = handle
+            self.leaders += 1
+
+        handle.future.add_done_callback(lambda _: self._forget(key, handle))
+        return handle, False
+
+    def join(self, key: str) -> Optional[Any]:
+        """
+        The handle of the computation running for `key`, counted as a shared
+        call, or None when there is none. Lets a caller skip work it would
+        only need before starting a computation of its own.
+        """
+        with self._lock:
+            handle = self._calls.get(key)
+            if handle is not None:
+                self.coalesced += 1
+            return handle
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"in_flight": len(self._calls), "leaders": self.leaders, "coalesced": self.coalesced}
+
+    def _forget(self, key: str, handle: Any):
+        with self._lock:
+            if self._calls.get(key) is handle:
+                del self._calls[key]
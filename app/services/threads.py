@@ -0,0 +1,355 @@
+"""
+CPU thread layout: how many torch intra-op / inter-op and OpenCV threads each
+inference process runs, and which cores it is pinned to.
+
+Left alone, every process sizes each library's pool to the whole machine, so
+two concurrent renders (or two workers) run several times more threads than
+there are cores. `plan_layout` splits the physical cores between processes
+and images in flight instead.
+
+    python -m app.services.threads                      # sweep the default layouts
+    python -m app.services.threads --layouts 0x2,2x2x4 --images 16
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from app.core.timing import pop_markers
+
+Core = Tuple[int, ...]  # the logical CPUs (hyper-threads) of one physical core
+
+
+class ThreadLayout(NamedTuple):
+    processes: int   # inference processes sharing the cores (the API process counts as one)
+    slots: int       # images each process renders at once
+    cores: int       # physical cores split between the processes
+    intra_op: int    # torch.set_num_threads, per process
+    inter_op: int    # torch.set_num_interop_threads, per process
+    opencv: int      # cv2.setNumThreads, per process
+    cpus: Tuple[Optional[Tuple[int, ...]], ...]  # CPU affinity per process; None = not pinned
+
+    def to_dict(self) -> Dict[str, Any]:
+        layout = self._asdict()
+        layout["cpus"] = [list(cpus) if cpus is not None else None for cpus in self.cpus]
+        return layout
+
+
+def available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _parse_cpu_list(text: str) -> List[int]:
+    # Linux cpulist format, e.g. "0-3,8,10-11"
+    cpus = []
+    for part in text.strip().split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.extend(range(int(first), int(last) + 1))
+        elif part:
+            cpus.append(int(part))
+    return cpus
+
+
+def cpu_cores() -> List[Core]:
+    """
+    The physical cores this process may run on. Without sysfs (or off
+    Linux) every logical CPU counts as a core of its own.
+    """
+    cpus = available_cpus()
+    allowed = set(cpus)
+    cores = {}
+    for cpu in cpus:
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list") as f:
+                siblings = _parse_cpu_list(f.read())
+        except (OSError, ValueError):
+            siblings = [cpu]
+        core = tuple(sorted(sibling for sibling in siblings if sibling in allowed)) or (cpu,)
+        cores[core] = None
+    return sorted(cores)
+
+
+def plan_layout(
+    processes: int,
+    slots: int,
+    cores: int = 0,
+    intra_op: int = 0,
+    inter_op: int = 0,
+    opencv: int = 0,
+    pin: bool = False,
+    topology: Optional[Sequence[Core]] = None,
+) -> ThreadLayout:
+    """
+    Splits `cores` physical cores (0 = all of `topology`, by default this
+    machine's) between `processes` processes rendering `slots` images each.
+    Zeros are filled in:
+
+    * intra_op: the process's share of the cores. Its renders share one
+      torch pool (their tiles are batched into one forward), so it is not
+      divided further by `slots`.
+    * inter_op: 1. The models run one operator at a time; a bigger inter-op
+      pool only adds idle threads.
+    * opencv: the process's cores divided by `slots`, since every image in
+      flight resizes, blends and encodes on its own.
+
+    With `pin`, each process gets `intra_op` consecutive cores (all of their
+    hyper-threads), wrapping around when there are not enough.
+    """
+    topology = list(topology if topology is not None else cpu_cores())
+    if 0 < cores < len(topology):
+        topology = topology[:cores]
+    processes = max(1, processes)
+    slots = max(1, slots)
+    share = max(1, len(topology) // processes)
+    intra_op = intra_op or share
+    cpus: List[Optional[Tuple[int, ...]]] = [None] * processes
+    if pin:
+        for i in range(processes):
+            picked = [topology[(i * intra_op + j) % len(topology)] for j in range(min(intra_op, len(topology)))]
+            cpus[i] = tuple(sorted({cpu for core in picked for cpu in core}))
+    return ThreadLayout(
+        processes=processes,
+        slots=slots,
+        cores=len(topology),
+        intra_op=intra_op,
+        inter_op=inter_op or 1,
+        opencv=opencv or max(1, intra_op // slots),
+        cpus=tuple(cpus),
+    )
+
+
+def set_interop_threads(threads: int) -> bool:
+    """
+    torch.set_num_interop_threads, which only works before the first
+    parallel operator of the process (a forked worker inherits its zygote's
+    setting). Returns whether the process now runs `threads`.
+    """
+    import torch
+
+    try:
+        torch.set_num_interop_threads(threads)
+    except RuntimeError:
+        return torch.get_num_interop_threads() == threads
+    return True
+
+
+def apply_layout(layout: ThreadLayout, process: int = 0):
+    """
+    Applies `layout` to this process, as its `process`-th inference process.
+    """
+    import torch
+
+    cpus = layout.cpus[process] if process < len(layout.cpus) else None
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(layout.intra_op)
+    if not set_interop_threads(layout.inter_op):
+        print(f"⚠️ torch already runs {torch.get_num_interop_threads()} inter-op threads; "
+              f"wanted {layout.inter_op}")
+    try:
+        import cv2
+    except ImportError:
+        return
+    cv2.setNumThreads(layout.opencv)
+
+
+def effective_layout() -> Dict[str, Any]:
+    """
+    The thread counts and CPU affinity this process actually runs with.
+    """
+    effective: Dict[str, Any] = {"pid": os.getpid(), "intra_op": None, "inter_op": None, "opencv": None,
+                                 "cpus": available_cpus()}
+    try:
+        import torch
+        effective["intra_op"] = torch.get_num_threads()
+        effective["inter_op"] = torch.get_num_interop_threads()
+    except ImportError:
+        pass
+    try:
+        import cv2
+        effective["opencv"] = cv2.getNumThreads()
+    except ImportError:
+        pass
+    return effective
+
+
+class Candidate(NamedTuple):
+    workers: int   # inference processes; 0 = render in this process
+    slots: int     # images in flight per process
+    threads: int   # torch intra-op threads per process; 0 = planned
+
+
+def parse_candidates(value: str) -> List[Candidate]:
+    """
+    "WORKERSxSLOTS[xTHREADS]", comma-separated, e.g. "0x2,2x2x4".
+    """
+    candidates = []
+    for spec in value.split(","):
+        if spec.strip():
+            parts = [int(part) for part in spec.strip().lower().split("x")]
+            if len(parts) not in (2, 3):
+                raise ValueError(f"Bad layout {spec!r}; expected WORKERSxSLOTS or WORKERSxSLOTSxTHREADS")
+            candidates.append(Candidate(*parts, *([0] if len(parts) == 2 else [])))
+    return candidates
+
+
+def default_candidates(cores: int) -> List[Candidate]:
+    """
+    In-process with 1, 2 and 4 images in flight, then worker pools of 2, 4,
+    8... processes for as long as each still gets two cores.
+    """
+    candidates = [Candidate(0, slots, 0) for slots in (1, 2, 4)]
+    workers = 2
+    while cores // workers >= 2:
+        candidates.append(Candidate(workers, 2, 0))
+        workers *= 2
+    return candidates
+
+
+def _env(candidate: Candidate, layout: ThreadLayout) -> str:
+    if candidate.workers == 0:
+        return (f"INFERENCE_PROCESSES=0 ENHANCE_WORKERS={layout.slots} "
+                f"INFERENCE_THREADS_PER_WORKER={layout.intra_op}")
+    return (f"INFERENCE_PROCESSES={layout.processes} INFERENCE_SLOTS_PER_WORKER={layout.slots} "
+            f"INFERENCE_THREADS_PER_WORKER={layout.intra_op}")
+
+
+def _renderer_sender(renderer, preset: str):
+    from app.loadtest import Record
+
+    def send(sample, data: bytes):
+        timings: Dict[str, float] = {}
+        started = time.perf_counter()
+        try:
+            renderer.render(data, ".jpg", preset=preset, timings=timings)
+            pop_markers(timings)
+        except Exception as e:
+            return Record(sample.label, 500, (time.perf_counter() - started) * 1000, {}, False,
+                          sample.height * sample.width / 1e6, f"{type(e).__name__}: {e}")
+        return Record(sample.label, 200, (time.perf_counter() - started) * 1000, timings, False,
+                      sample.height * sample.width / 1e6)
+
+    return send
+
+
+def _wait_for_pool(pool, timeout: float = 1800.0):
+    deadline = time.monotonic() + timeout
+    while not pool.ready:
+        error = pool.readiness()["error"]
+        if error or time.monotonic() > deadline:
+            raise RuntimeError(error or "Inference workers did not warm up in time")
+        time.sleep(0.5)
+
+
+def benchmark_layouts(candidates: Sequence[Candidate], workload, images: int, preset: str = "full",
+                      cores: int = 0, inter_op: int = 0, opencv: int = 0, pin: bool = True) -> List[dict]:
+    """
+    Renders `images` pages of `workload` under each candidate layout, with
+    as many images in flight as the layout has slots in total, and reports
+    the throughput in images per minute. Each layout first renders one
+    untimed page per process.
+
+    In-process candidates share one engine loaded here, so their inter-op
+    thread count is whatever this process started with; worker pools are
+    started fresh for each candidate.
+    """
+    from app.loadtest import closed_loop, summarize
+    from app.services.pipeline import LocalRenderer
+    from app.services.workers import WorkerPool
+
+    engine = None
+    results = []
+    for candidate in candidates:
+        processes = max(1, candidate.workers)
+        layout = plan_layout(processes, candidate.slots, cores=cores, intra_op=candidate.threads,
+                             inter_op=inter_op, opencv=opencv, pin=pin and candidate.workers > 0)
+        pool = None
+        try:
+            if candidate.workers == 0:
+                apply_layout(layout)
+                if engine is None:
+                    from app.services.ai_engine import AIEngine
+                    engine = AIEngine()
+                renderer = LocalRenderer(ai=engine)
+            else:
+                renderer = pool = WorkerPool(
+                    candidate.workers, threads_per_worker=layout.intra_op, pin_cpus=pin,
+                    slots_per_worker=candidate.slots, cores=cores, interop_threads=inter_op, opencv_threads=opencv,
+                )
+                _wait_for_pool(pool)
+            send = _renderer_sender(renderer, preset)
+            closed_loop(send, workload, processes, requests=processes)
+            records, elapsed = closed_loop(send, workload, processes * candidate.slots, requests=images)
+        except Exception as e:
+            print(f"❌ Layout {candidate.workers}x{candidate.slots} failed: {type(e).__name__}: {e}")
+            results.append({"candidate": candidate._asdict(), "layout": layout.to_dict(), "error": str(e)})
+            continue
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        report = summarize(records, elapsed)
+        results.append({
+            "candidate": candidate._asdict(),
+            "layout": layout.to_dict(),
+            "env": _env(candidate, layout),
+            "images": report["succeeded"],
+            "errors": report["errors"],
+            "elapsed_seconds": report["elapsed_seconds"],
+            "images_per_minute": round(report["succeeded"] / elapsed * 60, 2) if elapsed > 0 else None,
+            "latency_ms_p50": report["latency_ms"]["p50"],
+        })
+        print(f"  {_describe(candidate, layout)}: {results[-1]['images_per_minute']} images/min")
+    return results
+
+
+def _describe(candidate: Candidate, layout: ThreadLayout) -> str:
+    where = "in-process" if candidate.workers == 0 else f"{layout.processes} workers"
+    return (f"{where} x {layout.slots} slots, {layout.intra_op} torch / {layout.inter_op} inter-op / "
+            f"{layout.opencv} OpenCV threads")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep CPU thread layouts and report images/minute for each.")
+    parser.add_argument("--layouts", help="WORKERSxSLOTS[xTHREADS], comma-separated; WORKERS 0 = in-process "
+                                          "(default: in-process 1/2/4 slots and pools of 2, 4... workers)")
+    parser.add_argument("--images", type=int, default=12, help="Pages rendered per layout")
+    parser.add_argument("--sizes", default="600x800", help="Page sizes, WIDTHxHEIGHT, comma-separated")
+    parser.add_argument("--faces", type=int, default=1, help="Faces per page")
+    parser.add_argument("--preset", default="full")
+    parser.add_argument("--cores", type=int, default=0, help="Physical cores to use (default: all)")
+    parser.add_argument("--inter-op", type=int, default=0, help="torch inter-op threads (default: planned)")
+    parser.add_argument("--opencv", type=int, default=0, help="OpenCV threads per process (default: planned)")
+    parser.add_argument("--no-pin", action="store_true", help="Do not pin worker processes to their cores")
+    parser.add_argument("--json", help="Write the results here")
+    args = parser.parse_args(argv)
+
+    # Pool mode is CPU-only; keep the in-process layouts comparable
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    from app.loadtest import build_workload, parse_sizes
+
+    cores = len(cpu_cores()) if not args.cores else args.cores
+    candidates = parse_candidates(args.layouts) if args.layouts else default_candidates(cores)
+    # Must precede the first torch operator of this process (the in-process layouts)
+    set_interop_threads(plan_layout(1, 1, cores=args.cores, inter_op=args.inter_op).inter_op)
+    workload = build_workload(parse_sizes(args.sizes), args.faces, per_size=2)
+    print(f"⚡ Sweeping {len(candidates)} thread layouts on {cores} cores, {args.images} pages each...")
+    results = benchmark_layouts(candidates, workload, args.images, preset=args.preset, cores=args.cores,
+                                inter_op=args.inter_op, opencv=args.opencv, pin=not args.no_pin)
+
+    ranked = sorted((r for r in results if r.get("images_per_minute")), key=lambda r: -r["images_per_minute"])
+    for r in ranked:
+        print(f"  {r['images_per_minute']:>8.2f} images/min  p50 {r['latency_ms_p50']:>8.0f} ms  {r['env']}")
+    if ranked:
+        print(f"✅ Fastest: {ranked[0]['env']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
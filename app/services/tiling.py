@@ -0,0 +1,310 @@
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Optional
+
+import cv2
+import numpy as np
+import torch
+from torch.nn import functional as F
+
+from app.core.image_proc import tensor_to_bgr
+
+
+# TiledUpsampler's default `mod_scale`: whatever RRDBNet needs at the upsampler's scale
+RRDBNET_MOD_SCALE = -1
+
+# Tiles one image keeps in flight, per tile of the batcher's `max_batch`: enough to
+# fill a batch while the previous one runs, few enough that the float copies of
+# the tiles and their outputs stay small (see memory.estimate_peak_bytes)
+TILE_WINDOW_BATCHES = 2
+
+
+def rrdbnet_mod_scale(scale: int) -> Optional[int]:
+    # RRDBNet unshuffles its input for x2/x1 models, so borders must be divisible
+    return {2: 2, 1: 4}.get(scale)
+
+
+class _TileRequest:
+    __slots__ = ("tile", "future")
+
+    def __init__(self, tile: torch.Tensor):
+        self.tile = tile
+        self.future = Future()
+
+
+class TileBatcher:
+    """
+    Collects tiles from every in-flight image and runs same-shape tiles
+    through the model in one forward pass.
+
+    A single dispatcher thread owns the model. It waits at most `max_wait_ms`
+    after the first tile of a batch arrives for more tiles of the same shape,
+    up to `max_batch` tiles, then runs them and routes each output row back to
+    the Future of the tile that produced it.
+    """
+
+    def __init__(self, model: torch.nn.Module, device: torch.device, max_batch: int = 4, max_wait_ms: float = 5.0):
+        self.model = model
+        self.device = device
+        self.dtype = next(model.parameters()).dtype
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+
+        self.batches = 0
+        self.tiles = 0
+
+        self._queue: "queue.Queue[_TileRequest]" = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name="tile-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, tile: torch.Tensor) -> Future:
+        """
+        Queues one (C, H, W) tile. The Future resolves to the (C, H*s, W*s) output.
+        """
+        request = _TileRequest(tile)
+        self._queue.put(request)
+        return request.future
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Ends the dispatcher thread once the tiles already queued have run.
+        """
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    @property
+    def backlog(self) -> int:
+        """
+        Tiles waiting for a forward pass.
+        """
+        return self._queue.qsize()
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "tiles": self.tiles,
+            "avg_batch_size": round(self.tiles / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000.0,
+        }
+
+    def _loop(self):
+        # Tiles that arrived while a batch of another shape was being collected
+        held_back = deque()
+        stopping = False
+        while True:
+            if held_back:
+                first = held_back.popleft()
+            elif stopping:
+                return
+            else:
+                first = self._queue.get()
+                if first is None:
+                    return
+            shape = first.tile.shape
+            batch = [first]
+
+            # Drain held-back tiles of the same shape before waiting on the queue
+            others = deque()
+            for request in held_back:
+                if len(batch) < self.max_batch and request.tile.shape == shape:
+                    batch.append(request)
+                else:
+                    others.append(request)
+            held_back = others
+
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch and not stopping:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if request is None:
+                    # stop(): run what is collected and held back, then exit
+                    stopping = True
+                elif request.tile.shape == shape:
+                    batch.append(request)
+                else:
+                    held_back.append(request)
+
+            self._run(batch)
+
+    def _run(self, batch):
+        try:
+            inputs = torch.stack([request.tile for request in batch]).to(self.device, dtype=self.dtype)
+            with torch.no_grad():
+                outputs = self.model(inputs)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.tiles += len(batch)
+        for request, output in zip(batch, outputs):
+            request.future.set_result(output)
+
+
+class TiledUpsampler:
+    """
+    Drop-in replacement for `RealESRGANer.enhance` that sends its tiles through
+    a shared TileBatcher instead of calling the model one tile at a time.
+
+    Unlike RealESRGANer it keeps no per-image state on the instance, so any
+    number of threads may call `enhance` concurrently.
+    """
+
+    def __init__(self, batcher: TileBatcher, scale: int, tile: int = 200, tile_pad: int = 10, pre_pad: int = 0,
+                 mod_scale: Optional[int] = RRDBNET_MOD_SCALE):
+        self.batcher = batcher
+        self.scale = scale
+        self.tile_size = tile
+        self.tile_pad = tile_pad
+        self.pre_pad = pre_pad
+        # Input sides are padded to a multiple of `mod_scale` (None = any size)
+        self.mod_scale = rrdbnet_mod_scale(scale) if mod_scale == RRDBNET_MOD_SCALE else mod_scale
+
+    def enhance(self, img: np.ndarray, outscale=None, out: Optional[np.ndarray] = None):
+        """
+        Upsamples a uint8 BGR image. Returns (output, img_mode) like RealESRGANer.
+
+        Each tile is quantized and written into a uint8 BGR buffer as soon as
+        it comes back, so no full-size float copy of the image or of the
+        output ever exists. `out` may be a preallocated (H*scale, W*scale, 3)
+        uint8 buffer, e.g. a np.memmap; it is used when `outscale` is the
+        model's own scale.
+        """
+        h_input, w_input = img.shape[0:2]
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+        # Same reflect padding as RealESRGANer.pre_process, still in uint8
+        if self.pre_pad != 0:
+            rgb = cv2.copyMakeBorder(rgb, 0, self.pre_pad, 0, self.pre_pad, cv2.BORDER_REFLECT_101)
+        if self.mod_scale is not None:
+            h, w = rgb.shape[0:2]
+            mod_pad_h = (self.mod_scale - h % self.mod_scale) % self.mod_scale
+            mod_pad_w = (self.mod_scale - w % self.mod_scale) % self.mod_scale
+            if mod_pad_h or mod_pad_w:
+                rgb = cv2.copyMakeBorder(rgb, 0, mod_pad_h, 0, mod_pad_w, cv2.BORDER_REFLECT_101)
+
+        shape = (h_input * self.scale, w_input * self.scale, 3)
+        if out is None or out.shape != shape or out.dtype != np.uint8:
+            out = np.empty(shape, dtype=np.uint8)
+
+        # The padding rows/columns fall outside `out` and are simply not written
+        s = self.scale
+        tiles = torch.from_numpy(rgb).permute(2, 0, 1)
+        for output_tile, start_x, end_x, start_y, end_y in self._run_tiles(tiles, to_float=True):
+            end_y, end_x = min(end_y * s, shape[0]), min(end_x * s, shape[1])
+            if end_y > start_y * s and end_x > start_x * s:
+                out[start_y * s:end_y, start_x * s:end_x] = tensor_to_bgr(
+                    output_tile[:, :end_y - start_y * s, :end_x - start_x * s].float()
+                )
+        output = out
+
+        if outscale is not None and outscale != float(self.scale):
+            output = cv2.resize(
+                output, (int(w_input * outscale), int(h_input * outscale)), interpolation=cv2.INTER_LANCZOS4
+            )
+        return output, "RGB"
+
+    def enhance_tensor(self, img: np.ndarray, device=None) -> torch.Tensor:
+        """
+        Upsamples a uint8 BGR image by `scale` and returns the raw model output:
+        a float (3, H, W) RGB tensor, not yet clamped or quantized, on `device`
+        (default: the model's device, so nothing is copied back to the host).
+        """
+        device = device if device is not None else self.batcher.device
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB).astype(np.float32) / 255.0
+        tensor = torch.from_numpy(np.transpose(rgb, (2, 0, 1))).unsqueeze(0).to(device)
+
+        # Same reflect padding as RealESRGANer.pre_process
+        if self.pre_pad != 0:
+            tensor = F.pad(tensor, (0, self.pre_pad, 0, self.pre_pad), "reflect")
+        mod_pad_h, mod_pad_w = 0, 0
+        if self.mod_scale is not None:
+            _, _, h, w = tensor.shape
+            mod_pad_h = (self.mod_scale - h % self.mod_scale) % self.mod_scale
+            mod_pad_w = (self.mod_scale - w % self.mod_scale) % self.mod_scale
+            tensor = F.pad(tensor, (0, mod_pad_w, 0, mod_pad_h), "reflect")
+
+        output = self._tile_process(tensor[0])
+
+        # Same cropping as RealESRGANer.post_process
+        _, h, w = output.shape
+        output = output[:, 0:h - mod_pad_h * self.scale, 0:w - mod_pad_w * self.scale]
+        if self.pre_pad != 0:
+            _, h, w = output.shape
+            output = output[:, 0:h - self.pre_pad * self.scale, 0:w - self.pre_pad * self.scale]
+        return output
+
+    def _tile_process(self, img: torch.Tensor) -> torch.Tensor:
+        channel, height, width = img.shape
+        output = img.new_zeros((channel, height * self.scale, width * self.scale))
+
+        s = self.scale
+        for output_tile, start_x, end_x, start_y, end_y in self._run_tiles(img):
+            output[:, start_y * s:end_y * s, start_x * s:end_x * s] = output_tile.to(output.device, dtype=output.dtype)
+        return output
+
+    def _run_tiles(self, img: torch.Tensor, to_float: bool = False):
+        """
+        Runs every tile of a (C, H, W) image through the batcher and yields
+        (output_tile, start_x, end_x, start_y, end_y) in order, with the
+        output tile already cropped to its unpadded area. `to_float` turns
+        uint8 tiles into [0, 1] floats as they are submitted.
+
+        At most TILE_WINDOW_BATCHES * max_batch tiles are submitted ahead of
+        the one being yielded, so they still batch with each other and with
+        tiles of other images while only that many float tiles and outputs
+        are alive at once.
+        """
+        _, height, width = img.shape
+        tile_size = self.tile_size if self.tile_size > 0 else max(height, width)
+        tiles_x = math.ceil(width / tile_size)
+        tiles_y = math.ceil(height / tile_size)
+        window = TILE_WINDOW_BATCHES * self.batcher.max_batch
+
+        def submit(index):
+            y, x = divmod(index, tiles_x)
+            start_x = x * tile_size
+            end_x = min(start_x + tile_size, width)
+            start_y = y * tile_size
+            end_y = min(start_y + tile_size, height)
+
+            start_x_pad = max(start_x - self.tile_pad, 0)
+            end_x_pad = min(end_x + self.tile_pad, width)
+            start_y_pad = max(start_y - self.tile_pad, 0)
+            end_y_pad = min(end_y + self.tile_pad, height)
+
+            tile = img[:, start_y_pad:end_y_pad, start_x_pad:end_x_pad]
+            if to_float:
+                tile = tile.float() / 255.0
+            future = self.batcher.submit(tile)
+            return future, start_x, end_x, start_y, end_y, start_x_pad, start_y_pad
+
+        count = tiles_x * tiles_y
+        pending = deque(submit(index) for index in range(min(window, count)))
+        submitted = len(pending)
+        s = self.scale
+        while pending:
+            future, start_x, end_x, start_y, end_y, start_x_pad, start_y_pad = pending.popleft()
+            output_tile = future.result()
+            tile_x = (start_x - start_x_pad) * s
+            tile_y = (start_y - start_y_pad) * s
+            yield (
+                output_tile[:, tile_y:tile_y + (end_y - start_y) * s, tile_x:tile_x + (end_x - start_x) * s],
+                start_x, end_x, start_y, end_y,
+            )
+            # The consumer is done with the last tile; keep the window full
+            del output_tile
+            if submitted < count:
+                pending.append(submit(submitted))
+                submitted += 1
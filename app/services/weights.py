@@ -0,0 +1,227 @@
+import argparse
+import hashlib
+import json
+import os
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+# Flat weight file: an 8-byte little-endian header length, a JSON header, then
+# every tensor's raw bytes at a 64-byte aligned offset. Loading it maps the
+# file and hands out tensors that are views over the mapping: nothing is
+# unpickled or copied, and every process on the host that maps the same file
+# shares its page-cache pages.
+FORMAT_VERSION = 1
+SUFFIX = ".tensors"
+_ALIGN = 64
+
+_DTYPES = {
+    torch.float32: "float32",
+    torch.float16: "float16",
+    torch.float64: "float64",
+    torch.int64: "int64",
+    torch.int32: "int32",
+    torch.uint8: "uint8",
+    torch.bool: "bool",
+}
+
+# Address ranges of every mapped file, so share_memory() can leave those tensors alone
+_mapped_ranges: List[Tuple[int, int]] = []
+_mapped_lock = threading.Lock()
+
+
+def mapped_path(path: str) -> str:
+    """
+    Where the converted copy of checkpoint `path` lives: next to it, same stem.
+    """
+    return os.path.splitext(path)[0] + SUFFIX
+
+
+def is_stale(flat: str, path: str) -> bool:
+    """
+    True when checkpoint `path` was modified after its converted copy `flat`
+    (e.g. a new .pth was dropped in without re-converting). A converted file
+    shipped without its checkpoint is never stale.
+    """
+    try:
+        return os.path.getmtime(flat) < os.path.getmtime(path)
+    except OSError:
+        return False
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checkpoint_state(path: str) -> Dict[str, torch.Tensor]:
+    """
+    The state dict inside a basicsr-style .pth checkpoint: `params_ema` when
+    present (the EMA weights are the ones released), else `params`, else the
+    file itself.
+    """
+    loaded = torch.load(path, map_location="cpu")
+    for key in ("params_ema", "params"):
+        if key in loaded:
+            return loaded[key]
+    return loaded
+
+
+def convert(path: str, dest: Optional[str] = None) -> str:
+    """
+    Writes checkpoint `path` as a flat weight file (default: `mapped_path(path)`).
+    The header keeps the checkpoint's SHA-256 so the converted file keeps its
+    cache identity. Returns the destination.
+    """
+    dest = dest or mapped_path(path)
+    state = checkpoint_state(path)
+
+    tensors, offset = {}, 0
+    arrays = []
+    for name, tensor in state.items():
+        if tensor.dtype not in _DTYPES:
+            raise ValueError(f"{name}: unsupported dtype {tensor.dtype}")
+        array = tensor.detach().cpu().contiguous().numpy()
+        offset = -(-offset // _ALIGN) * _ALIGN
+        tensors[name] = {
+            "dtype": _DTYPES[tensor.dtype],
+            "shape": list(array.shape),
+            "offset": offset,
+            "nbytes": array.nbytes,
+        }
+        arrays.append((offset, array))
+        offset += array.nbytes
+
+    header = json.dumps({
+        "format": FORMAT_VERSION,
+        "source": os.path.basename(path),
+        "source_sha256": _sha256(path),
+        "tensors": tensors,
+    }).encode("utf-8")
+    # Pad the header so the data section starts aligned
+    data_start = -(-(8 + len(header)) // _ALIGN) * _ALIGN
+    header += b" " * (data_start - 8 - len(header))
+
+    tmp_path = f"{dest}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+        for offset, array in arrays:
+            f.seek(data_start + offset)
+            f.write(array.tobytes())
+    os.replace(tmp_path, dest)
+    return dest
+
+
+def read_header(path: str) -> Tuple[dict, int]:
+    """
+    (header, data start) of a flat weight file.
+    """
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    if header.get("format") != FORMAT_VERSION:
+        raise ValueError(f"{path}: unsupported weight file format {header.get('format')}")
+    return header, 8 + length
+
+
+def load_mapped(path: str) -> Dict[str, torch.Tensor]:
+    """
+    Tensors of a flat weight file as zero-copy views over a private mapping.
+    Pages are only copied if a tensor is written to, which inference never does.
+    """
+    header, data_start = read_header(path)
+    mapping = np.memmap(path, dtype=np.uint8, mode="c")
+    with _mapped_lock:
+        _mapped_ranges.append((mapping.ctypes.data, mapping.ctypes.data + mapping.size))
+
+    state = {}
+    for name, meta in header["tensors"].items():
+        array = np.ndarray(
+            tuple(meta["shape"]), dtype=np.dtype(meta["dtype"]), buffer=mapping, offset=data_start + meta["offset"]
+        )
+        state[name] = torch.from_numpy(array)
+    return state
+
+
+def is_mapped(tensor: torch.Tensor) -> bool:
+    """
+    True when `tensor` is a view over a file mapped by `load_mapped`.
+    """
+    ptr = tensor.data_ptr()
+    with _mapped_lock:
+        return any(start <= ptr < end for start, end in _mapped_ranges)
+
+
+def source_digest(path: str) -> Optional[str]:
+    """
+    SHA-256 of the checkpoint a flat weight file was converted from, or None
+    if `path` is missing or unreadable.
+    """
+    try:
+        return read_header(path)[0].get("source_sha256")
+    except (OSError, ValueError):
+        return None
+
+
+def assign_state(module: torch.nn.Module, state: Dict[str, torch.Tensor]):
+    """
+    Like `module.load_state_dict(state, strict=True)`, but the module's
+    parameters and buffers *become* the given tensors instead of being copied
+    into, so mapped tensors stay mapped.
+    """
+    expected = module.state_dict(keep_vars=True)
+    missing = sorted(set(expected) - set(state))
+    unexpected = sorted(set(state) - set(expected))
+    if missing or unexpected:
+        raise RuntimeError(f"Error loading weights: missing keys {missing}, unexpected keys {unexpected}")
+
+    for name, tensor in state.items():
+        current = expected[name]
+        if current.shape != tensor.shape:
+            raise RuntimeError(f"Error loading weights: {name} has shape {tuple(tensor.shape)}, expected {tuple(current.shape)}")
+        if current.dtype != tensor.dtype:
+            tensor = tensor.to(current.dtype)
+        owner_name, _, attr = name.rpartition(".")
+        owner = module.get_submodule(owner_name) if owner_name else module
+        if attr in owner._parameters:
+            owner._parameters[attr] = torch.nn.Parameter(tensor, requires_grad=False)
+        else:
+            owner._buffers[attr] = tensor
+
+
+def load_weights(module: torch.nn.Module, path: str) -> str:
+    """
+    Loads checkpoint `path` into `module`: zero-copy from its converted flat
+    file when there is an up-to-date one (see `convert`), else through
+    torch.load. Returns the file actually read.
+    """
+    flat = mapped_path(path)
+    if os.path.exists(flat):
+        if not is_stale(flat, path):
+            assign_state(module, load_mapped(flat))
+            return flat
+        print(f"⚠️ {os.path.basename(flat)} is older than {os.path.basename(path)}; loading the checkpoint "
+              f"instead (re-run `python -m app.services.weights {path}`)")
+    module.load_state_dict(checkpoint_state(path), strict=True)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert .pth checkpoints to flat, memory-mappable weight files.")
+    parser.add_argument("checkpoints", nargs="+", help=".pth files; each is written next to itself as <name>.tensors")
+    args = parser.parse_args(argv)
+
+    for path in args.checkpoints:
+        dest = convert(path)
+        print(f"✅ {os.path.basename(path)} -> {dest} ({os.path.getsize(dest) / 1024 ** 2:.1f} MiB)")
+
+
+if __name__ == "__main__":
+    main()
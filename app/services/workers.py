@@ -0,0 +1,392 @@
+import importlib
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from app.services.threads import ThreadLayout, apply_layout, effective_layout, plan_layout, set_interop_threads
+
+if TYPE_CHECKING:
+    from app.core.codecs import OutputFormat
+    from app.services.profiling import ProfileSlot
+
+# Message kinds sent from the inference processes back to the API process
+_CLAIMED = "claimed"
+_DONE = "done"
+_FAILED = "failed"
+_DIED = "died"
+_READY = "ready"
+_WARM = "warm"
+
+DEFAULT_ENGINE = "app.services.ai_engine:AIEngine"
+
+# How often blocked processes check that their parent is still alive
+_PARENT_POLL_SECONDS = 1.0
+
+
+class WorkerError(RuntimeError):
+    """Raised in the API process when an inference worker fails a task, dies or times out."""
+
+
+def _load_engine_class(path: str):
+    module_name, _, attr = path.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def _serve(engine, tasks, results, layout: ThreadLayout, index: int, zygote_pid: int, warmup_sizes: Sequence[int]):
+    """
+    Inference worker main loop. Runs in a child forked from the zygote, so
+    `engine` is the zygote's engine and its weights are shared pages.
+
+    `layout.slots` images are rendered concurrently so the worker's
+    TileBatcher can batch tiles across them. Each worker applies its part of
+    `layout` (threads, CPU affinity) and warms up with it before taking tasks.
+    """
+    from app.services.pipeline import render, warm_up
+
+    apply_layout(layout, index)
+    engine.reset_after_fork()
+    slots = layout.slots
+
+    pid = os.getpid()
+    started = time.monotonic()
+    try:
+        warm_up(engine, warmup_sizes)
+    except Exception as e:
+        # Not fatal: a worker that cannot warm up still reports real failures per task
+        print(f"⚠️ Inference worker {pid} warm-up failed: {e}")
+    results.put((_WARM, None, (pid, time.monotonic() - started, effective_layout())))
+    free_slots = threading.Semaphore(slots)
+
+    def run(task_id, data, fmt, preset, profile, backend):
+        timings = {}
+        try:
+            output = render(engine, data, fmt, preset=preset, timings=timings, profile=profile, backend=backend)
+        except Exception as e:
+            results.put((_FAILED, task_id, f"{type(e).__name__}: {e}"))
+        else:
+            results.put((_DONE, task_id, (output, timings)))
+        finally:
+            free_slots.release()
+
+    def orphaned():
+        # A terminated zygote cannot clean up its children, so each worker
+        # watches for it and exits instead of blocking on the queue forever
+        return os.getppid() != zygote_pid
+
+    with ThreadPoolExecutor(max_workers=slots, thread_name_prefix="render") as pool:
+        while True:
+            # Only take a task off the shared queue when a slot is free, so idle
+            # workers get the work instead of it queueing up behind a busy one
+            while not free_slots.acquire(timeout=_PARENT_POLL_SECONDS):
+                if orphaned():
+                    os._exit(0)
+            try:
+                task = tasks.get(timeout=_PARENT_POLL_SECONDS)
+            except queue.Empty:
+                free_slots.release()
+                if orphaned():
+                    os._exit(0)
+                continue
+            if task is None:
+                break
+            # SimpleQueue writes straight to the pipe, so the claim reaches the
+            # API process even if this worker is SIGKILLed right afterwards
+            results.put((_CLAIMED, task[0], pid))
+            pool.submit(run, *task)
+
+
+def _zygote(tasks, results, layout: ThreadLayout, engine_path: str, shutdown, api_pid: int, warmup_sizes: Sequence[int]):
+    """
+    Loads the models once, moves them to shared memory and forks the
+    inference workers from this clean, single-threaded process. Dead workers
+    are re-forked; everything exits on shutdown or when the API process goes away.
+    """
+    # Pool mode is CPU-only: a CUDA context cannot be used in a forked child
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    import torch
+
+    # Keep OpenMP's thread pool from starting here: it does not survive fork()
+    torch.set_num_threads(1)
+    # Only settable before the first parallel operator, and inherited by the workers
+    set_interop_threads(layout.inter_op)
+    started = time.monotonic()
+    engine = _load_engine_class(engine_path)(device="cpu")
+    engine.share_memory()
+    results.put((_READY, None, time.monotonic() - started))
+
+    fork = mp.get_context("fork")
+
+    def spawn(slot):
+        proc = fork.Process(
+            target=_serve, args=(engine, tasks, results, layout, slot, os.getpid(), warmup_sizes),
+            name=f"inference-{slot}", daemon=True,
+        )
+        proc.start()
+        return proc
+
+    procs = [spawn(slot) for slot in range(layout.processes)]
+    while True:
+        if os.getppid() != api_pid:
+            # The API process is gone; don't leave orphaned workers behind
+            for proc in procs:
+                proc.terminate()
+            return
+        for slot, proc in enumerate(procs):
+            proc.join(timeout=0.5)
+            if proc.exitcode is not None and proc.exitcode != 0 and not shutdown.is_set():
+                print(f"❌ Inference worker {proc.pid} exited with {proc.exitcode}, restarting")
+                results.put((_DIED, None, proc.pid))
+                procs[slot] = spawn(slot)
+        if shutdown.is_set() and all(proc.exitcode is not None for proc in procs):
+            return
+
+
+class WorkerPool:
+    """
+    Pre-forked multi-process inference (CPU only).
+
+    A zygote process loads the restoration backends and GFPGAN once, puts the tensors in shared
+    memory and forks `num_workers` children. Each child runs its own slice of
+    the physical cores (torch and OpenCV thread counts, optional CPU affinity;
+    see `plan_layout`), so RSS grows by the per-worker activations rather than
+    by a full copy of the weights.
+    The API process feeds them through a local queue and gets encoded images
+    back; it never loads the models itself.
+
+    Every task has a deadline. A task whose worker dies or that exceeds
+    `task_timeout` fails with WorkerError instead of hanging its caller.
+    """
+
+    def __init__(
+        self,
+        num_workers: int,
+        threads_per_worker: int = 0,
+        pin_cpus: bool = True,
+        slots_per_worker: int = 1,
+        task_timeout: float = 600.0,
+        engine: str = DEFAULT_ENGINE,
+        warmup_sizes: Sequence[int] = (),
+        cores: int = 0,
+        interop_threads: int = 0,
+        opencv_threads: int = 0,
+    ):
+        self.layout = plan_layout(
+            num_workers, slots_per_worker, cores=cores, intra_op=threads_per_worker,
+            inter_op=interop_threads, opencv=opencv_threads, pin=pin_cpus,
+        )
+        self.num_workers = self.layout.processes
+        self.threads_per_worker = self.layout.intra_op
+        self.pin_cpus = pin_cpus
+        self.slots_per_worker = self.layout.slots
+        self.task_timeout = task_timeout
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None  # slowest worker's warm-up
+        # The workers pick their tiles the same way once they run with their own thread count
+        from app.services.autotune import tuned_tile
+        self.tile, self.tile_pad = tuned_tile("cpu", self.threads_per_worker)
+
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.restarts = 0
+
+        # Spawned (not forked) so the zygote does not inherit this process's threads
+        ctx = mp.get_context("spawn")
+        self._tasks = ctx.Queue()
+        self._results = ctx.SimpleQueue()
+        self._shutdown = ctx.Event()
+        self._ids = itertools.count()
+        self._futures: Dict[int, Tuple[Future, float]] = {}  # task id -> (future, deadline)
+        self._claims: Dict[int, List[int]] = {}  # worker pid -> task ids it is running
+        self._warm: Set[int] = set()  # pids of workers that finished their warm-up
+        self._worker_threads: Dict[int, Dict[str, Any]] = {}  # worker pid -> its effective_layout()
+        self._lock = threading.Lock()
+
+        self._zygote = ctx.Process(
+            target=_zygote,
+            args=(
+                self._tasks, self._results, self.layout, engine, self._shutdown, os.getpid(), tuple(warmup_sizes),
+            ),
+            name="inference-zygote",
+        )
+        self._zygote.start()
+        self._listener = threading.Thread(target=self._listen, name="worker-results", daemon=True)
+        self._listener.start()
+
+    @property
+    def ready(self) -> bool:
+        """
+        True once the models are loaded and every worker has warmed up.
+        """
+        return self.load_seconds is not None and len(self._warm) >= self.num_workers
+
+    @property
+    def capacity(self) -> int:
+        return self.num_workers * self.slots_per_worker
+
+    def submit(self, data: bytes, fmt: Union[str, "OutputFormat"], preset: str = "full",
+               profile: Optional["ProfileSlot"] = None, backend: Optional[str] = None) -> Future:
+        """
+        Queues one render. The Future resolves to (output bytes, stage timings in ms).
+        With `profile`, the worker profiles the render and writes the files itself.
+        `backend` is the restoration backend (None = the default one).
+        """
+        task_id = next(self._ids)
+        future = Future()
+        future.task_id = task_id
+        with self._lock:
+            self._futures[task_id] = (future, time.monotonic() + self.task_timeout)
+        self._tasks.put((task_id, data, fmt, preset, profile, backend))
+        return future
+
+    def render(self, data: bytes, fmt: Union[str, "OutputFormat"], preset: str = "full",
+               timings: Optional[Dict[str, float]] = None, profile: Optional["ProfileSlot"] = None,
+               backend: Optional[str] = None) -> bytes:
+        future = self.submit(data, fmt, preset, profile, backend)
+        try:
+            output, stage_timings = future.result(timeout=self.task_timeout)
+        except FutureTimeoutError:
+            self._expire(future.task_id)
+            output, stage_timings = future.result()
+        if timings is not None:
+            timings.update(stage_timings)
+        return output
+
+    def worker_pids(self) -> List[int]:
+        """
+        Pids of the live inference workers (the zygote's children).
+        """
+        from app.services.memory import child_pids
+        return child_pids(self._zygote.pid) if self._zygote.pid else []
+
+    def fingerprint(self) -> dict:
+        from app.services.ai_engine import model_fingerprint
+        return {**model_fingerprint(self.tile, self.tile_pad), "device": "cpu"}
+
+    def readiness(self) -> dict:
+        error = None
+        if self.load_seconds is None and self._zygote.exitcode is not None:
+            error = f"Inference zygote exited with {self._zygote.exitcode} while loading the models"
+        return {
+            "ready": self.ready,
+            "mode": "worker_pool",
+            "device": "cpu",
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "warm_workers": len(self._warm),
+            "workers": self.num_workers,
+            "threads": {
+                "planned": self.layout.to_dict(),
+                "processes": sorted(self._worker_threads.values(), key=lambda threads: threads["pid"]),
+            },
+            "error": error,
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._futures)
+        return {
+            "mode": "worker_pool",
+            "device": "cpu",
+            "workers": self.num_workers,
+            "threads_per_worker": self.threads_per_worker,
+            "slots_per_worker": self.slots_per_worker,
+            "pin_cpus": self.pin_cpus,
+            "tile": self.tile,
+            "tile_pad": self.tile_pad,
+            "ready": self.ready,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "pending": pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "restarts": self.restarts,
+        }
+
+    def shutdown(self, timeout: float = 10.0):
+        self._shutdown.set()
+        for _ in range(self.num_workers):
+            self._tasks.put(None)
+        self._zygote.join(timeout=timeout)
+        if self._zygote.is_alive():
+            self._zygote.terminate()
+
+    def _expire(self, task_id: int):
+        with self._lock:
+            entry = self._futures.pop(task_id, None)
+        if entry is not None:
+            self.timed_out += 1
+            entry[0].set_exception(WorkerError(f"Inference task timed out after {self.task_timeout:.0f}s"))
+
+    def _fail_dead_worker(self, pid: int):
+        """
+        Fails the tasks the dead worker had claimed, plus anything past its deadline.
+        """
+        now = time.monotonic()
+        with self._lock:
+            doomed = [(task_id, "Inference worker died while processing this image")
+                      for task_id in self._claims.pop(pid, [])]
+            doomed += [(task_id, f"Inference task timed out after {self.task_timeout:.0f}s")
+                       for task_id, (_, deadline) in self._futures.items() if deadline < now]
+            failed = []
+            for task_id, reason in doomed:
+                entry = self._futures.pop(task_id, None)
+                if entry is not None:
+                    failed.append((entry[0], reason))
+        for future, reason in failed:
+            self.failed += 1
+            future.set_exception(WorkerError(reason))
+
+    def _listen(self):
+        while True:
+            try:
+                kind, task_id, payload = self._results.get()
+            except (EOFError, OSError):
+                return
+
+            if kind == _READY:
+                self.load_seconds = payload
+                print(f"✅ Inference models loaded in {payload:.1f}s, forking {self.num_workers} workers")
+                continue
+            if kind == _WARM:
+                pid, seconds, threads = payload
+                self._warm.add(pid)
+                self._worker_threads[pid] = threads
+                self.warmup_seconds = max(self.warmup_seconds or 0.0, seconds)
+                if len(self._warm) == self.num_workers:
+                    print(f"✅ Inference workers ready ({self.num_workers} x {self.threads_per_worker} threads)")
+                continue
+            if kind == _DIED:
+                # Not ready again until its replacement has warmed up
+                self.restarts += 1
+                self._warm.discard(payload)
+                self._worker_threads.pop(payload, None)
+                self._fail_dead_worker(payload)
+                continue
+
+            with self._lock:
+                if kind == _CLAIMED:
+                    self._claims.setdefault(payload, []).append(task_id)
+                    continue
+                entry = self._futures.pop(task_id, None)
+                for claimed in self._claims.values():
+                    if task_id in claimed:
+                        claimed.remove(task_id)
+
+            if entry is None:
+                # Already failed (timed out); drop the late result
+                continue
+            future = entry[0]
+            if kind == _DONE:
+                self.completed += 1
+                future.set_result(payload)
+            else:
+                self.failed += 1
+                future.set_exception(WorkerError(payload))
@@ -5,7 +5,9 @@ from pathlib import Path
 # Define the models we need (Updated RealESRGAN URL)
 MODELS = {
     "GFPGANv1.4.pth": "https://github.com/TencentARC/GFPGAN/releases/download/v1.3.0/GFPGANv1.4.pth",
-    "RealESRGAN_x2plus.pth": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth"
+    "RealESRGAN_x2plus.pth": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.1/RealESRGAN_x2plus.pth",
+    # SRVGGNetCompact, for the quick previews
+    "realesr-general-x4v3.pth": "https://github.com/xinntao/Real-ESRGAN/releases/download/v0.2.5.0/realesr-general-x4v3.pth",
 }
 
 # In Docker, we put weights here
@@ -27,6 +29,20 @@ def download_file(url, dest_path):
     except Exception as e:
         print(f"❌ Failed to download {dest_path.name}: {e}")
 
+def convert_file(pth_path):
+    # Flat copy the engine maps instead of unpickling the checkpoint (see app/services/weights.py)
+    from app.services.weights import convert, mapped_path
+
+    flat_path = Path(mapped_path(str(pth_path)))
+    if not pth_path.exists() or (flat_path.exists() and flat_path.stat().st_mtime >= pth_path.stat().st_mtime):
+        return
+    print(f"🔁 Converting {pth_path.name} to {flat_path.name}...")
+    try:
+        convert(str(pth_path), str(flat_path))
+        print(f"✅ Converted {pth_path.name}")
+    except Exception as e:
+        print(f"❌ Failed to convert {pth_path.name}: {e}")
+
 def setup():
     # Create directory if it doesn't exist
     if not WEIGHTS_DIR.exists():
@@ -36,6 +52,7 @@ def setup():
     for filename, url in MODELS.items():
         dest_path = WEIGHTS_DIR / filename
         download_file(url, dest_path)
+        convert_file(dest_path)
 
 if __name__ == "__main__":
     setup()
@@ -0,0 +1,31 @@
+import pytest
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """
+    The /api/v1 router wired to a fake renderer (no models) and a GCSService
+    over a filesystem bucket, with a write-behind spool. Yields (client, renderer, gcs).
+    """
+    pytest.importorskip("torch")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.api import endpoints
+    from app.config import settings
+    from app.services.gcs import FilesystemStore, GCSService
+    from tests.fakes import FakePreviewEngine, FakeRenderer
+
+    monkeypatch.setattr(settings, "CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(settings, "PROFILE_DIR", str(tmp_path / "profiles"))
+    monkeypatch.setattr(settings, "INFERENCE_PROCESSES", 0)
+
+    renderer = FakeRenderer()
+    gcs = GCSService(FilesystemStore(str(tmp_path / "buckets")), spool_dir=str(tmp_path / "spool"), backoff=0.01)
+    endpoints.startup(renderer_override=renderer, gcs_override=gcs, preview_override=FakePreviewEngine())
+
+    app = FastAPI()
+    app.include_router(endpoints.router, prefix="/api/v1")
+    with TestClient(app) as client:
+        yield client, renderer, gcs
+    endpoints.shutdown()
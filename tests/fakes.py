@@ -0,0 +1,108 @@
+"""
+Lightweight stand-ins for the model-backed services, used by the tests.
+"""
+import os
+import signal
+import time
+
+import numpy as np
+
+# Image heights that trigger special behaviour in FakeEngine
+CRASH_HEIGHT = 3
+ERROR_HEIGHT = 5
+SLOW_HEIGHT = 7
+
+
+class FakeEngine:
+    """
+    Quacks like AIEngine for the worker pool: holds a large "weights" tensor
+    and returns its input unchanged (or crashes / fails / stalls on request).
+    """
+
+    WEIGHT_BYTES = 64 * 1024 ** 2
+
+    def __init__(self, device=None):
+        import torch
+        self.device = torch.device(device or "cpu")
+        self.weights = torch.ones(self.WEIGHT_BYTES // 4)
+
+    def share_memory(self):
+        self.weights.share_memory_()
+
+    def reset_after_fork(self):
+        pass
+
+    def warm_up_faces(self):
+        pass
+
+    def enhance_array(self, img: np.ndarray, preset: str = "full", timings=None) -> np.ndarray:
+        # Touch every page of the weights, like a forward pass would
+        float(self.weights.sum())
+        height = img.shape[0]
+        if height == CRASH_HEIGHT:
+            os.kill(os.getpid(), signal.SIGKILL)
+        if height == ERROR_HEIGHT:
+            raise ValueError("bad input")
+        if height == SLOW_HEIGHT:
+            time.sleep(30)
+        return img
+
+
+class FakeRenderer:
+    """
+    In-process renderer that returns the upload unchanged and counts calls.
+    """
+
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self.presets = []
+        self.profiles = []
+        self.backends = []
+        self.ready = True
+
+    def render(self, data: bytes, ext: str, preset: str = "full", timings=None, profile=None, backend=None) -> bytes:
+        self.calls += 1
+        self.presets.append(preset)
+        self.profiles.append(profile)
+        self.backends.append(backend)
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("render failed")
+        return data
+
+    def fingerprint(self) -> dict:
+        return {"fake": 1}
+
+    def readiness(self) -> dict:
+        return {"ready": self.ready, "mode": "fake", "device": "cpu"}
+
+    def stats(self) -> dict:
+        return {"mode": "fake", "calls": self.calls}
+
+
+class FakePreviewEngine:
+    """
+    Stands in for PreviewEngine: answers with fixed bytes after `delay` seconds.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls = 0
+
+    def render(self, data: bytes, timings=None) -> bytes:
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        return b"preview"
+
+
+def png_bytes(height: int = 16, width: int = 16, seed: int = 0) -> bytes:
+    import cv2
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    ok, buf = cv2.imencode(".png", img)
+    assert ok
+    return buf.tobytes()
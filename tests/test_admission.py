@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("torch")
+
+from app.services.admission import AdmissionController, AdmissionRejected, request_cost  # noqa: E402
+
+
+def test_requests_within_budget_are_admitted_at_once():
+    async def scenario():
+        controller = AdmissionController(budget=100)
+        assert await controller.acquire(60) == 60
+        assert await controller.acquire(40) == 40
+        return controller.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["in_flight_bytes"] == 100
+    assert stats["admitted"] == 2 and stats["queued"] == 0
+
+
+def test_waiters_are_admitted_in_order_as_cost_is_released():
+    async def scenario():
+        controller = AdmissionController(budget=100, max_wait=5)
+        first = await controller.acquire(80)
+        order = []
+
+        async def request(name, cost):
+            await controller.acquire(cost)
+            order.append(name)
+
+        waiting = [asyncio.ensure_future(request("big", 60)), asyncio.ensure_future(request("small", 10))]
+        await asyncio.sleep(0.05)
+        # FIFO: the small one does not overtake the big one at the head of the queue
+        assert order == [] and controller.stats()["queued"] == 2
+
+        controller.release(first)
+        await asyncio.gather(*waiting)
+        return order, controller.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["big", "small"]
+    assert stats["in_flight_bytes"] == 70
+    assert stats["wait_seconds_max"] > 0
+
+
+def test_requests_are_shed_after_the_wait_or_when_the_queue_is_full():
+    async def scenario():
+        controller = AdmissionController(budget=100, max_wait=0.05, max_queue=1, retry_after=7)
+        await controller.acquire(100)
+        waiting = asyncio.ensure_future(controller.acquire(50))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as queue_full:
+            await controller.acquire(50)
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await waiting
+        return controller, queue_full.value, timed_out.value
+
+    controller, queue_full, timed_out = asyncio.run(scenario())
+    assert "waiting" in str(queue_full) and "waited" in str(timed_out)
+    assert timed_out.retry_after == 7
+    stats = controller.stats()
+    assert stats["shed"] == 2 and stats["queued"] == 0 and stats["in_flight_bytes"] == 100
+
+
+def test_oversized_requests_run_alone():
+    async def scenario():
+        controller = AdmissionController(budget=100)
+        return await controller.acquire(10 ** 12)
+
+    assert asyncio.run(scenario()) == 100
+
+
+def test_cost_grows_with_size_and_preset():
+    small = request_cost((500, 400), "full")
+    assert request_cost((1000, 800), "full") > small
+    assert request_cost((500, 400), "fast") < small
+    assert request_cost((500, 400), "full", faces=3) > small
@@ -0,0 +1,262 @@
+"""
+Equivalence checks between the app's re-implemented inference stages and
+the upstream RealESRGANer / GFPGANer code they replace. Uses tiny random
+networks, so no checkpoints are needed.
+"""
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("realesrgan")
+pytest.importorskip("gfpgan")
+
+from basicsr.archs.rrdbnet_arch import RRDBNet  # noqa: E402
+from realesrgan import RealESRGANer  # noqa: E402
+
+from app.services.tiling import TileBatcher, TiledUpsampler  # noqa: E402
+
+
+def _tiny_rrdbnet(seed=0):
+    torch.manual_seed(seed)
+    return RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=8, num_block=1, num_grow_ch=4, scale=2)
+
+
+def _realesrganer(model, tmp_path, tile, tile_pad):
+    weights = tmp_path / "tiny.pth"
+    torch.save({"params": model.state_dict()}, weights)
+    return RealESRGANer(
+        scale=2, model_path=str(weights), model=_tiny_rrdbnet(seed=1),
+        tile=tile, tile_pad=tile_pad, pre_pad=0, half=False, device=torch.device("cpu"),
+    )
+
+
+@pytest.mark.parametrize("shape", [(70, 50), (64, 64), (31, 97)])
+@pytest.mark.parametrize("max_batch", [1, 4])
+def test_tiled_upsampler_matches_realesrganer(tmp_path, shape, max_batch):
+    model = _tiny_rrdbnet().eval()
+    reference = _realesrganer(model, tmp_path, tile=32, tile_pad=4)
+    batcher = TileBatcher(model, torch.device("cpu"), max_batch=max_batch, max_wait_ms=1)
+    upsampler = TiledUpsampler(batcher, scale=2, tile=32, tile_pad=4)
+
+    img = np.random.default_rng(0).integers(0, 256, size=(*shape, 3), dtype=np.uint8)
+    expected, _ = reference.enhance(img, outscale=2)
+    actual, _ = upsampler.enhance(img, outscale=2)
+
+    assert actual.shape == expected.shape
+    # Batched convolutions may differ from single-tile ones in the last float bit
+    assert np.abs(actual.astype(int) - expected.astype(int)).max() <= 1
+
+
+def test_tile_batcher_batches_tiles_from_concurrent_images():
+    from concurrent.futures import ThreadPoolExecutor
+
+    model = _tiny_rrdbnet().eval()
+    batcher = TileBatcher(model, torch.device("cpu"), max_batch=8, max_wait_ms=50)
+    upsampler = TiledUpsampler(batcher, scale=2, tile=16, tile_pad=2)
+    imgs = [np.full((32, 32, 3), i * 40, dtype=np.uint8) for i in range(4)]
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda img: upsampler.enhance(img, outscale=2), imgs))
+
+    stats = batcher.stats()
+    assert stats["tiles"] == 16
+    assert stats["batches"] < 16
+
+
+class _FakeGFPGAN(torch.nn.Module):
+    def forward(self, x, return_rgb=False, weight=0.5):
+        return (torch.tanh(x.flip(1) * 1.3),)
+
+
+def _face_helper(monkeypatch, landmarks):
+    from facexlib.utils import face_restoration_helper
+
+    # Detection/parsing weights are not needed: landmarks are injected below
+    monkeypatch.setattr(face_restoration_helper, "init_detection_model", lambda *a, **k: None)
+    monkeypatch.setattr(face_restoration_helper, "init_parsing_model", lambda *a, **k: None)
+    helper = face_restoration_helper.FaceRestoreHelper(
+        2, face_size=512, crop_ratio=(1, 1), det_model="retinaface_resnet50",
+        save_ext="png", use_parse=False, device=torch.device("cpu"),
+    )
+
+    def get_face_landmarks_5(self, **kwargs):
+        self.all_landmarks_5 = [lm.copy() for lm in landmarks]
+        return len(self.all_landmarks_5)
+
+    monkeypatch.setattr(face_restoration_helper.FaceRestoreHelper, "get_face_landmarks_5", get_face_landmarks_5)
+    return helper
+
+
+@pytest.mark.parametrize("num_faces", [0, 1, 2])
+def test_staged_face_pipeline_matches_gfpganer(monkeypatch, tmp_path, num_faces):
+    import threading
+
+    from gfpgan import GFPGANer
+
+    from app.services.ai_engine import AIEngine
+
+    template = np.array([[192.98, 239.95], [318.90, 240.19], [256.63, 314.02], [201.26, 371.41], [313.09, 371.15]])
+    landmarks = [template / 8 + offset for offset in ([10, 12], [60, 40])][:num_faces]
+    img = np.random.default_rng(1).integers(0, 256, size=(120, 140, 3), dtype=np.uint8)
+
+    model = _tiny_rrdbnet().eval()
+    bg_upsampler = TiledUpsampler(TileBatcher(model, torch.device("cpu")), scale=2, tile=64, tile_pad=4)
+
+    gfpganer = GFPGANer.__new__(GFPGANer)
+    gfpganer.upscale = 2
+    gfpganer.device = torch.device("cpu")
+    gfpganer.gfpgan = _FakeGFPGAN()
+    gfpganer.face_helper = _face_helper(monkeypatch, landmarks)
+    gfpganer.bg_upsampler = bg_upsampler
+    _, _, expected = gfpganer.enhance(img.copy(), has_aligned=False, only_center_face=False, paste_back=True)
+
+    engine = AIEngine.__new__(AIEngine)
+    engine.device = torch.device("cpu")
+    engine.face_enhancer = gfpganer
+    engine.bg_upsampler = bg_upsampler
+    engine._lock = threading.Lock()
+    actual = engine.enhance_array(img.copy())
+
+    assert actual.shape == expected.shape
+    assert np.array_equal(actual, expected)
+
+
+def test_enhance_tensor_quantizes_to_enhance_output():
+    from app.core.image_proc import tensor_to_bgr
+
+    model = _tiny_rrdbnet().eval()
+    batcher = TileBatcher(model, torch.device("cpu"), max_batch=4, max_wait_ms=1)
+    upsampler = TiledUpsampler(batcher, scale=2, tile=32, tile_pad=4)
+    img = np.random.default_rng(1).integers(0, 256, size=(45, 38, 3), dtype=np.uint8)
+
+    expected, _ = upsampler.enhance(img, outscale=2)
+    tensor = upsampler.enhance_tensor(img)
+    assert tensor.shape == (3, 90, 76)
+    assert np.array_equal(tensor_to_bgr(tensor), expected)
+
+
+def test_tiled_upsampler_streams_into_a_memory_mapped_buffer(tmp_path):
+    from app.core.image_proc import tensor_to_bgr
+
+    model = _tiny_rrdbnet().eval()
+    batcher = TileBatcher(model, torch.device("cpu"), max_batch=4, max_wait_ms=1)
+    upsampler = TiledUpsampler(batcher, scale=2, tile=32, tile_pad=4)
+    img = np.random.default_rng(2).integers(0, 256, size=(45, 71, 3), dtype=np.uint8)
+
+    out = np.memmap(tmp_path / "out.bin", dtype=np.uint8, mode="w+", shape=(90, 142, 3))
+    streamed, _ = upsampler.enhance(img, outscale=2, out=out)
+    assert streamed is out
+    assert np.array_equal(streamed, upsampler.enhance(img, outscale=2)[0])
+    assert np.array_equal(streamed, tensor_to_bgr(upsampler.enhance_tensor(img)))
+
+
+def test_tiled_upsampler_keeps_a_bounded_window_of_tiles_in_flight():
+    from app.services.tiling import TILE_WINDOW_BATCHES
+
+    batcher = TileBatcher(_tiny_rrdbnet().eval(), torch.device("cpu"), max_batch=2, max_wait_ms=1)
+    upsampler = TiledUpsampler(batcher, scale=2, tile=16, tile_pad=2)
+    submitted = []
+    submit = batcher.submit
+    batcher.submit = lambda tile: submitted.append(tile) or submit(tile)
+    img = torch.from_numpy(np.random.default_rng(5).integers(0, 256, size=(3, 96, 96), dtype=np.uint8))
+
+    window = TILE_WINDOW_BATCHES * batcher.max_batch
+    done = 0
+    for _ in upsampler._run_tiles(img, to_float=True):
+        assert len(submitted) - done <= window
+        done += 1
+    assert done == len(submitted) == 36
+    assert all(tile.dtype == torch.float32 for tile in submitted)
+
+
+def _engine(monkeypatch, landmarks):
+    import threading
+
+    from gfpgan import GFPGANer
+
+    from app.services.ai_engine import AIEngine
+
+    model = _tiny_rrdbnet().eval()
+    gfpganer = GFPGANer.__new__(GFPGANer)
+    gfpganer.upscale = 2
+    gfpganer.device = torch.device("cpu")
+    gfpganer.gfpgan = _FakeGFPGAN()
+    gfpganer.face_helper = _face_helper(monkeypatch, landmarks)
+
+    engine = AIEngine.__new__(AIEngine)
+    engine.device = torch.device("cpu")
+    engine.face_enhancer = gfpganer
+    engine.tile_batcher = TileBatcher(model, torch.device("cpu"))
+    engine.bg_upsampler = TiledUpsampler(engine.tile_batcher, scale=2, tile=64, tile_pad=4)
+    engine._lock = threading.Lock()
+    return engine
+
+
+@pytest.mark.parametrize("preset, stages, tiles", [
+    ("full", {"face_detection", "face_restoration", "background", "paste_back"}, True),
+    ("faces_only", {"face_detection", "face_restoration", "background", "paste_back"}, False),
+    ("background_only", {"background"}, True),
+    ("fast", {"background"}, False),
+])
+def test_presets_skip_stages(monkeypatch, preset, stages, tiles):
+    from app.core.timing import FACES, pop_markers
+
+    template = np.array([[192.98, 239.95], [318.90, 240.19], [256.63, 314.02], [201.26, 371.41], [313.09, 371.15]])
+    engine = _engine(monkeypatch, [template / 8 + [10, 12]])
+    img = np.random.default_rng(3).integers(0, 256, size=(120, 140, 3), dtype=np.uint8)
+
+    timings = {}
+    out = engine.enhance_array(img, preset=preset, timings=timings)
+    assert out.shape == (240, 280, 3)
+    assert pop_markers(timings)[FACES] == (1 if "face_detection" in stages else 0)
+    assert set(timings) - {"resize"} == stages
+    assert (engine.tile_batcher.stats()["tiles"] > 0) == tiles
+
+
+def test_images_without_faces_skip_paste_back(monkeypatch):
+    engine = _engine(monkeypatch, [])
+    img = np.random.default_rng(4).integers(0, 256, size=(64, 64, 3), dtype=np.uint8)
+
+    timings = {}
+    out = engine.enhance_array(img, timings=timings)
+    assert "paste_back" not in timings
+    assert np.array_equal(out, engine.bg_upsampler.enhance(img, outscale=2)[0])
+
+
+def _registry(engine, models):
+    from app.services.backends import Backend, BackendConfig, BackendRegistry, BackendSpec
+
+    loaded = {}
+    for name, model, scale in models:
+        backend = Backend.__new__(Backend)
+        backend.spec = BackendSpec(name, {"type": type(model).__name__}, f"/w/{name}.pth", scale, tile=32)
+        backend.device = engine.device
+        backend.model = model
+        backend.init_runtime(64, 4)
+        loaded[name] = backend
+    registry = BackendRegistry.__new__(BackendRegistry)
+    registry.config = BackendConfig({name: backend.spec for name, backend in loaded.items()}, {}, models[0][0])
+    registry._backends = loaded
+    return registry
+
+
+def test_requests_pick_a_backend_and_get_the_pipeline_scale(monkeypatch):
+    from basicsr.archs.srvgg_arch import SRVGGNetCompact
+
+    from app.services.backends import UnknownBackendError
+
+    engine = _engine(monkeypatch, [])
+    torch.manual_seed(0)
+    compact = SRVGGNetCompact(num_in_ch=3, num_out_ch=3, num_feat=8, num_conv=2, upscale=4, act_type="prelu").eval()
+    engine.backends = _registry(engine, [("tiny_x2", _tiny_rrdbnet(), 2), ("tiny_x4", compact, 4)])
+    img = np.random.default_rng(5).integers(0, 256, size=(50, 46, 3), dtype=np.uint8)
+
+    out = engine.enhance_array(img, preset="background_only", backend="tiny_x4")
+    x4 = engine.backends.get("tiny_x4")
+    assert out.shape == (100, 92, 3)
+    assert np.array_equal(out, x4.upsamplers[0].enhance(img, outscale=2)[0])
+    assert engine.enhance_tensor(img, preset="background_only", backend="tiny_x4").shape == (3, 100, 92)
+    assert x4.stats()["tiles"] > 0
+    assert engine.backends.get("tiny_x2").stats()["tiles"] == 0
+    with pytest.raises(UnknownBackendError):
+        engine.enhance_array(img, backend="missing")
@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("basicsr")
+
+from basicsr.archs.rrdbnet_arch import RRDBNet  # noqa: E402
+
+from app.config import settings  # noqa: E402
+from app.services import autotune  # noqa: E402
+
+
+@pytest.fixture
+def tuning_file(tmp_path, monkeypatch):
+    path = tmp_path / "tiles.json"
+    monkeypatch.setattr(settings, "TILE_TUNING_FILE", str(path))
+    monkeypatch.setattr(settings, "TILE_AUTOTUNE", "load")
+    return path
+
+
+def _tiny_rrdbnet():
+    torch.manual_seed(0)
+    return RRDBNet(num_in_ch=3, num_out_ch=3, num_feat=8, num_block=1, num_grow_ch=4, scale=2).eval()
+
+
+def test_benchmark_measures_every_pair():
+    results = autotune.benchmark(_tiny_rrdbnet(), "cpu", [16, 32], [2, 4], image_size=48, repeats=1)
+    assert [(r["tile"], r["tile_pad"]) for r in results] == [(16, 2), (16, 4), (32, 2), (32, 4)]
+    assert all(r["megapixels_per_second"] > 0 for r in results)
+
+
+def test_benchmark_stops_its_tile_batcher():
+    import threading
+
+    def batchers():
+        return sum(1 for thread in threading.enumerate() if thread.name == "tile-batcher")
+
+    before = batchers()
+    autotune.benchmark(_tiny_rrdbnet(), "cpu", [16], [2], image_size=32, repeats=1)
+    assert batchers() == before
+
+
+def test_winner_respects_the_padding_floor():
+    results = [
+        {"tile": 128, "tile_pad": 4, "megapixels_per_second": 9.0},
+        {"tile": 256, "tile_pad": 10, "megapixels_per_second": 2.0},
+        {"tile": 200, "tile_pad": 10, "megapixels_per_second": 1.0},
+    ]
+    assert autotune.pick_winner(results, min_pad=10)["tile"] == 256
+    assert autotune.pick_winner([], min_pad=10) is None
+
+
+def test_autotune_stores_the_winner_per_hardware(tuning_file):
+    assert autotune.tuned_tile("cpu") == (settings.TILE_SIZE, settings.TILE_PAD)
+
+    entry = autotune.autotune(_tiny_rrdbnet(), "cpu", tile_sizes=[16, 24], tile_pads=[settings.TILE_PAD],
+                              image_size=48, repeats=1)
+    assert autotune.tuned_tile("cpu") == (entry["tile"], entry["tile_pad"])
+    assert entry["tile"] in (16, 24)
+
+    # Other hardware (here: another thread count) does not reuse it
+    stored = json.loads(tuning_file.read_text())
+    assert list(stored) == [autotune.hardware_key(autotune.hardware_fingerprint("cpu"))]
+    assert autotune.load_tuning(str(tuning_file), autotune.hardware_fingerprint("cpu", threads=999)) is None
+
+
+def test_autotune_off_ignores_stored_results(tuning_file, monkeypatch):
+    autotune.save_tuning(str(tuning_file), autotune.hardware_fingerprint("cpu"), [], {"tile": 64, "tile_pad": 12})
+    assert autotune.tuned_tile("cpu") == (64, 12)
+    monkeypatch.setattr(settings, "TILE_AUTOTUNE", "off")
+    assert autotune.tuned_tile("cpu") == (settings.TILE_SIZE, settings.TILE_PAD)
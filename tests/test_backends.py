@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from app.services import backends
+from app.services.backends import DEFAULT_CONFIG, BackendConfig, UnknownBackendError, load_backend_config
+
+
+def _config(**overrides):
+    config = {
+        "default": "big",
+        "backends": {
+            "big": {"network": {"type": "RRDBNet", "scale": 2}, "weights": "/w/big.pth", "scale": 2},
+            "small": {"network": {"type": "SRVGGNetCompact", "upscale": 4}, "weights": "/w/small.pth", "scale": 4,
+                      "tile": 400, "instances": 2},
+        },
+        "tiers": {"premium": "big", "standard": "small"},
+    }
+    config.update(overrides)
+    return BackendConfig.from_dict(config)
+
+
+@pytest.fixture
+def installed(monkeypatch):
+    """
+    Which checkpoints exist; every one unless removed from the set.
+    """
+    paths = {"/w/big.pth", "/w/small.pth"}
+    monkeypatch.setattr(backends, "_weights_present", lambda path: path in paths)
+    return paths
+
+
+def test_built_in_config_keeps_real_esrgan_as_the_default():
+    config = BackendConfig.from_dict(DEFAULT_CONFIG)
+    assert config.default == "realesrgan_x2"
+    assert config.backends["realesrgan_x2"].network["type"] == "RRDBNet"
+    assert config.backends["compact_x4"].scale == 4
+    # The autotuned tile is measured on RRDBNet, so other networks bring their own
+    for spec in config.backends.values():
+        if spec.network["type"] != "RRDBNet":
+            assert spec.tile > 0 and spec.tile_pad > 0
+    assert config.tiers["standard"] == "compact_x4"
+
+
+def test_requests_pick_a_backend_by_name_or_tier(installed):
+    config = _config()
+    assert config.resolve(None) is None
+    assert config.resolve("standard") == "small"
+    assert config.resolve("small") == "small"
+    # The default backend is never named, so its renders keep their cache keys
+    assert config.resolve("premium") is None
+    assert config.resolve("big") is None
+    with pytest.raises(UnknownBackendError):
+        config.resolve("turbo")
+
+
+def test_tier_without_its_weights_falls_back_to_the_default(installed):
+    installed.discard("/w/small.pth")
+    config = _config()
+    assert config.resolve("standard") is None
+    with pytest.raises(UnknownBackendError):
+        config.resolve("small")
+
+
+@pytest.mark.parametrize("overrides, message", [
+    ({"default": "huge"}, "Default backend"),
+    ({"tiers": {"standard": "tiny"}}, "unknown backend"),
+    ({"tiers": {"small": "big"}}, "name of another backend"),
+    ({"backends": {}}, "at least one"),
+    ({"backends": {"x": {"network": {}, "weights": "/w/x.pth", "scale": 2}}}, "`type`"),
+    ({"backends": {"x": {"network": {"type": "EDSR"}, "weights": "/w/x.pth"}}}, "`scale`"),
+    ({"backends": {"x": {"network": {"type": "EDSR"}, "weights": "/w/x.pth", "scale": 2, "instances": 0}}},
+     "instance"),
+])
+def test_invalid_configs_are_rejected(overrides, message):
+    if "backends" in overrides and "default" not in overrides:
+        overrides = {**overrides, "default": None, "tiers": {}}
+    with pytest.raises(ValueError, match=message):
+        _config(**overrides)
+
+
+def test_config_file_is_loaded(tmp_path, installed):
+    path = tmp_path / "backends.json"
+    path.write_text(json.dumps({
+        "backends": {"edsr": {"network": {"type": "EDSR", "num_in_ch": 3}, "weights": "/w/big.pth", "scale": 2,
+                              "tile": 128, "tile_batch": 8}},
+    }))
+    config = load_backend_config(str(path))
+    assert config.default == "edsr"
+    assert config.backends["edsr"].tile_batch == 8
+    assert config.to_dict()["backends"]["edsr"] == {
+        "network": "EDSR", "scale": 2, "tile": 128, "tile_pad": 0, "tile_batch": 8, "instances": 1,
+        "installed": True,
+    }
@@ -0,0 +1,113 @@
+import os
+
+from app.services.cache import ResultCache, content_key
+
+
+def _touch_later(cache, key):
+    # mtime is the on-disk LRU clock; make sure it moves between puts
+    path = cache._data_path(key)
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 1))
+
+
+def test_content_key_depends_on_fingerprint():
+    assert content_key(b"img", "a") == content_key(b"img", "a")
+    assert content_key(b"img", "a") != content_key(b"img", "b")
+    assert content_key(b"img", "a") != content_key(b"other", "a")
+
+
+def test_round_trip_and_disk_hit(tmp_path):
+    cache = ResultCache(str(tmp_path), max_disk_bytes=1000, max_memory_bytes=0)
+    assert cache.get("k") is None
+    cache.put("k", b"data", {"media_type": "image/png"})
+    assert cache.get("k") == (b"data", {"media_type": "image/png"})
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["disk_hits"] == 1
+    assert stats["memory_entries"] == 0
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_disk_bytes=0, max_memory_bytes=10)
+    cache.put("a", b"aaaa", {})
+    cache.put("b", b"bbbb", {})
+    assert cache.get("a") is not None  # "b" is now least recently used
+    cache.put("c", b"cccc", {})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    stats = cache.stats()
+    assert stats["memory_evictions"] == 1
+    assert stats["disk_evictions"] == 0
+    assert stats["memory_bytes"] == 8
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_disk_bytes=10, max_memory_bytes=0)
+    cache.put("a", b"aaaa", {})
+    cache.put("b", b"bbbb", {})
+    cache.put("c", b"cccc", {})
+    assert cache.get("a") is None
+    assert not os.path.exists(cache._data_path("a"))
+    assert not os.path.exists(cache._meta_path("a"))
+    stats = cache.stats()
+    assert stats["disk_evictions"] == 1
+    assert stats["disk_bytes"] == 8
+
+
+def test_oversized_entries_are_not_stored(tmp_path):
+    cache = ResultCache(str(tmp_path), max_disk_bytes=4, max_memory_bytes=4)
+    cache.put("big", b"0123456789", {})
+    assert cache.get("big") is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_index_survives_restart_in_lru_order(tmp_path):
+    cache = ResultCache(str(tmp_path), max_disk_bytes=100, max_memory_bytes=0)
+    cache.put("old", b"1111", {"n": 1})
+    cache.put("new", b"2222", {"n": 2})
+    _touch_later(cache, "new")
+
+    reopened = ResultCache(str(tmp_path), max_disk_bytes=6, max_memory_bytes=0)
+    assert reopened.get("old") is None
+    assert reopened.get("new") == (b"2222", {"n": 2})
+    assert reopened.stats()["disk_evictions"] == 1
+
+
+def test_restart_removes_partial_writes(tmp_path):
+    cache = ResultCache(str(tmp_path), max_disk_bytes=100, max_memory_bytes=0)
+    cache.put("ok", b"data", {})
+    (tmp_path / "orphan.bin").write_bytes(b"no meta")
+    (tmp_path / "lonely.json").write_text("{}")
+    (tmp_path / "ok.bin.123.tmp").write_bytes(b"half")
+
+    reopened = ResultCache(str(tmp_path), max_disk_bytes=100, max_memory_bytes=0)
+    assert sorted(os.listdir(tmp_path)) == ["ok.bin", "ok.json"]
+    stats = reopened.stats()
+    assert stats["disk_entries"] == 1
+    assert stats["disk_bytes"] == 4
+
+
+def test_failed_write_leaves_nothing_behind(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path), max_disk_bytes=100, max_memory_bytes=0)
+    real_write = cache._write_atomic
+
+    def fail_on_meta(path, data):
+        if path.endswith(".json"):
+            raise OSError("disk full")
+        real_write(path, data)
+
+    monkeypatch.setattr(cache, "_write_atomic", fail_on_meta)
+    cache.put("k", b"data", {})
+    assert os.listdir(tmp_path) == []
+    assert cache.stats()["disk_entries"] == 0
+    assert cache.get("k") is None
+
+
+def test_update_meta_rewrites_disk_entry(tmp_path):
+    cache = ResultCache(str(tmp_path), max_disk_bytes=100, max_memory_bytes=100)
+    cache.put("k", b"data", {"url": None})
+    cache.update_meta("k", {"url": "http://x"})
+    assert cache.get("k")[1] == {"url": "http://x"}
+    reopened = ResultCache(str(tmp_path), max_disk_bytes=100, max_memory_bytes=0)
+    assert reopened.get("k")[1] == {"url": "http://x"}
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+from app.core.codecs import (  # noqa: E402
+    OutputFormat, decode_image, encode_image, image_size, output_format, reduction_factor,
+)
+
+
+def _photo(height=64, width=80):
+    img = np.random.default_rng(0).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(img, (0, 0), 2)
+
+
+def test_default_format_follows_the_upload():
+    assert output_format("scan.png") == OutputFormat(".png")
+    assert output_format("scan.gif") == OutputFormat(".jpg")
+    assert output_format("scan.png", codec="WebP", quality=80) == OutputFormat(".webp", quality=80)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"codec": "gif"},
+    {"codec": "png", "quality": 80},
+    {"codec": "webp", "progressive": True},
+    {"codec": "jpeg", "png_compression": 3},
+    {"codec": "jpeg", "quality": 0},
+    {"codec": "png", "png_compression": 10},
+])
+def test_invalid_options_are_rejected(kwargs):
+    compression = kwargs.pop("png_compression", None)
+    with pytest.raises(ValueError):
+        output_format("scan.jpg", compression=compression, **kwargs)
+
+
+def test_encoder_options_are_applied():
+    img = _photo()
+    assert len(encode_image(img, OutputFormat(".jpg", quality=30))) < len(encode_image(img, ".jpg"))
+    assert len(encode_image(img, OutputFormat(".png", compression=9))) <= len(encode_image(img, OutputFormat(".png", compression=0)))
+
+    progressive = encode_image(img, OutputFormat(".jpg", quality=90, progressive=True))
+    assert b"\xff\xc2" in progressive  # SOF2: progressive DCT
+    assert decode_image(progressive).shape == img.shape
+
+
+@pytest.mark.parametrize("ext", [".jpg", ".png", ".webp", ".bmp"])
+def test_size_is_read_from_the_header(ext):
+    data = encode_image(_photo(37, 53), ext)
+    assert image_size(data) == (37, 53)
+    assert image_size(data[:8]) is None
+
+
+def test_progressive_jpeg_size_is_read_from_the_header():
+    data = encode_image(_photo(37, 53), OutputFormat(".jpg", progressive=True))
+    assert image_size(data) == (37, 53)
+
+
+def test_reduced_decode_covers_the_target():
+    assert reduction_factor((6000, 4000), (1500, 1000)) == 4
+    assert reduction_factor((6000, 4000), (1501, 1000)) == 2
+    assert reduction_factor((1200, 800), (1000, 700)) == 1
+
+    data = encode_image(_photo(400, 240), ".jpg")
+    assert decode_image(data, reduce=4).shape == (100, 60, 3)
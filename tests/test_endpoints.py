@@ -0,0 +1,419 @@
+import io
+import json
+import time
+import zipfile
+
+import pytest
+
+from tests.fakes import png_bytes
+
+
+def _post(client, data, **form):
+    return client.post("/api/v1/enhance", files={"file": ("page.png", data, "image/png")}, data=form)
+
+
+def _wait_done(client, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        payload = client.get(f"/api/v1/jobs/{job_id}").json()
+        if payload["status"] in ("done", "failed"):
+            return payload
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_result_filename_is_escaped_in_the_header(api):
+    client, _, _ = api
+    name = "página 1; x.png"
+    response = client.post("/api/v1/enhance", files={"file": (name, png_bytes(seed=3), "image/png")})
+    job_id = response.json()["job_id"]
+    _wait_done(client, job_id)
+
+    disposition = client.get(f"/api/v1/jobs/{job_id}/result").headers["Content-Disposition"]
+    assert disposition == (
+        "inline; filename=\"p_gina 1_ x.png\"; filename*=UTF-8''p%C3%A1gina%201%3B%20x.png"
+    )
+
+
+def test_enhance_returns_job_and_serves_result(api):
+    client, renderer, _ = api
+    data = png_bytes()
+    response = _post(client, data)
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    assert _wait_done(client, job_id)["status"] == "done"
+    result = client.get(f"/api/v1/jobs/{job_id}/result")
+    assert result.status_code == 200
+    assert result.headers["content-type"] == "image/png"
+    assert result.content == data
+    assert renderer.calls == 1
+
+
+def test_wait_true_returns_urls(api):
+    client, _, _ = api
+    response = _post(client, png_bytes(), wait="true")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "success"
+    assert body["enhanced_url"].endswith("page.png")
+
+
+def test_undecodable_upload_is_rejected_before_queuing(api):
+    client, renderer, _ = api
+    response = _post(client, b"definitely not an image")
+    assert response.status_code == 400
+    assert renderer.calls == 0
+
+
+def test_queue_full_returns_503(api, monkeypatch):
+    from app.api import endpoints
+    from app.services.jobs import QueueFullError
+
+    def full(*args, **kwargs):
+        raise QueueFullError("Job queue is full")
+
+    client, renderer, _ = api
+    monkeypatch.setattr(endpoints.jobs, "submit", full)
+    assert _post(client, png_bytes(seed=9)).status_code == 503
+    assert renderer.calls == 0
+
+
+def test_unknown_job_is_404(api):
+    client, _, _ = api
+    assert client.get("/api/v1/jobs/nope").status_code == 404
+    assert client.get("/api/v1/jobs/nope/result").status_code == 404
+
+
+def test_failed_job_reports_error(api):
+    client, renderer, _ = api
+    renderer.fail = True
+    job_id = _post(client, png_bytes(seed=3)).json()["job_id"]
+    payload = _wait_done(client, job_id)
+    assert payload["status"] == "failed"
+    assert client.get(f"/api/v1/jobs/{job_id}/result").status_code == 500
+
+
+def test_result_falls_back_to_cache_after_image_eviction(api):
+    from app.api import endpoints
+
+    client, _, _ = api
+    data = png_bytes(seed=5)
+    job_id = _post(client, data).json()["job_id"]
+    _wait_done(client, job_id)
+
+    job = endpoints.jobs.get(job_id)
+    job.result = {**job.result, "image": None}
+    assert client.get(f"/api/v1/jobs/{job_id}/result").content == data
+
+    endpoints.cache = None
+    assert client.get(f"/api/v1/jobs/{job_id}/result").status_code == 410
+
+
+def test_identical_uploads_share_one_render(api):
+    from app.api import endpoints
+
+    client, renderer, _ = api
+    renderer.delay = 0.3
+    data = png_bytes(seed=11)
+    first = _post(client, data).json()["job_id"]
+    second = _post(client, data).json()["job_id"]
+    assert first == second
+    _wait_done(client, first)
+    assert renderer.calls == 1
+    assert endpoints.in_flight.stats()["coalesced"] == 1
+
+
+def test_job_rechecks_cache_after_leader_finished(api):
+    from app.api import endpoints
+
+    client, renderer, _ = api
+    data = png_bytes(seed=12)
+    _wait_done(client, _post(client, data).json()["job_id"])
+    assert renderer.calls == 1
+
+    # A request that missed the cache just before the leader stored its output
+    key = endpoints.pipeline.cache_key(data, "page.png")
+    result = endpoints.pipeline.run(data, "page.png", "orig", "enh", key=key)
+    assert result["cached"] is True
+    assert renderer.calls == 1
+
+
+def test_tile_tuning_is_exposed_to_admins_once_ready(api, monkeypatch):
+    from app.config import settings
+
+    client, renderer, _ = api
+    assert client.get("/api/v1/admin/tiles").status_code == 403
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "secret")
+    admin = {"X-Admin-Token": "secret"}
+    assert client.get("/api/v1/admin/tiles").status_code == 401
+
+    renderer.ready = False
+    assert client.get("/api/v1/admin/tiles", headers=admin).status_code == 503
+    renderer.ready = True
+    body = client.get("/api/v1/admin/tiles", headers=admin).json()
+    assert body["autotune"] in ("off", "load", "startup")
+    assert body["hardware"]["device"] == "cpu"
+
+
+def test_preset_is_passed_to_the_renderer_and_keys_the_cache(api):
+    client, renderer, _ = api
+    data = png_bytes(seed=13)
+    _wait_done(client, _post(client, data, preset="fast").json()["job_id"])
+    payload = _wait_done(client, _post(client, data, preset="faces_only").json()["job_id"])
+    assert renderer.presets == ["fast", "faces_only"]
+    assert payload["result"]["preset"] == "faces_only"
+    assert "upload" in payload["result"]["timings_ms"]
+
+
+def test_unknown_preset_is_rejected(api):
+    client, renderer, _ = api
+    assert _post(client, png_bytes(), preset="turbo").status_code == 400
+    assert renderer.calls == 0
+
+
+def test_backend_is_picked_by_name_or_tier_and_keys_the_cache(api, monkeypatch):
+    from app.services import backends
+
+    monkeypatch.setattr(backends, "_weights_present", lambda path: True)
+    client, renderer, _ = api
+    data = png_bytes(seed=17)
+    standard = _wait_done(client, _post(client, data, backend="standard").json()["job_id"])
+    premium = _wait_done(client, _post(client, data, backend="premium").json()["job_id"])
+    named = _wait_done(client, _post(client, data, backend="compact_x4").json()["job_id"])
+
+    # The default backend is never named to the renderer
+    assert renderer.backends == ["compact_x4", None]
+    assert standard["result"]["backend"] == "compact_x4"
+    assert premium["result"]["backend"] == "realesrgan_x2"
+    assert named["result"]["cached"]
+    assert client.get("/api/v1/stats").json()["backends"]["compact_x4"]["renders"] >= 1
+    assert client.get("/api/v1/backends").json()["tiers"]["standard"] == "compact_x4"
+
+
+def test_unknown_backend_is_rejected(api):
+    client, renderer, _ = api
+    assert _post(client, png_bytes(), backend="turbo").status_code == 400
+    assert renderer.calls == 0
+
+
+def test_enhance_is_503_until_models_are_ready(api):
+    client, renderer, _ = api
+    renderer.ready = False
+    response = _post(client, png_bytes())
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    assert renderer.calls == 0
+
+    renderer.ready = True
+    assert _post(client, png_bytes()).status_code == 202
+
+
+def test_batch_streams_one_line_per_page(api):
+    client, renderer, _ = api
+    files = [
+        ("files", ("p1.png", png_bytes(seed=21), "image/png")),
+        ("files", ("notes.txt", b"not an image", "text/plain")),
+        ("files", ("p3.png", png_bytes(seed=23), "image/png")),
+    ]
+    response = client.post("/api/v1/enhance/batch", files=files)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    pages = sorted(lines[:-1], key=lambda record: record["index"])
+    assert [(p["filename"], p["status"]) for p in pages] == [("p1.png", "done"), ("notes.txt", "failed"), ("p3.png", "done")]
+    assert pages[0]["result"]["enhanced_url"]
+    assert lines[-1] == {"summary": {"pages": 3, "done": 2, "failed": 1}}
+    assert renderer.calls == 2
+
+    # Every page is a regular job
+    assert client.get(pages[2]["result_url"]).content == png_bytes(seed=23)
+
+
+def test_batch_accepts_a_zip_and_streams_a_zip(api):
+    client, _, _ = api
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        z.writestr("issue/02.png", png_bytes(seed=32))
+        z.writestr("issue/01.png", png_bytes(seed=31))
+        z.writestr("__MACOSX/issue/._01.png", b"resource fork")
+
+    response = client.post(
+        "/api/v1/enhance/batch",
+        files={"archive": ("issue.zip", archive.getvalue(), "application/zip")},
+        data={"response_format": "zip"},
+    )
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as z:
+        assert z.read("0000_01.png") == png_bytes(seed=31)
+        assert z.read("0001_02.png") == png_bytes(seed=32)
+        manifest = [json.loads(line) for line in z.read("manifest.ndjson").decode().splitlines()]
+    assert manifest[-1]["summary"]["done"] == 2
+
+
+def test_batch_rejects_a_non_zip_archive(api):
+    client, _, _ = api
+    response = client.post("/api/v1/enhance/batch", files={"archive": ("issue.zip", b"nope", "application/zip")})
+    assert response.status_code == 400
+
+
+def test_stream_returns_the_image_itself(api):
+    client, _, _ = api
+    data = png_bytes(seed=41)
+    response = _post(client, data, stream="true")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/png"
+    assert response.content == data
+    assert response.headers["X-Cache"] == "miss"
+    assert response.headers["X-Job-Id"]
+    assert "upload;dur=" in response.headers["Server-Timing"]
+
+    assert _post(client, data, stream="true").headers["X-Cache"] == "hit"
+
+
+def test_codec_options_pick_the_output_and_key_the_cache(api):
+    client, renderer, _ = api
+    data = png_bytes(seed=42)
+    response = _post(client, data, stream="true", codec="webp", quality="80")
+    assert response.headers["content-type"] == "image/webp"
+    assert response.headers["Content-Disposition"] == 'inline; filename="page.webp"'
+
+    assert _post(client, data, stream="true", codec="webp", quality="60").headers["X-Cache"] == "miss"
+    assert renderer.calls == 2
+
+    assert _post(client, data, codec="png", quality="80").status_code == 400
+
+
+def test_oversized_uploads_are_rejected_from_the_header(api, monkeypatch):
+    from app.config import settings
+
+    client, renderer, _ = api
+    monkeypatch.setattr(settings, "MAX_INPUT_PIXELS", 100)
+    response = _post(client, png_bytes(16, 16))
+    assert response.status_code == 413
+    assert "16x16" in response.json()["detail"]
+
+    monkeypatch.setattr(settings, "MAX_UPLOAD_BYTES", 64)
+    assert _post(client, png_bytes(16, 16)).status_code == 413
+    assert renderer.calls == 0
+
+
+def test_requests_over_the_memory_budget_wait_then_get_503(api, monkeypatch):
+    from app.api import endpoints
+    from app.services.admission import AdmissionController
+
+    client, renderer, _ = api
+    renderer.delay = 0.5
+    monkeypatch.setattr(endpoints, "admission", AdmissionController(budget=1, max_wait=0.05, retry_after=9))
+
+    assert _post(client, png_bytes(seed=51)).status_code == 202
+    response = _post(client, png_bytes(seed=52))
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "9"
+
+    stats = client.get("/api/v1/stats").json()["admission"]
+    assert stats["shed"] == 1 and stats["admitted"] == 1
+
+
+def test_identical_uploads_share_a_render_without_reserving_memory(api, monkeypatch):
+    from app.api import endpoints
+    from app.services.admission import AdmissionController
+
+    client, renderer, _ = api
+    renderer.delay = 0.5
+    monkeypatch.setattr(endpoints, "admission", AdmissionController(budget=1, max_wait=0.05, retry_after=9))
+
+    data = png_bytes(seed=53)
+    first = _post(client, data)
+    second = _post(client, data)
+    assert (first.status_code, second.status_code) == (202, 202)
+    assert first.json()["job_id"] == second.json()["job_id"]
+    stats = client.get("/api/v1/stats").json()["admission"]
+    assert stats["admitted"] == 1 and stats["shed"] == 0
+
+
+def test_jobs_carry_a_latency_estimate_and_the_model_learns(api):
+    client, _, _ = api
+    response = _post(client, png_bytes(seed=61))
+    estimate = float(response.headers["X-Estimated-Ms"])
+    assert estimate > 0
+    assert response.json()["estimated_ms"] == pytest.approx(estimate, abs=1)
+    _wait_done(client, response.json()["job_id"])
+
+    assert client.get("/api/v1/stats").json()["latency"]["observations"] == 1
+    assert "X-Estimated-Ms" in _post(client, png_bytes(seed=62), stream="true").headers
+
+
+def test_metrics_expose_stage_histograms_and_counters(api):
+    from app.core import metrics
+
+    client, _, _ = api
+    requests_before = metrics.REQUESTS.value("enhance")
+    invalid_before = metrics.ERRORS.value("invalid")
+    response = _post(client, png_bytes(seed=71), wait="true")
+    assert response.status_code == 200
+    assert _post(client, png_bytes(seed=71), wait="true").json()["cached"]
+    assert _post(client, b"not an image").status_code == 400
+
+    assert metrics.REQUESTS.value("enhance") == requests_before + 3
+    assert metrics.ERRORS.value("invalid") == invalid_before + 1
+    text = client.get("/api/v1/metrics").text
+    assert 'enhance_stage_seconds_bucket{stage="upload",le="+Inf"}' in text
+    assert 'enhance_stage_seconds_count{stage="upload_spool"}' in text
+    assert "enhance_cache_hits_total" in text
+    assert "enhance_queue_depth 0" in text
+    assert 'enhance_torch_threads{process="api"}' in text
+
+
+def test_profiling_is_admin_only_and_captures_the_next_requests(api, monkeypatch):
+    from app.config import settings
+
+    client, renderer, _ = api
+    assert client.post("/api/v1/admin/profile").status_code == 403
+    monkeypatch.setattr(settings, "ADMIN_TOKEN", "secret")
+    assert client.post("/api/v1/admin/profile", headers={"X-Admin-Token": "wrong"}).status_code == 401
+
+    admin = {"X-Admin-Token": "secret"}
+    _post(client, png_bytes(seed=81), wait="true")
+    assert renderer.profiles == [None]  # not armed: nothing instrumented
+
+    session = client.post("/api/v1/admin/profile", data={"requests": "1"}, headers=admin).json()
+    assert client.get(session["download_url"], headers=admin).status_code == 409
+    _post(client, png_bytes(seed=82), wait="true")
+    _post(client, png_bytes(seed=83), wait="true")
+    assert renderer.profiles[1] is not None and renderer.profiles[2] is None
+
+    status = client.get(session["status_url"], headers=admin).json()
+    assert status["captured"] == 1 and status["remaining"] == 0
+    download = client.get(session["download_url"], headers=admin)
+    assert download.status_code == 200
+    assert download.headers["content-type"] == "application/zip"
+
+
+def test_preview_is_served_until_the_full_result_replaces_it(api):
+    client, renderer, _ = api
+    renderer.delay = 0.5
+    data = png_bytes(seed=91)
+    payload = _post(client, data, preview="true").json()
+    assert payload["preview_url"].endswith(f"/jobs/{payload['job_id']}/preview")
+
+    deadline = time.monotonic() + 5.0
+    while True:
+        response = client.get(payload["preview_url"])
+        if response.status_code == 200:
+            break
+        assert response.status_code == 202 and time.monotonic() < deadline
+        time.sleep(0.01)
+    assert response.headers["x-preview"] == "preview"
+    assert response.content == b"preview"
+
+    _wait_done(client, payload["job_id"])
+    final = client.get(payload["preview_url"])
+    assert final.headers["x-preview"] == "final"
+    assert final.content == data
+
+    # Without preview=true there is nothing to show before the result
+    renderer.delay = 0.3
+    job_id = _post(client, png_bytes(seed=92)).json()["job_id"]
+    assert client.get(f"/api/v1/jobs/{job_id}/preview").status_code == 404
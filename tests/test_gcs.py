@@ -0,0 +1,116 @@
+import hashlib
+import os
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from app.services.gcs import FilesystemStore, GCSService, UploadSpool
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FilesystemStore(str(tmp_path / "buckets"))
+
+
+@pytest.fixture
+def service(store, tmp_path):
+    gcs = GCSService(store, spool_dir=str(tmp_path / "spool"), workers=2, backoff=0.0)
+    yield gcs
+    gcs.shutdown()
+
+
+def _name(url, store, bucket):
+    prefix = os.path.join(os.path.abspath(store.root), bucket) + os.sep
+    path = url[len("file://"):]
+    assert path.startswith(prefix)
+    return path[len(prefix):]
+
+
+def test_upload_is_stored_and_returns_its_url(service, store):
+    url = service.upload_bytes(b"page", "page.png", "enhanced", folder="enhanced", content_type="image/png")
+    name = _name(url, store, "enhanced")
+    assert name.startswith("enhanced/") and name.endswith("_page.png")
+    assert store.read("enhanced", name) == b"page"
+    assert service.stats()["uploads"] == 1
+
+
+def test_originals_are_deduplicated_by_content(service, store, tmp_path):
+    first = service.upload_bytes(b"scan", "a.JPG", "originals", folder="originals")
+    second = service.upload_bytes(b"scan", "b.jpg", "originals", folder="originals")
+    assert first == second
+    assert _name(first, store, "originals") == f"originals/{hashlib.sha256(b'scan').hexdigest()}.jpg"
+    assert store.puts == 1
+    assert service.stats()["deduplicated"] == 1
+
+    # A new process finds the object in the bucket instead of in its memory
+    restarted = GCSService(store, workers=1, backoff=0.0)
+    assert restarted.upload_bytes(b"scan", "c.jpg", "originals", folder="originals") == first
+    assert store.puts == 1
+    restarted.shutdown()
+
+
+def test_transient_failures_are_retried(service, store):
+    store.fail_next = 2
+    assert service.upload_bytes(b"page", "page.png", "enhanced") is not None
+    assert service.stats()["retries"] == 2
+
+    store.fail_next = 3
+    assert service.upload_bytes(b"page", "page.png", "enhanced") is None
+    assert service.stats()["failures"] == 1
+
+
+def test_upload_async_returns_a_future(service, store):
+    future = service.upload_async(b"scan", "scan.png", "originals", folder="originals")
+    assert isinstance(future, Future)
+    assert store.read("originals", _name(future.result(timeout=5), store, "originals")) == b"scan"
+
+
+def test_upload_behind_returns_before_the_object_is_stored(service, store):
+    store.fail_next = 1  # the first spooled attempt fails and is retried
+    url = service.upload_behind(b"page", "page.png", "enhanced", folder="enhanced")
+    assert service.spool.flush(timeout=5)
+    assert store.read("enhanced", _name(url, store, "enhanced")) == b"page"
+    assert service.spool.stats() == {"pending": 0, "uploaded": 1, "retries": 1, "failed": 0, "parked": 0}
+    assert os.listdir(service.spool.directory) == ["failed"]
+
+
+class _Down:
+    def put(self, *args):
+        raise ConnectionError("offline")
+
+    def permanent(self, error):
+        return False
+
+
+def test_spooled_uploads_are_parked_and_resumed_after_a_restart(tmp_path, store):
+    directory = str(tmp_path / "spool")
+    spool = UploadSpool(directory, _Down(), workers=1, max_attempts=2, backoff=0.0)
+    spool.add("enhanced", "enhanced/page.png", b"page", "image/png")
+    assert spool.flush(timeout=5)
+    spool.shutdown()
+    assert spool.stats()["failed"] == 1
+    assert spool.stats()["parked"] == 1
+
+    # Leftovers of an interrupted write are dropped, parked uploads retried
+    open(os.path.join(directory, "orphan.bin"), "wb").close()
+    spool = UploadSpool(directory, store, workers=1, backoff=0.0)
+    assert spool.flush(timeout=5)
+    spool.shutdown()
+    assert store.read("enhanced", "enhanced/page.png") == b"page"
+    assert spool.stats()["uploaded"] == 1
+    assert os.listdir(directory) == ["failed"]
+    assert os.listdir(os.path.join(directory, "failed")) == []
+
+
+def test_without_a_store_uploads_get_mock_urls(monkeypatch):
+    from app.services import gcs
+
+    def offline(**kwargs):
+        raise RuntimeError("no credentials")
+
+    monkeypatch.setattr(gcs, "GoogleCloudStore", offline)
+    service = GCSService(spool_dir="unused")
+    assert service.spool is None
+    assert service.upload_behind(b"page", "page.png", "enhanced") == "http://localhost/mock/page.png"
+    service.shutdown()
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip("cv2")
+
+from app.core.image_proc import MagazineEnhancer
+
+
+def _photo(height, width, seed=0):
+    # Smooth noise looks more like a photo than white noise does
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(img, (0, 0), 2)
+
+
+@pytest.mark.parametrize("shape", [(64, 80), (301, 199)])
+def test_fused_look_matches_pil_reference(shape):
+    img = _photo(*shape)
+    fused = MagazineEnhancer.apply_magazine_look_array(img)
+    reference = MagazineEnhancer.apply_magazine_look_reference(img)
+    diff = np.abs(fused.astype(np.int16) - reference.astype(np.int16))
+    assert fused.shape == reference.shape and fused.dtype == np.uint8
+    assert diff.max() <= 4
+    assert diff.mean() < 0.5
+
+
+def test_extremes_match_pil_reference():
+    img = np.zeros((32, 32, 3), dtype=np.uint8)
+    img[:16] = 255
+    img[:, :8] = (0, 0, 255)
+    fused = MagazineEnhancer.apply_magazine_look_array(img)
+    reference = MagazineEnhancer.apply_magazine_look_reference(img)
+    assert np.abs(fused.astype(np.int16) - reference.astype(np.int16)).max() <= 4
+
+
+def test_input_is_not_modified():
+    img = _photo(40, 40)
+    before = img.copy()
+    MagazineEnhancer.apply_magazine_look_array(img)
+    assert np.array_equal(img, before)
+
+
+def _rgb_tensor(img):
+    import torch
+    return torch.from_numpy(img[:, :, ::-1].copy()).permute(2, 0, 1).float() / 255.0
+
+
+def test_tensor_look_matches_pil_reference():
+    pytest.importorskip("torch")
+    from app.core.image_proc import tensor_to_bgr
+
+    img = _photo(120, 90)
+    out = tensor_to_bgr(MagazineEnhancer.apply_magazine_look_tensor(_rgb_tensor(img)))
+    reference = MagazineEnhancer.apply_magazine_look_reference(img)
+    diff = np.abs(out.astype(np.int16) - reference.astype(np.int16))
+    assert out.shape == reference.shape and out.dtype == np.uint8
+    # The reference truncates after every stage; the tensor path rounds once
+    assert diff.max() <= 4
+    assert diff.mean() < 2
+
+
+def test_tensor_look_is_per_image_in_a_batch():
+    torch = pytest.importorskip("torch")
+
+    images = [_rgb_tensor(_photo(40, 48, seed=seed)) for seed in range(3)]
+    batched = MagazineEnhancer.apply_magazine_look_tensor(torch.stack(images))
+    for image, out in zip(images, batched):
+        single = MagazineEnhancer.apply_magazine_look_tensor(image)
+        assert torch.allclose(single, out, atol=1e-6)
+
+
+def test_tensor_look_handles_images_smaller_than_the_blur():
+    pytest.importorskip("torch")
+    from app.core.image_proc import tensor_to_bgr
+
+    out = tensor_to_bgr(MagazineEnhancer.apply_magazine_look_tensor(_rgb_tensor(_photo(5, 7))))
+    assert out.shape == (5, 7, 3)
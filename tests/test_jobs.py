@@ -0,0 +1,114 @@
+import threading
+import time
+
+import pytest
+
+from app.services.jobs import JobManager, JobStatus, QueueFullError
+
+
+def _wait(job, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not job.finished:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_job_runs_and_stores_result():
+    jobs = JobManager(max_workers=1)
+    job = jobs.submit(lambda x: {"value": x}, 42)
+    assert job.future.result(timeout=5) == {"value": 42}
+    _wait(job)
+    assert job.status == JobStatus.DONE
+    assert jobs.get(job.id).result == {"value": 42}
+    jobs.shutdown()
+
+
+def test_failure_is_propagated():
+    def boom():
+        raise ValueError("broken")
+
+    jobs = JobManager(max_workers=1)
+    job = jobs.submit(boom)
+    with pytest.raises(ValueError):
+        job.future.result(timeout=5)
+    _wait(job)
+    assert job.status == JobStatus.FAILED
+    assert job.error == "broken"
+    jobs.shutdown()
+
+
+def test_queue_full_is_rejected():
+    release = threading.Event()
+    jobs = JobManager(max_workers=1, max_pending=2)
+    jobs.submit(release.wait)
+    jobs.submit(release.wait)
+    with pytest.raises(QueueFullError):
+        jobs.submit(release.wait)
+    release.set()
+    jobs.shutdown()
+
+
+def test_finished_jobs_expire_after_ttl():
+    jobs = JobManager(max_workers=1, ttl=0.05)
+    job = jobs.submit(lambda: {})
+    _wait(job)
+    time.sleep(0.1)
+    jobs.submit(lambda: {})  # eviction happens on submit
+    assert jobs.get(job.id) is None
+    jobs.shutdown()
+
+
+def test_retention_keeps_only_newest_finished_jobs():
+    jobs = JobManager(max_workers=1, max_retained=2)
+    done = [jobs.complete({"n": i}) for i in range(3)]
+    jobs.complete({"n": 3})
+    assert jobs.get(done[0].id) is None
+    assert jobs.get(done[2].id) is not None
+    jobs.shutdown()
+
+
+def test_complete_registers_a_finished_job():
+    jobs = JobManager(max_workers=1)
+    job = jobs.complete({"cached": True})
+    assert job.status == JobStatus.DONE
+    assert job.future.result(timeout=0) == {"cached": True}
+    jobs.shutdown()
+
+
+def test_stored_images_are_capped_by_bytes():
+    jobs = JobManager(max_workers=1, max_result_bytes=250)
+    old = jobs.complete({"image": b"x" * 100})
+    mid = jobs.complete({"image": b"y" * 100})
+    new = jobs.complete({"image": b"z" * 100})
+    jobs.complete({"image": None})  # triggers eviction
+    assert old.result["image"] is None
+    assert mid.result["image"] == b"y" * 100
+    assert new.result["image"] == b"z" * 100
+    assert jobs.stats()["result_bytes"] == 200
+    jobs.shutdown()
+
+
+def test_shortest_expected_job_runs_first():
+    release = threading.Event()
+    order = []
+    jobs = JobManager(max_workers=1, aging=0.0)
+    jobs.submit(release.wait)  # occupies the only thread while the others queue
+    for name, estimate in (("long", 5000.0), ("short", 100.0), ("medium", 1000.0)):
+        jobs.submit(order.append, name, estimated_ms=estimate)
+    assert jobs.stats()["queued_estimated_ms"] == 6100.0
+    release.set()
+    jobs.shutdown()
+    assert order == ["short", "medium", "long"]
+
+
+def test_aging_lets_a_long_wait_beat_a_shorter_estimate():
+    release = threading.Event()
+    order = []
+    jobs = JobManager(max_workers=1, aging=1.0)
+    jobs.submit(release.wait)
+    jobs.submit(order.append, "long", estimated_ms=20.0)
+    time.sleep(0.1)  # 100 ms of waiting outweighs the 20 ms difference
+    jobs.submit(order.append, "short", estimated_ms=0.0)
+    release.set()
+    jobs.shutdown()
+    assert order == ["long", "short"]
@@ -0,0 +1,72 @@
+import pytest
+
+pytest.importorskip("torch")
+
+from app.services.latency import LatencyModel  # noqa: E402
+
+
+def _timings(size, faces):
+    # Synthetic host: RRDBNet 3 s per processed megapixel, 500 ms per face
+    mp = size[0] * size[1] / 1e6
+    return {
+        "decode": 10 * mp, "resize": 0.0, "face_detection": 100 * mp, "face_restoration": 500.0 * faces,
+        "paste_back": 20.0 * faces, "background": 3000 * mp, "magazine_look": 40 * mp,
+        "encode": 30 * mp, "upload": 25.0,
+    }
+
+
+def test_model_learns_stage_costs_from_timings():
+    model = LatencyModel(forgetting=1.0)
+    sizes = [(400, 300), (800, 600), (1000, 1000), (600, 400)]
+    for i in range(60):
+        size = sizes[i % len(sizes)]
+        model.observe(size, "full", 2, _timings(size, 2))
+
+    expected = sum(_timings((900, 700), 2).values())
+    assert model.predict((900, 700), "full") == pytest.approx(expected, rel=0.05)
+    assert model.stats()["expected_faces"] == pytest.approx(2.0, abs=0.1)
+    assert model.stats()["mean_relative_error"] < 0.05
+
+
+def test_small_jobs_are_predicted_faster_and_presets_skip_stages():
+    model = LatencyModel()
+    assert model.predict((400, 300), "full") < model.predict((1200, 900), "full")
+    assert model.predict((400, 300), "fast") < model.predict((400, 300), "background_only")
+    assert model.predict(None, "full") > 0
+
+
+def test_model_survives_a_restart(tmp_path):
+    model = LatencyModel()
+    for _ in range(5):
+        model.observe((800, 600), "full", 1, _timings((800, 600), 1))
+    path = str(tmp_path / "latency.json")
+    model.save(path)
+
+    restored = LatencyModel()
+    assert restored.load(path)
+    assert restored.predict((800, 600), "full") == pytest.approx(model.predict((800, 600), "full"))
+    assert not LatencyModel().load(str(tmp_path / "missing.json"))
+
+
+def test_backends_learn_their_own_background_cost(tmp_path):
+    model = LatencyModel(forgetting=1.0)
+    size = (800, 600)
+    background = model.stats()["stages"]["background"]
+    for _ in range(20):
+        timings = _timings(size, 0)
+        model.observe(size, "background_only", 0, {**timings, "background": timings["background"] / 10},
+                      backend="compact_x4")
+
+    # Only "background" depends on the backend (every backend's output is resized
+    # to the same x2), so the other stages learn from these renders for all of them
+    stages = model.stats()["stages"]
+    assert stages["background"] == background
+    assert stages["background@compact_x4"]["slope_ms"] < background["slope_ms"] / 5
+    assert model.predict(size, "background_only", backend="compact_x4") < model.predict(size, "background_only")
+    path = str(tmp_path / "latency.json")
+    model.save(path)
+    restored = LatencyModel()
+    assert restored.load(path)
+    assert restored.predict(size, "background_only", backend="compact_x4") == pytest.approx(
+        model.predict(size, "background_only", backend="compact_x4")
+    )
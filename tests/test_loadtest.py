@@ -0,0 +1,64 @@
+import pytest
+
+pytest.importorskip("cv2")
+
+from app.loadtest import (  # noqa: E402
+    Record, build_workload, closed_loop, markdown, open_loop, parse_sizes, percentile, summarize, unique_bytes,
+)
+
+
+def test_percentiles_use_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([7.0], 95) == 7.0
+    assert percentile([], 50) is None
+
+
+def test_workload_pages_decode_at_their_size():
+    import cv2
+    import numpy as np
+
+    sizes = parse_sizes("200x300,400x500")
+    assert sizes == [(300, 200), (500, 400)]
+    workload = build_workload(sizes, faces=3, per_size=1)
+    for sample, (height, width) in zip(workload, sizes):
+        page = cv2.imdecode(np.frombuffer(unique_bytes(sample, 7), np.uint8), cv2.IMREAD_COLOR)
+        assert page.shape == (height, width, 3)
+        assert sample.label == f"{width}x{height}"
+
+
+def _fake_send(sample, data):
+    return Record(sample.label, 200, 10.0 * sample.width / 200, {"background": 5.0, "encode": 1.0}, False, 0.06)
+
+
+def test_drivers_send_the_requested_load_and_report_it():
+    workload = build_workload(parse_sizes("200x300,400x500"), faces=0, per_size=1)
+    records, elapsed = closed_loop(_fake_send, workload, concurrency=3, requests=10)
+    assert len(records) == 10
+    records_open, _ = open_loop(_fake_send, workload, rate=500.0, requests=10, max_in_flight=4)
+    assert len(records_open) == 10
+
+    report = summarize(records + [Record("200x300", 503, 1.0, {}, False, 0.06, "busy")], elapsed)
+    assert report["succeeded"] == 10 and report["errors"] == {"503": 1}
+    assert report["latency_ms_by_size"]["400x500"]["p50"] == 20.0
+    assert report["stages_ms"]["background"]["mean"] == 5.0
+    assert "| latency p95 (ms) | 20 (+0.0%) |" in markdown(report, baseline=report)
+
+
+def test_closed_loop_against_the_api(api):
+    from app.loadtest import _record
+
+    client, renderer, _ = api
+    workload = build_workload(parse_sizes("64x48"), faces=1, per_size=1)
+
+    def send(sample, data):
+        response = client.post("/api/v1/enhance", files={"file": (sample.filename, data, "image/jpeg")},
+                               data={"wait": "true"})
+        return _record(sample, response.status_code, 1.0, response.json, response.text)
+
+    records, elapsed = closed_loop(send, workload, concurrency=2, requests=4)
+    report = summarize(records, elapsed)
+    assert report["succeeded"] == 4 and report["cached"] == 0
+    assert renderer.calls == 4
+    assert "upload" in report["stages_ms"]
@@ -0,0 +1,40 @@
+from app.services.memory import MIN_DIMENSION, estimate_peak_bytes, fit_to_budget
+
+
+def test_estimate_grows_with_image_and_faces():
+    small = estimate_peak_bytes(600, 800)
+    assert estimate_peak_bytes(1200, 1600) > small
+    assert estimate_peak_bytes(600, 800, faces=1) > small
+    assert estimate_peak_bytes(600, 800, faces=3) > estimate_peak_bytes(600, 800, faces=1)
+
+
+def test_tiling_bounds_the_activations():
+    # Without tiling the model activations scale with the whole image
+    assert estimate_peak_bytes(3000, 3000, tile=0) > 10 * estimate_peak_bytes(3000, 3000, tile=200)
+
+
+def test_tile_window_is_counted():
+    # Float copies of the tiles in flight and their outputs grow with the batch size
+    assert estimate_peak_bytes(3000, 3000, tile_batch=8) > estimate_peak_bytes(3000, 3000, tile_batch=4)
+
+
+def test_memory_mapped_output_is_not_counted():
+    assert estimate_peak_bytes(2000, 2000, mmap_output=True) < estimate_peak_bytes(2000, 2000)
+    assert estimate_peak_bytes(2000, 2000, float_output=True) > estimate_peak_bytes(2000, 2000)
+
+
+def test_fit_keeps_full_resolution_when_it_fits():
+    assert fit_to_budget(1500, 1000, 8 * 1024 ** 3) == (1500, 1000)
+
+
+def test_fit_shrinks_into_the_budget_keeping_the_aspect_ratio():
+    budget = 1024 ** 3
+    height, width = fit_to_budget(6000, 4000, budget, faces=2)
+    assert estimate_peak_bytes(height, width, faces=2) <= budget
+    assert abs(height / width - 1.5) < 0.01
+    # As large as the budget allows, not just "small enough"
+    assert estimate_peak_bytes(int(height * 1.05), int(width * 1.05), faces=2) > budget
+
+
+def test_fit_never_goes_below_the_minimum_size():
+    assert max(fit_to_budget(6000, 4000, 1)) == MIN_DIMENSION
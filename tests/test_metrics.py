@@ -0,0 +1,63 @@
+import threading
+
+from app.core.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_counter_adds_up_every_threads_shard():
+    counter = Counter("things_total", "Things.", ["kind"])
+
+    def work():
+        for _ in range(1000):
+            counter.inc("a")
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counter.inc("b", amount=2.5)
+
+    assert counter.value("a") == 4000
+    assert counter.collect() == [
+        "# HELP things_total Things.",
+        "# TYPE things_total counter",
+        'things_total{kind="a"} 4000',
+        'things_total{kind="b"} 2.5',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("latency_seconds", "Latency.", ["stage"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, "decode")
+
+    lines = histogram.collect()
+    assert 'latency_seconds_bucket{stage="decode",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{stage="decode",le="1"} 3' in lines
+    assert 'latency_seconds_bucket{stage="decode",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{stage="decode"} 4.05' in lines
+    assert 'latency_seconds_count{stage="decode"} 4' in lines
+    assert histogram.count("decode") == 4
+    assert abs(histogram.total("decode") - 4.05) < 1e-9
+
+
+def test_registry_renders_gauges_and_skips_broken_ones():
+    registry = Registry()
+    registry.register(Gauge("depth", "Queue depth.", lambda: 3))
+    registry.register(Gauge("rss_bytes", "RSS.", lambda: {("1",): 10, ("2",): 20}, ["pid"]))
+    registry.register(Gauge("broken", "Raises.", lambda: 1 / 0))
+
+    text = registry.render()
+    assert "depth 3\n" in text
+    assert 'rss_bytes{pid="2"} 20\n' in text
+    assert "broken" not in text
+
+
+def test_observe_stages_skips_markers():
+    from app.core import metrics
+    from app.core.timing import FACES
+
+    before = metrics.STAGE_SECONDS.count(FACES), metrics.BACKEND_SECONDS.total("test-backend")
+    metrics.observe_stages({"decode": 10.0, "upload": 30.0, FACES: 3}, "test-backend")
+    assert metrics.STAGE_SECONDS.count(FACES) == before[0]
+    assert metrics.BACKEND_SECONDS.total("test-backend") - before[1] == 0.01
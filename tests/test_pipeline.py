@@ -0,0 +1,109 @@
+import threading
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.core.codecs import decode_image  # noqa: E402
+from app.services.pipeline import LocalRenderer, render  # noqa: E402
+from app.core.codecs import encode_image  # noqa: E402
+from tests.fakes import png_bytes  # noqa: E402
+
+
+class _Engine:
+    """
+    Identity engine that records which path render() took.
+    """
+
+    def __init__(self, device):
+        self.device = torch.device(device)
+        self.paths = []
+
+    def enhance_array(self, img, preset="full", timings=None):
+        self.paths.append("array")
+        return img
+
+    def enhance_tensor(self, img, preset="full", timings=None):
+        self.paths.append("tensor")
+        # Stays on the CPU: only the device *type* decides the path
+        return torch.from_numpy(img[:, :, ::-1].copy()).permute(2, 0, 1).float() / 255.0
+
+    def warm_up_faces(self):
+        self.paths.append("faces")
+
+    def fingerprint(self):
+        return {"engine": 1}
+
+
+def test_cpu_engine_uses_lookup_table_look():
+    engine = _Engine("cpu")
+    out = decode_image(render(engine, png_bytes(24, 20), ".png"))
+    assert engine.paths == ["array"]
+    assert out.shape == (24, 20, 3)
+
+
+def test_accelerator_engine_keeps_tensor_until_encode():
+    engine = _Engine("cuda")
+    data = png_bytes(24, 20)
+    out = decode_image(render(engine, data, ".png"))
+    assert engine.paths == ["tensor"]
+
+    cpu = decode_image(render(_Engine("cpu"), data, ".png"))
+    assert np.abs(out.astype(np.int16) - cpu.astype(np.int16)).max() <= 6
+
+
+def test_render_records_stage_timings():
+    timings = {}
+    render(_Engine("cpu"), png_bytes(24, 20), ".png", timings=timings)
+    assert set(timings) == {"decode", "magazine_look", "encode"}
+    assert all(ms >= 0 for ms in timings.values())
+
+
+def test_local_renderer_loads_and_warms_up_in_the_background():
+    release = threading.Event()
+    engine = _Engine("cpu")
+
+    def load():
+        release.wait(5)
+        return engine
+
+    renderer = LocalRenderer(load=load, warmup_sizes=[32, 48])
+    assert not renderer.ready
+    assert renderer.readiness()["ready"] is False
+    assert renderer.stats() == {"mode": "in_process", "ready": False}
+
+    release.set()
+    # An early caller waits for the load instead of failing
+    out = decode_image(renderer.render(png_bytes(24, 20), ".png"))
+    assert out.shape == (24, 20, 3)
+    assert renderer.ready
+    # Warm-up ran before the real render: one face pass, one page per size
+    assert engine.paths == ["faces", "array", "array", "array"]
+    status = renderer.readiness()
+    assert status["device"] == "cpu" and status["warmup_seconds"] is not None
+    assert status["threads"]["planned"] is None
+
+
+def test_local_renderer_reports_a_failed_load():
+    def load():
+        raise OSError("weights/GFPGANv1.4.pth missing")
+
+    renderer = LocalRenderer(load=load)
+    with pytest.raises(RuntimeError, match="GFPGANv1.4.pth"):
+        renderer.render(png_bytes(8, 8), ".png")
+    assert not renderer.ready
+    assert "OSError" in renderer.readiness()["error"]
+
+
+def test_large_jpeg_is_decoded_at_reduced_size():
+    class Shrinking(_Engine):
+        def decode_size(self, height, width, preset="full"):
+            return height // 3, width // 3
+
+    engine = Shrinking("cpu")
+    page = np.random.default_rng(0).integers(0, 256, size=(240, 160, 3), dtype=np.uint8)
+    # Halving still covers a third of the size, quartering would not
+    assert decode_image(render(engine, encode_image(page, ".jpg"), ".png")).shape == (120, 80, 3)
+    # Only JPEGs can be decoded at reduced size
+    assert decode_image(render(engine, encode_image(page, ".png"), ".png")).shape == (240, 160, 3)
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+cv2 = pytest.importorskip("cv2")
+
+from app.core.codecs import decode_image  # noqa: E402
+from app.services.jobs import JobManager  # noqa: E402
+from app.services.preview import PreviewEngine, PreviewLane, build_preview_model  # noqa: E402
+from tests.fakes import FakePreviewEngine, png_bytes  # noqa: E402
+
+
+def _wait(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def _blocked_job(jobs):
+    release = threading.Event()
+    job = jobs.submit(lambda: release.wait(5) and {"done": True})
+    return job, release
+
+
+def test_preview_is_rendered_then_dropped_when_the_job_finishes():
+    jobs = JobManager(max_workers=2)
+    lane = PreviewLane(FakePreviewEngine)
+    job, release = _blocked_job(jobs)
+
+    preview = lane.submit(job, b"data")
+    _wait(lambda: preview.status == "ready")
+    assert preview.image == b"preview"
+    # A second upload sharing the job gets the same preview
+    assert lane.submit(job, b"data") is preview
+
+    release.set()
+    job.future.result(timeout=5)
+    _wait(lambda: lane.get(job.id) is None)
+    assert lane.stats()["rendered"] == 1
+    lane.shutdown()
+    jobs.shutdown()
+
+
+def test_a_full_lane_skips_new_previews():
+    jobs = JobManager(max_workers=4)
+    lane = PreviewLane(lambda: FakePreviewEngine(delay=0.3), max_pending=1)
+    first, release_first = _blocked_job(jobs)
+    second, release_second = _blocked_job(jobs)
+
+    assert lane.submit(first, b"a") is not None
+    assert lane.submit(second, b"b") is None
+    assert lane.stats()["skipped"] == 1
+    for release in (release_first, release_second):
+        release.set()
+    lane.shutdown()
+    jobs.shutdown()
+
+
+def test_finished_jobs_get_no_preview():
+    jobs = JobManager()
+    lane = PreviewLane(FakePreviewEngine)
+    job = jobs.complete({"cached": True})
+    assert lane.submit(job, b"data") is None
+    lane.shutdown()
+
+
+def test_lane_caps_its_threads_before_loading_the_engine():
+    from app.services.threads import plan_layout
+
+    threads, opencv = torch.get_num_threads(), cv2.getNumThreads()
+    seen = {}
+
+    def load():
+        seen.update(intra_op=torch.get_num_threads(), opencv=cv2.getNumThreads())
+        return FakePreviewEngine()
+
+    lane = PreviewLane(load, layout=plan_layout(1, 1, intra_op=1, opencv=1))
+    try:
+        lane._engine.result(timeout=5)
+        assert seen == {"intra_op": 1, "opencv": 1}
+        assert lane.stats()["layout"]["intra_op"] == 1
+    finally:
+        lane.shutdown()
+        torch.set_num_threads(threads)
+        cv2.setNumThreads(opencv)
+
+
+def test_engine_renders_a_small_jpeg_with_the_compact_model(tmp_path):
+    weights = tmp_path / "compact.pth"
+    torch.save({"params": build_preview_model().state_dict()}, weights)
+    engine = PreviewEngine(device="cpu", max_side=64, weights=str(weights))
+    assert engine.model is not None
+
+    timings = {}
+    out = decode_image(engine.render(png_bytes(300, 400), timings))
+    assert out.shape == (48, 64, 3)
+    assert {"decode", "resize", "background", "magazine_look", "encode"} <= set(timings)
+
+
+def test_engine_without_weights_upscales_bicubically(tmp_path):
+    engine = PreviewEngine(device="cpu", max_side=32, weights=str(tmp_path / "missing.pth"))
+    assert engine.model is None
+    assert decode_image(engine.render(png_bytes(20, 40))).shape == (16, 32, 3)
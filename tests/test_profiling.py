@@ -0,0 +1,93 @@
+import os
+import time
+import zipfile
+
+import pytest
+
+from app.services.profiling import Profiler, ProfilerBusyError, StackSampler, capture
+
+
+def test_nothing_is_claimed_until_armed(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    assert profiler.claim("abc") is None
+
+    session = profiler.arm(requests=2)
+    with pytest.raises(ProfilerBusyError):
+        profiler.arm()
+
+    first = profiler.claim("abc")
+    assert first.index == 0 and first.directory.endswith("000_abc")
+    assert profiler.claim("def") is None  # one capture at a time
+    profiler.finish(first, 0.5)
+
+    second = profiler.claim("def")
+    profiler.finish(second, 0.25, error="boom")
+    assert profiler.claim("ghi") is None  # both requests captured: disarmed
+
+    status = profiler.status(session["session_id"])
+    assert status["captured"] == 2 and status["remaining"] == 0
+    assert status["finished_at"] is not None
+    assert status["captures"][1]["error"] == "boom"
+    profiler.arm()  # a new session can start
+
+
+def test_archive_zips_every_capture(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    session_id = profiler.arm(requests=1)["session_id"]
+    assert profiler.archive(session_id) is None
+
+    slot = profiler.claim("abc")
+    os.makedirs(slot.directory)
+    with open(os.path.join(slot.directory, "stacks.collapsed"), "w") as f:
+        f.write("request;main 3\n")
+    profiler.finish(slot, 0.1)
+
+    with zipfile.ZipFile(profiler.archive(session_id)) as bundle:
+        assert bundle.namelist() == ["000_abc/stacks.collapsed"]
+
+
+def test_disarm_stops_further_captures(tmp_path):
+    profiler = Profiler(str(tmp_path))
+    session_id = profiler.arm(requests=5)["session_id"]
+    assert profiler.disarm(session_id)["remaining"] == 0
+    assert profiler.claim("abc") is None
+    assert profiler.disarm("unknown") is None
+
+
+def _busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_stack_sampler_records_the_calling_thread(tmp_path):
+    sampler = StackSampler(0.002)
+    sampler.start()
+    _busy_wait(0.1)
+    sampler.stop()
+
+    assert sampler.samples > 0
+    assert any(stack.startswith("request;") and "_busy_wait" in stack for stack in sampler.stacks)
+    path = str(tmp_path / "stacks.collapsed")
+    sampler.write(path)
+    with open(path) as f:
+        line = f.readline()
+    assert line.rsplit(" ", 1)[1].strip().isdigit()
+
+
+def test_capture_writes_trace_stacks_and_operator_table(tmp_path):
+    torch = pytest.importorskip("torch")
+
+    profiler = Profiler(str(tmp_path))
+    profiler.arm(requests=1)
+    slot = profiler.claim("conv")
+    conv = torch.nn.Conv2d(3, 8, 3)
+    with capture(slot):
+        with torch.no_grad():
+            for _ in range(3):
+                conv(torch.rand(1, 3, 64, 64))
+        _busy_wait(0.02)
+
+    assert sorted(os.listdir(slot.directory)) == ["ops.txt", "stacks.collapsed", "trace.json"]
+    with open(os.path.join(slot.directory, "ops.txt")) as f:
+        assert "conv" in f.read()
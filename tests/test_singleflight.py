@@ -0,0 +1,82 @@
+import threading
+from concurrent.futures import Future
+
+from app.services.singleflight import SingleFlight
+
+
+class _Handle:
+    def __init__(self):
+        self.future = Future()
+
+
+def test_second_caller_shares_the_running_handle():
+    flight = SingleFlight()
+    started = []
+
+    def start():
+        handle = _Handle()
+        started.append(handle)
+        return handle
+
+    first, shared_first = flight.do("k", start)
+    second, shared_second = flight.do("k", start)
+    assert first is second
+    assert (shared_first, shared_second) == (False, True)
+    assert len(started) == 1
+    assert flight.stats() == {"in_flight": 1, "leaders": 1, "coalesced": 1}
+
+
+def test_join_attaches_only_to_running_work():
+    flight = SingleFlight()
+    assert flight.join("k") is None
+    handle, _ = flight.do("k", _Handle)
+    assert flight.join("k") is handle
+    assert flight.stats() == {"in_flight": 1, "leaders": 1, "coalesced": 1}
+    handle.future.set_result(None)
+    assert flight.join("k") is None
+
+
+def test_key_is_released_when_the_work_finishes():
+    flight = SingleFlight()
+    first, _ = flight.do("k", _Handle)
+    first.future.set_result("done")
+    second, shared = flight.do("k", _Handle)
+    assert second is not first
+    assert shared is False
+
+
+def test_failed_work_is_released_too():
+    flight = SingleFlight()
+    first, _ = flight.do("k", _Handle)
+    first.future.set_exception(RuntimeError("boom"))
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_different_keys_do_not_coalesce():
+    flight = SingleFlight()
+    a, _ = flight.do("a", _Handle)
+    b, _ = flight.do("b", _Handle)
+    assert a is not b
+
+
+def test_concurrent_callers_start_once():
+    flight = SingleFlight()
+    starts = []
+    barrier = threading.Barrier(8)
+    handles = []
+
+    def start():
+        starts.append(1)
+        return _Handle()
+
+    def call():
+        barrier.wait()
+        handles.append(flight.do("k", start)[0])
+
+    threads = [threading.Thread(target=call) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(starts) == 1
+    assert len({id(h) for h in handles}) == 1
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from app.services.threads import (
+    Candidate, _parse_cpu_list, apply_layout, default_candidates, effective_layout, parse_candidates, plan_layout,
+)
+
+# Four physical cores with two hyper-threads each, numbered the way Linux does
+SMT_TOPOLOGY = [(0, 4), (1, 5), (2, 6), (3, 7)]
+
+
+def test_cpu_lists_are_parsed():
+    assert _parse_cpu_list("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert _parse_cpu_list("5") == [5]
+
+
+def test_in_process_layout_splits_opencv_between_images_in_flight():
+    layout = plan_layout(1, 2, topology=SMT_TOPOLOGY)
+    # Physical cores, not hyper-threads
+    assert (layout.cores, layout.intra_op, layout.inter_op, layout.opencv) == (4, 4, 1, 2)
+    assert layout.cpus == (None,)
+
+
+def test_workers_get_disjoint_cores_with_their_hyper_threads():
+    layout = plan_layout(2, 2, pin=True, topology=SMT_TOPOLOGY)
+    assert layout.intra_op == 2 and layout.opencv == 1
+    assert layout.cpus == ((0, 1, 4, 5), (2, 3, 6, 7))
+
+
+def test_explicit_counts_win_and_pinning_wraps_around():
+    layout = plan_layout(3, 1, intra_op=2, inter_op=2, opencv=3, pin=True, topology=SMT_TOPOLOGY)
+    assert (layout.intra_op, layout.inter_op, layout.opencv) == (2, 2, 3)
+    assert layout.cpus[2] == (0, 1, 4, 5)
+
+
+def test_core_limit_and_oversubscribed_processes():
+    assert plan_layout(1, 1, cores=2, topology=SMT_TOPOLOGY).intra_op == 2
+    # More workers than cores still gives every worker a thread
+    assert plan_layout(8, 4, topology=SMT_TOPOLOGY).intra_op == 1
+
+
+def test_layout_serializes_for_the_readiness_payload():
+    layout = plan_layout(2, 1, pin=True, topology=SMT_TOPOLOGY).to_dict()
+    assert layout["cpus"] == [[0, 1, 4, 5], [2, 3, 6, 7]]
+    assert layout["processes"] == 2
+
+
+def test_candidates():
+    assert parse_candidates("0x2, 2x2x4") == [Candidate(0, 2, 0), Candidate(2, 2, 4)]
+    with pytest.raises(ValueError):
+        parse_candidates("2")
+    workers = [c.workers for c in default_candidates(8)]
+    assert workers == [0, 0, 0, 2, 4]
+    assert [c.workers for c in default_candidates(2)] == [0, 0, 0]
+
+
+def test_effective_layout_reports_this_process():
+    effective = effective_layout()
+    assert effective["pid"] == os.getpid()
+    assert effective["cpus"]
+
+
+def test_apply_layout_sets_torch_and_opencv_threads():
+    torch = pytest.importorskip("torch")
+    cv2 = pytest.importorskip("cv2")
+    before = torch.get_num_threads(), cv2.getNumThreads()
+    try:
+        apply_layout(plan_layout(1, 2, intra_op=2, opencv=1, inter_op=torch.get_num_interop_threads()))
+        assert torch.get_num_threads() == 2
+        assert cv2.getNumThreads() == 1
+    finally:
+        torch.set_num_threads(before[0])
+        cv2.setNumThreads(before[1])
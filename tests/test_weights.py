@@ -0,0 +1,85 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.services import ai_engine  # noqa: E402
+from app.services.weights import assign_state, convert, is_mapped, load_weights, mapped_path  # noqa: E402
+
+
+class _Net(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(3, 4, 3, padding=1)
+        self.norm = torch.nn.BatchNorm2d(4)
+
+    def forward(self, x):
+        return self.norm(self.conv(x))
+
+
+def _checkpoint(tmp_path, net):
+    # basicsr layout: the released weights live under params_ema
+    path = tmp_path / "net.pth"
+    torch.save({"params_ema": net.state_dict(), "params": {}}, path)
+    return str(path)
+
+
+def test_converted_weights_load_as_mapped_views(tmp_path):
+    source = _Net().eval()
+    path = _checkpoint(tmp_path, source)
+    assert convert(path) == mapped_path(path)
+
+    net = _Net().eval()
+    assert load_weights(net, path) == mapped_path(path)
+    for name, tensor in net.state_dict().items():
+        assert torch.equal(tensor, source.state_dict()[name])
+        assert is_mapped(tensor)
+
+    x = torch.rand(1, 3, 8, 8)
+    with torch.no_grad():
+        assert torch.equal(net(x), source(x))
+
+
+def test_checkpoint_is_loaded_without_a_converted_file(tmp_path):
+    source = _Net()
+    path = _checkpoint(tmp_path, source)
+
+    net = _Net()
+    assert load_weights(net, path) == path
+    assert torch.equal(net.conv.weight, source.conv.weight)
+    assert not is_mapped(net.conv.weight)
+
+
+def test_stale_converted_file_is_ignored(tmp_path):
+    import os
+
+    path = _checkpoint(tmp_path, _Net())
+    convert(path)
+    # A new checkpoint dropped in without re-converting
+    replacement = _Net()
+    torch.save({"params_ema": replacement.state_dict()}, path)
+    stamp = os.path.getmtime(mapped_path(path)) + 10
+    os.utime(path, (stamp, stamp))
+
+    net = _Net()
+    assert load_weights(net, path) == path
+    assert torch.equal(net.conv.weight, replacement.conv.weight)
+    assert ai_engine.weights_id(path) != ai_engine.source_digest(mapped_path(path))
+
+
+def test_mismatched_weights_are_rejected(tmp_path):
+    net = _Net()
+    state = dict(net.state_dict())
+    del state["conv.bias"]
+    with pytest.raises(RuntimeError, match="conv.bias"):
+        assign_state(_Net(), state)
+
+    state = dict(net.state_dict(), **{"conv.weight": torch.zeros(4, 3, 5, 5)})
+    with pytest.raises(RuntimeError, match="shape"):
+        assign_state(_Net(), state)
+
+
+def test_converted_file_keeps_the_checkpoint_identity(tmp_path):
+    path = _checkpoint(tmp_path, _Net())
+    before = ai_engine.weights_id(path)
+    convert(path)
+    assert ai_engine.weights_id(path) == before
@@ -0,0 +1,182 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("torch")
+cv2 = pytest.importorskip("cv2")
+
+from app.services.workers import WorkerError, WorkerPool  # noqa: E402
+from tests.fakes import CRASH_HEIGHT, ERROR_HEIGHT, SLOW_HEIGHT, FakeEngine, png_bytes  # noqa: E402
+
+FAKE_ENGINE = "tests.fakes:FakeEngine"
+
+
+def _wait_ready(pool, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while not pool.ready:
+        assert time.monotonic() < deadline, "worker pool did not start"
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(2, threads_per_worker=1, pin_cpus=False, task_timeout=10.0, engine=FAKE_ENGINE)
+    _wait_ready(pool)
+    yield pool
+    pool.shutdown()
+
+
+def test_render_round_trip(pool):
+    output = pool.render(png_bytes(), ".png")
+    img = cv2.imdecode(__import__("numpy").frombuffer(output, "uint8"), cv2.IMREAD_COLOR)
+    assert img.shape == (16, 16, 3)
+    assert pool.stats()["completed"] == 1
+
+
+def test_workers_report_their_thread_layout(pool):
+    threads = pool.readiness()["threads"]
+    assert threads["planned"]["processes"] == 2 and threads["planned"]["intra_op"] == 1
+    assert len(threads["processes"]) == 2
+    for worker in threads["processes"]:
+        assert worker["pid"] != os.getpid()
+        assert worker["intra_op"] == 1 and worker["inter_op"] == 1
+
+
+def test_stage_timings_come_back_from_the_worker(pool):
+    timings = {}
+    pool.render(png_bytes(), ".png", preset="fast", timings=timings)
+    assert {"decode", "magazine_look", "encode"} <= set(timings)
+
+
+def test_failed_task_is_routed_to_its_caller(pool):
+    with pytest.raises(WorkerError, match="bad input"):
+        pool.render(png_bytes(height=ERROR_HEIGHT), ".png")
+    # The worker survives a Python exception and keeps serving
+    assert pool.render(png_bytes(), ".png")
+
+
+def test_crashed_worker_fails_its_task_and_is_restarted(pool):
+    with pytest.raises(WorkerError, match="died"):
+        pool.render(png_bytes(height=CRASH_HEIGHT), ".png")
+
+    deadline = time.monotonic() + 10
+    while pool.stats()["restarts"] < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert pool.render(png_bytes(), ".png")
+
+
+def test_killed_worker_is_not_counted_warm(pool):
+    import signal
+
+    victim = sorted(pool._warm)[0]
+    os.kill(victim, signal.SIGKILL)
+    deadline = time.monotonic() + 10
+    while pool.stats()["restarts"] < 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert victim not in pool._warm
+    _wait_ready(pool)
+    assert set(pool._warm) == set(pool.worker_pids())
+
+    # Between a death and the replacement's warm-up the pool is not ready; report
+    # a death the zygote will not replace so that window stays open
+    from app.services.workers import _DIED
+    pool._results.put((_DIED, None, sorted(pool._warm)[0]))
+    deadline = time.monotonic() + 10
+    while pool.stats()["restarts"] < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.05)
+    assert not pool.ready
+    assert pool.readiness()["warm_workers"] == 1
+
+
+def test_all_workers_crashing_is_not_mistaken_for_shutdown(pool):
+    futures = [pool.submit(png_bytes(height=CRASH_HEIGHT, seed=i), ".png") for i in range(2)]
+    for future in futures:
+        with pytest.raises(WorkerError):
+            future.result(timeout=20)
+    assert pool.render(png_bytes(), ".png")
+
+
+def test_stuck_task_times_out():
+    pool = WorkerPool(1, threads_per_worker=1, pin_cpus=False, task_timeout=1.0, engine=FAKE_ENGINE)
+    try:
+        _wait_ready(pool)
+        with pytest.raises(WorkerError, match="timed out"):
+            pool.render(png_bytes(height=SLOW_HEIGHT), ".png")
+        assert pool.stats()["timed_out"] == 1
+    finally:
+        pool._zygote.kill()
+
+
+def test_workers_exit_when_the_zygote_is_killed():
+    psutil = pytest.importorskip("psutil")
+    pool = WorkerPool(1, threads_per_worker=1, pin_cpus=False, engine=FAKE_ENGINE)
+    _wait_ready(pool)
+    pool.submit(png_bytes(height=SLOW_HEIGHT), ".png")
+    # READY is reported before the workers are forked; wait for the claim
+    deadline = time.monotonic() + 30
+    while not pool._claims:
+        assert time.monotonic() < deadline, "task was never claimed"
+        time.sleep(0.05)
+    workers = [p for p in psutil.Process(pool._zygote.pid).children() if p.name() != "resource_tracker"]
+    assert workers
+
+    # SIGKILL skips the zygote's own cleanup, so its busy worker must notice by itself
+    pool._zygote.kill()
+    _, alive = psutil.wait_procs(workers, timeout=10)
+    assert not alive
+
+
+def _shm_usage(pid: int):
+    """
+    (resident, private) bytes of the process's torch shared-memory mappings.
+    """
+    resident = private = 0
+    in_shm = False
+    with open(f"/proc/{pid}/smaps") as f:
+        for line in f:
+            fields = line.split()
+            if "-" in fields[0] and not fields[0].endswith(":"):
+                in_shm = "torch_" in line
+            elif in_shm and fields[0] == "Rss:":
+                resident += int(fields[1]) * 1024
+            elif in_shm and fields[0] in ("Private_Clean:", "Private_Dirty:"):
+                private += int(fields[1]) * 1024
+    return resident, private
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/smaps"), reason="needs Linux /proc smaps")
+def test_workers_share_the_weights(pool):
+    psutil = pytest.importorskip("psutil")
+    # Each render reads all 64 MB of "weights", like a forward pass would
+    for seed in range(4):
+        pool.render(png_bytes(seed=seed), ".png")
+
+    workers = [p for p in psutil.Process(pool._zygote.pid).children() if p.name() != "resource_tracker"]
+    assert len(workers) == 2
+    for worker in workers:
+        resident, private = _shm_usage(worker.pid)
+        # The weights are mapped from shared memory, not copied into each worker
+        assert resident >= FakeEngine.WEIGHT_BYTES / 2
+        assert private < FakeEngine.WEIGHT_BYTES / 4
+
+
+@pytest.mark.skipif((os.cpu_count() or 1) < 2, reason="needs at least 2 cores")
+def test_throughput_scales_with_workers():
+    def images_per_second(num_workers):
+        pool = WorkerPool(num_workers, threads_per_worker=1, pin_cpus=True, engine=FAKE_ENGINE)
+        try:
+            _wait_ready(pool)
+            pool.render(png_bytes(), ".png")  # warm up every import
+            started = time.monotonic()
+            futures = [pool.submit(png_bytes(256, 256, seed=i), ".png") for i in range(16)]
+            for future in futures:
+                future.result(timeout=60)
+            return 16 / (time.monotonic() - started)
+        finally:
+            pool.shutdown()
+
+    assert images_per_second(2) > 1.4 * images_per_second(1)